@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Write synthetic GeoLite2 Country and City locations at any scale.
+
+The files follow the layout of the MaxMind GeoLite2 CSV files bundled with
+codenerix_geodata and are named the same way, so a directory of them can be
+imported with "populate_geodata --source DIRECTORY". Proportions follow the
+bundled dataset: about one region every 30 cities and one province every
+115, a country level line per country, names with accents and quotes and
+some names missing outside English.
+
+    python benchmarks/generate_geodata.py /tmp/geodata --cities 100000 \\
+        --languages 5
+"""
+
+import argparse
+import bz2
+import csv
+import random
+import string
+import zlib
+from os import makedirs
+from os.path import join
+
+# MaxMind locales, the language of each one names its LANGUAGES_DATABASES
+LOCALES = ("en", "es", "fr", "de", "pt-BR", "ja", "ru", "zh-CN", "it", "nl")
+
+CONTINENTS = (
+    ("AF", "Africa"),
+    ("AN", "Antarctica"),
+    ("AS", "Asia"),
+    ("EU", "Europe"),
+    ("NA", "North America"),
+    ("OC", "Oceania"),
+    ("SA", "South America"),
+)
+
+COUNTRY_HEADER = (
+    "geoname_id",
+    "locale_code",
+    "continent_code",
+    "continent_name",
+    "country_iso_code",
+    "country_name",
+)
+
+CITY_HEADER = COUNTRY_HEADER + (
+    "subdivision_1_iso_code",
+    "subdivision_1_name",
+    "subdivision_2_iso_code",
+    "subdivision_2_name",
+    "city_name",
+    "metro_code",
+    "time_zone",
+)
+
+SYLLABLES = (
+    "ba ca da el fa go ha in ja ka lo ma na or pa qu ra sa ta ur va wa xi yo "
+    "za ña çu lé mö sà tø vî"
+).split()
+
+CODE = string.ascii_uppercase + string.digits
+
+
+def locales(languages):
+    """Return the first "languages" locales, English always comes first"""
+    if not 1 <= languages <= len(LOCALES):
+        raise ValueError(
+            "Between 1 and {} languages can be generated".format(len(LOCALES))
+        )
+    return LOCALES[:languages]
+
+
+def word(rnd, syllables=3):
+    return "".join(rnd.choice(SYLLABLES) for _ in range(syllables)).title()
+
+
+def translate(name, locale):
+    """Most places share their name across languages, some are translated
+    and a few are only named in English. The same name always gets the same
+    translation, whatever line it is found on"""
+    if locale == "en":
+        return name
+    draw = zlib.crc32("{}|{}".format(name, locale).encode("utf-8")) / 2**32
+    if draw < 0.03:
+        return ""
+    if draw < 0.25:
+        return "{} ({})".format(name, locale)
+    return name
+
+
+def code(number, width):
+    text = ""
+    for _ in range(width):
+        number, digit = divmod(number, len(CODE))
+        text = CODE[digit] + text
+    return text
+
+
+class World(object):
+    """Deterministic places shared by every locale of one dataset"""
+
+    def __init__(self, cities, seed=0):
+        rnd = random.Random(seed)
+        self.cities = cities
+        self.seed = seed
+
+        # Up to 676 two letter country codes, ~250 as in the real dataset
+        total = max(20, min(250, cities // 40))
+        codes = [
+            a + b
+            for a in string.ascii_uppercase
+            for b in string.ascii_uppercase
+        ]
+        rnd.shuffle(codes)
+        self.countries = []
+        for index, country_code in enumerate(sorted(codes[:total])):
+            continent_code = CONTINENTS[index % len(CONTINENTS)][0]
+            zones = [
+                "{}/{}".format(
+                    dict(CONTINENTS)[continent_code].replace(" ", "_"),
+                    word(rnd, 2) + "_" + str(index * 3 + zone),
+                )
+                for zone in range(rnd.randint(1, 3))
+            ]
+            self.countries.append(
+                (
+                    1000000 + index,
+                    continent_code,
+                    country_code,
+                    word(rnd),
+                    zones,
+                )
+            )
+
+        # Regions and provinces with codes unique inside their country
+        regions = max(1, cities // 30)
+        self.regions = {}
+        for number in range(regions):
+            country = self.countries[number % total]
+            width = 3 if regions // total >= len(CODE) ** 2 else 2
+            region_code = code(number // total, width)
+            provinces = []
+            if rnd.random() < 0.25:
+                for province in range(rnd.randint(1, 6)):
+                    provinces.append(
+                        (code(number // total * 8 + province, 3), word(rnd))
+                    )
+            self.regions.setdefault(country[2], []).append(
+                (region_code, word(rnd), provinces)
+            )
+
+    def city_rows(self):
+        """Yield (geoname id, country, region, province, name, time zone),
+        region and province are (code, name) pairs or None"""
+        rnd = random.Random(self.seed + 1)
+        for number in range(self.cities):
+            country = rnd.choice(self.countries)
+            region = province = None
+            regions = self.regions.get(country[2])
+            if regions and rnd.random() < 0.95:
+                region_code, region_name, provinces = rnd.choice(regions)
+                region = (region_code, region_name)
+                if provinces and rnd.random() < 0.7:
+                    province = rnd.choice(provinces)
+            name = word(rnd, rnd.randint(2, 4))
+            if rnd.random() < 0.01:
+                name = '{}, "{}"'.format(name, word(rnd, 2))
+            yield (
+                2000000 + number,
+                country,
+                region,
+                province,
+                name,
+                rnd.choice(country[4]),
+            )
+
+
+def write_csv(filename, header, rows):
+    with bz2.open(filename, "wt", encoding="utf-8", newline="") as stream:
+        writer = csv.writer(stream, lineterminator="\n")
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def generate(path, cities, languages=2, seed=0):
+    """Write the Country and City locations of every locale into "path",
+    return the paths written"""
+    makedirs(path, exist_ok=True)
+    world = World(cities, seed)
+    continents = dict(CONTINENTS)
+    written = []
+    for locale in locales(languages):
+        countries = {}
+        rows = []
+        for geoid, continent_code, country_code, name, _ in world.countries:
+            countries[country_code] = translate(name, locale) or name
+            rows.append(
+                (
+                    geoid,
+                    locale,
+                    continent_code,
+                    translate(continents[continent_code], locale)
+                    or continents[continent_code],
+                    country_code,
+                    countries[country_code],
+                )
+            )
+        filename = join(
+            path, "GeoLite2-Country-Locations-{}.csv.bz2".format(locale)
+        )
+        write_csv(filename, COUNTRY_HEADER, rows)
+        written.append(filename)
+
+        def city_lines():
+            # Country level lines carry no subdivision nor city
+            for (
+                geoid,
+                continent_code,
+                country_code,
+                _,
+                zones,
+            ) in world.countries:
+                yield (
+                    geoid,
+                    locale,
+                    continent_code,
+                    continents[continent_code],
+                    country_code,
+                    countries[country_code],
+                    "",
+                    "",
+                    "",
+                    "",
+                    "",
+                    "",
+                    zones[0],
+                )
+            for (
+                geoid,
+                country,
+                region,
+                province,
+                name,
+                zone,
+            ) in world.city_rows():
+                yield (
+                    geoid,
+                    locale,
+                    country[1],
+                    continents[country[1]],
+                    country[2],
+                    countries[country[2]],
+                    region[0] if region else "",
+                    translate(region[1], locale) if region else "",
+                    province[0] if province else "",
+                    translate(province[1], locale) if province else "",
+                    translate(name, locale),
+                    "",
+                    zone,
+                )
+
+        filename = join(
+            path, "GeoLite2-City-Locations-{}.csv.bz2".format(locale)
+        )
+        write_csv(filename, CITY_HEADER, city_lines())
+        written.append(filename)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("path", help="Directory to write the data files to")
+    parser.add_argument(
+        "--cities", type=int, default=10000, help="Number of cities"
+    )
+    parser.add_argument(
+        "--languages",
+        type=int,
+        default=2,
+        help="Number of locales, up to {}".format(len(LOCALES)),
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args()
+    for filename in generate(
+        options.path, options.cities, options.languages, options.seed
+    ):
+        print(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Time populate_geodata on synthetic datasets of growing size.
+
+Every case imports the data written by generate_geodata.py into a new
+SQLite database, in its own process, with LANGUAGES_DATABASES set to the
+generated languages. The populate_geodata --report of every case (time,
+rows, SQL queries and traced memory of each phase) is collected with the
+maximum resident memory of the process into one JSON document:
+
+    python benchmarks/run_benchmarks.py --cities 10000,100000,500000 \\
+        --languages 2,5 --output results.json
+
+Compare a run with a previous one to catch scaling regressions, the
+command exits with status 1 when a case got slower, ran more queries or
+used more memory than the tolerance allows:
+
+    python benchmarks/run_benchmarks.py --baseline results.json
+
+Memory is traced with tracemalloc, which slows the import down, so the
+times are meant to be compared between runs, not with production imports.
+"""
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import abspath, dirname, exists, join
+
+from generate_geodata import LOCALES, generate, locales
+
+# Compared with --baseline, the worse the higher
+METRICS = ("seconds", "queries", "peak_memory", "max_rss")
+
+
+def run_case(data_path, database, report, languages, arguments):
+    """Import "data_path" into the SQLite file "database", runs in the
+    process started by run() for one case"""
+    import resource
+
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    codes = [locale.split("-")[0].upper() for locale in locales(languages)]
+    settings.configure(
+        SECRET_KEY="benchmark",
+        INSTALLED_APPS=[
+            "django.contrib.contenttypes",
+            "django.contrib.auth",
+            "django.contrib.admin",
+            "django.contrib.sessions",
+            "django.contrib.messages",
+            "codenerix",
+            "codenerix_extensions",
+            "codenerix_geodata",
+        ],
+        DATABASES={
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": database,
+            }
+        },
+        LANGUAGES_DATABASES=codes,
+        LANGUAGES=[(code.lower(), code) for code in codes],
+        USE_TZ=True,
+        DEFAULT_AUTO_FIELD="django.db.models.AutoField",
+        # Migrations only create the ES and EN names, build every table of
+        # the generated languages straight from the models
+        MIGRATION_MODULES={"codenerix_geodata": None},
+        SILENCED_SYSTEM_CHECKS=["admin.E403", "admin.E408", "admin.E409"],
+    )
+    django.setup()
+    call_command("migrate", run_syncdb=True, verbosity=0)
+    call_command(
+        "populate_geodata",
+        "--source",
+        data_path,
+        "--report",
+        report,
+        *arguments
+    )
+
+    with open(report) as stream:
+        document = json.load(stream)
+    # Bytes, like the traced peak_memory (ru_maxrss is in KiB on Linux)
+    document["max_rss"] = (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    )
+    with open(report, "w") as stream:
+        json.dump(document, stream, indent=2)
+
+
+def run(cities, languages, workdir, arguments, verbose=False):
+    """Generate the data of one case if missing, import it in a new
+    process and return its results"""
+    data_path = join(workdir, "data-{}-{}".format(cities, languages))
+    if not exists(data_path):
+        started = time.time()
+        generate(data_path, cities, languages)
+        print(
+            "    generated {} cities in {} languages in {:.1f}s".format(
+                cities, languages, time.time() - started
+            )
+        )
+    database = join(workdir, "db-{}-{}.sqlite3".format(cities, languages))
+    report = join(workdir, "report-{}-{}.json".format(cities, languages))
+    for filename in (database, report):
+        if exists(filename):
+            os.remove(filename)
+
+    process = subprocess.run(
+        [
+            sys.executable,
+            abspath(__file__),
+            "--case",
+            data_path,
+            database,
+            report,
+            str(languages),
+            "--",
+        ]
+        + arguments,
+        stdout=None if verbose else subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        env=dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join(
+                [dirname(dirname(abspath(__file__)))]
+                + [path for path in [os.environ.get("PYTHONPATH")] if path]
+            ),
+        ),
+    )
+    if process.returncode:
+        raise RuntimeError(
+            "Case {} cities, {} languages failed:\n{}".format(
+                cities, languages, process.stderr
+            )
+        )
+    with open(report) as stream:
+        document = json.load(stream)
+    return {
+        "cities": cities,
+        "languages": languages,
+        "seconds": document["seconds"],
+        "rows": document["rows"],
+        "rows_per_second": (
+            document["rows"] / document["seconds"]
+            if document["seconds"]
+            else None
+        ),
+        "queries": document["queries"],
+        "peak_memory": document["peak_memory"],
+        "max_rss": document["max_rss"],
+        "phases": document["phases"],
+    }
+
+
+def megabytes(value):
+    return "{:.1f}".format(value / 1024.0 / 1024.0) if value else "-"
+
+
+def show(result):
+    print(
+        "{cities:>9} {languages:>5} {seconds:>9.2f} {rate:>10} {queries:>9} "
+        "{peak:>9} {rss:>9}".format(
+            cities=result["cities"],
+            languages=result["languages"],
+            seconds=result["seconds"],
+            rate="{:.0f}".format(result["rows_per_second"] or 0),
+            queries=result["queries"],
+            peak=megabytes(result["peak_memory"]),
+            rss=megabytes(result["max_rss"]),
+        )
+    )
+    slowest = sorted(
+        result["phases"], key=lambda phase: phase["seconds"], reverse=True
+    )[:3]
+    for phase in slowest:
+        print(
+            "{:>16} {} {} {}: {:.2f}s, {} rows, {} queries".format(
+                "",
+                phase["phase"],
+                phase["entity"],
+                phase["language"] or "",
+                phase["seconds"],
+                phase["rows"],
+                phase["queries"],
+            )
+        )
+
+
+def regressions(results, baseline, tolerance):
+    """Return a line for every metric of a case worse than in "baseline"
+    by more than "tolerance" (a ratio)"""
+    previous = dict(
+        ((result["cities"], result["languages"]), result)
+        for result in baseline["results"]
+    )
+    found = []
+    for result in results:
+        before = previous.get((result["cities"], result["languages"]))
+        if before is None:
+            continue
+        for metric in METRICS:
+            if not before.get(metric) or result.get(metric) is None:
+                continue
+            ratio = result[metric] / float(before[metric])
+            if ratio > 1 + tolerance:
+                found.append(
+                    "{} cities, {} languages: {} {} -> {} ({:+.0%})".format(
+                        result["cities"],
+                        result["languages"],
+                        metric,
+                        before[metric],
+                        result[metric],
+                        ratio - 1,
+                    )
+                )
+    return found
+
+
+def integers(value):
+    return [int(number) for number in value.split(",") if number]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--case":
+        data_path, database, report, languages = sys.argv[2:6]
+        run_case(data_path, database, report, int(languages), sys.argv[7:])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--cities",
+        type=integers,
+        default=[10000, 100000],
+        help="Comma separated dataset sizes (default: 10000,100000)",
+    )
+    parser.add_argument(
+        "--languages",
+        type=integers,
+        default=[2],
+        help="Comma separated numbers of languages, up to {} "
+        "(default: 2)".format(len(LOCALES)),
+    )
+    parser.add_argument(
+        "--populate",
+        default="--bulk",
+        help="Options given to populate_geodata (default: --bulk)",
+    )
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        help="Directory keeping generated data between runs (default: a "
+        "temporary directory)",
+    )
+    parser.add_argument("--output", default=None, help="Write results here")
+    parser.add_argument(
+        "--baseline", default=None, help="Results of a previous run"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Ratio a metric may grow over --baseline (default: 0.25)",
+    )
+    parser.add_argument("--verbose", action="store_true", default=False)
+    options = parser.parse_args()
+
+    workdir = options.workdir or tempfile.mkdtemp(prefix="geodata-bench-")
+    arguments = shlex.split(options.populate)
+    print("Data and databases in {}".format(workdir))
+    print(
+        "{:>9} {:>5} {:>9} {:>10} {:>9} {:>9} {:>9}".format(
+            "cities",
+            "langs",
+            "seconds",
+            "rows/s",
+            "queries",
+            "peak MB",
+            "rss MB",
+        )
+    )
+    results = []
+    for cities in options.cities:
+        for languages in options.languages:
+            result = run(
+                cities, languages, workdir, arguments, options.verbose
+            )
+            show(result)
+            results.append(result)
+
+    document = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "populate": arguments,
+        "results": results,
+    }
+    if options.output:
+        with open(options.output, "w") as stream:
+            json.dump(document, stream, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as stream:
+            baseline = json.load(stream)
+        found = regressions(results, baseline, options.tolerance)
+        for line in found:
+            print("REGRESSION {}".format(line))
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
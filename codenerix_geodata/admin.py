@@ -21,7 +21,7 @@
 from django.conf import settings
 from django.contrib import admin
 
-from .models import Continent, Country, Region, Province, TimeZone, City, MODELS
+from .models import Continent, Country, Region, Province, TimeZone, City, ImportManifest, GeoTranslation, DatasetVersion, MODELS
 
 admin.site.register(Continent)
 admin.site.register(Country)
@@ -29,6 +29,9 @@ admin.site.register(Region)
 admin.site.register(Province)
 admin.site.register(TimeZone)
 admin.site.register(City)
+admin.site.register(ImportManifest)
+admin.site.register(GeoTranslation)
+admin.site.register(DatasetVersion)
 
 for field, model in MODELS:
     for lang_code in settings.LANGUAGES_DATABASES:
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class MyAppConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'codenerix_geodata'
+
+    def ready(self):
+        from codenerix_geodata import gazetteer, translations, trigrams
+        # Cached geodata is loaded again when rows are saved or deleted
+        gazetteer.connect()
+        # Consolidated names and trigrams follow the names saved or deleted
+        translations.connect()
+        trigrams.connect()
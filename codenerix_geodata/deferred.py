@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Secondary indexes and foreign keys of the geodata tables dropped while
+rows are loaded in bulk and built again once at the end.
+
+Primary keys and unique indexes are kept, the import looks rows up through
+them. The statements recreating what was dropped are stored in the import
+manifest (kind "index") before anything is dropped, so an import killed
+halfway leaves enough behind for the next one to restore the schema.
+"""
+
+import abc
+import hashlib
+
+from django.db import connection, transaction
+
+from codenerix_geodata.models import ImportManifest
+
+KIND = "index"
+
+
+class DeferredIndexes(abc.ABC):
+    vendor = None
+
+    def __init__(self, models):
+        self.tables = [model._meta.db_table for model in models]
+        # Drop statements of what defer() had to leave in place
+        self.skipped = []
+
+    def quote(self, name):
+        return connection.ops.quote_name(name)
+
+    @abc.abstractmethod
+    def statements(self, cursor):
+        """Return (drop, create) statements of what can be deferred"""
+
+    def pending(self):
+        return ImportManifest.objects.filter(kind=KIND).exists()
+
+    def defer(self):
+        """Drop the secondary indexes and foreign keys, return how many
+
+        Those whose create statement is longer than a manifest key could
+        not be restored after a crash, they are left in place and listed in
+        "skipped".
+        """
+        limit = ImportManifest._meta.get_field("key").max_length
+        self.skipped = []
+        with transaction.atomic(), connection.cursor() as cursor:
+            statements = []
+            for drop, create in self.statements(cursor):
+                if len(create) <= limit:
+                    statements.append((drop, create))
+                else:
+                    self.skipped.append(drop)
+            ImportManifest.objects.bulk_create(
+                [
+                    ImportManifest(
+                        kind=KIND,
+                        key=create,
+                        checksum=hashlib.sha1(
+                            create.encode("utf-8")
+                        ).hexdigest(),
+                        object_id=position,
+                    )
+                    for position, (drop, create) in enumerate(statements)
+                ]
+            )
+            for drop, create in statements:
+                cursor.execute(drop)
+        return len(statements)
+
+    def restore(self):
+        """Build again everything defer() dropped, return how many"""
+        statements = list(
+            ImportManifest.objects.filter(kind=KIND)
+            .order_by("object_id")
+            .values_list("key", flat=True)
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            for create in statements:
+                cursor.execute(create)
+            ImportManifest.objects.filter(kind=KIND).delete()
+        return len(statements)
+
+
+class SQLiteDeferredIndexes(DeferredIndexes):
+    """SQLite can not drop foreign keys, they are not checked while loading
+    and the rows of every geodata table are checked in one pass later"""
+
+    vendor = "sqlite"
+
+    def statements(self, cursor):
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+            "AND tbl_name IN ({}) AND sql LIKE 'CREATE INDEX %%' "
+            "ORDER BY name".format(", ".join(["%s"] * len(self.tables))),
+            self.tables,
+        )
+        return [
+            ("DROP INDEX {}".format(self.quote(name)), sql)
+            for name, sql in cursor.fetchall()
+        ]
+
+    def defer(self):
+        if not connection.disable_constraint_checking():
+            raise RuntimeError("Foreign key checks can not be disabled")
+        try:
+            return super().defer()
+        except Exception:
+            connection.enable_constraint_checking()
+            raise
+
+    def restore(self):
+        restored = super().restore()
+        connection.enable_constraint_checking()
+        connection.check_constraints(table_names=self.tables)
+        return restored
+
+
+class PostgreSQLDeferredIndexes(DeferredIndexes):
+    """Foreign keys are added back with one validating ALTER TABLE each,
+    after the indexes"""
+
+    vendor = "postgresql"
+
+    def statements(self, cursor):
+        cursor.execute(
+            "SELECT i.oid::regclass::text, pg_get_indexdef(i.oid) "
+            "FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid "
+            "WHERE x.indrelid = ANY(%s::regclass[]) "
+            "AND NOT x.indisunique AND NOT x.indisprimary "
+            "ORDER BY 1",
+            [self.tables],
+        )
+        statements = [
+            ("DROP INDEX {}".format(name), sql)
+            for name, sql in cursor.fetchall()
+        ]
+        cursor.execute(
+            "SELECT conrelid::regclass::text, conname, "
+            "pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE contype = 'f' AND conrelid = ANY(%s::regclass[]) "
+            "ORDER BY 1, 2",
+            [self.tables],
+        )
+        for table, name, definition in cursor.fetchall():
+            statements.append(
+                (
+                    "ALTER TABLE {} DROP CONSTRAINT {}".format(
+                        table, self.quote(name)
+                    ),
+                    "ALTER TABLE {} ADD CONSTRAINT {} {}".format(
+                        table, self.quote(name), definition
+                    ),
+                )
+            )
+        return statements
+
+
+DEFERRED_INDEXES = {
+    "sqlite": SQLiteDeferredIndexes,
+    "postgresql": PostgreSQLDeferredIndexes,
+}
+
+
+def get_deferred_indexes(models):
+    """Return the deferred indexes of "models" for the default database"""
+    if connection.vendor not in DEFERRED_INDEXES:
+        raise ValueError(
+            "Deferred indexes are not supported on {} databases".format(
+                connection.vendor
+            )
+        )
+    return DEFERRED_INDEXES[connection.vendor](models)
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process cache of the continents, countries, regions, provinces and
+cities with their names in every language.
+
+The geodata is loaded once per process, about one query per table, and
+answered from memory afterwards:
+
+    from codenerix_geodata import gazetteer
+
+    spain = gazetteer.get(Country, 1)           # Place("country", 1, ...)
+    gazetteer.get("city", 2345, "en").name
+    gazetteer.children(spain)                   # regions, cities without one
+    gazetteer.path(city)                        # continent ... city
+
+Every table is kept in arrays indexed by a slot number: the primary keys,
+the slot of every parent, the children of every row one after another and
+the name in every language. Codes and names are indexes into one pool of
+interned strings, a name shared by many rows or languages is stored once.
+
+The DatasetVersion stamp is bumped by populate_geodata,
+load_geodata_snapshot and once by every transaction saving or deleting
+geodata rows through the ORM (the admin included). The stamp is read again
+once CDNX_GEODATA_GAZETTEER_TTL seconds (5 by default) went by since the
+last read, the data is loaded again when it changed. Changes made by this
+process are seen at once.
+"""
+
+import sys
+import threading
+import time
+from array import array
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from codenerix_extensions.helpers import get_language_database
+from codenerix_geodata.models import MODELS, DatasetVersion
+
+NULL = -1
+
+# Every entity with the fields of its parents, the direct parent of a row
+# is the last one set (a city without province hangs from its region)
+HIERARCHY = (
+    ("continent", ()),
+    ("country", ("continent",)),
+    ("region", ("country",)),
+    ("province", ("region",)),
+    ("city", ("country", "region", "province")),
+)
+ENTITIES = tuple(entity for entity, parents in HIERARCHY)
+
+Place = namedtuple("Place", "entity pk code name")
+
+
+class Table(object):
+    """Rows of one entity, every array is indexed by slot"""
+
+    def __init__(self, entity, parents):
+        self.entity = entity
+        self.parents = parents
+        self.slots = {}
+        self.pks = array("q")
+        self.codes = array("q")
+        # Direct parent as (index in ENTITIES, slot)
+        self.parent_entities = array("b")
+        self.parent_slots = array("q")
+        self.names = {}
+        # Children of slot n are children[first[n]:first[n + 1]]
+        self.first = array("q")
+        self.child_entities = array("b")
+        self.child_slots = array("q")
+
+
+class Gazetteer(object):
+    """Immutable copy of the geodata of one dataset version"""
+
+    def __init__(self, version):
+        self.version = version
+        self.pool = []
+        self.pooled = {}
+        self.tables = {}
+        for entity, parents in HIERARCHY:
+            self.tables[entity] = self.load(entity, parents)
+        self.link()
+        # Only needed while loading
+        del self.pooled
+
+    def intern(self, text):
+        if text is None:
+            return NULL
+        index = self.pooled.get(text)
+        if index is None:
+            index = len(self.pool)
+            self.pool.append(sys.intern(text))
+            self.pooled[text] = index
+        return index
+
+    def load(self, entity, parents):
+        model = apps.get_model("codenerix_geodata", dict(MODELS)[entity])
+        has_code = entity != "city"
+        table = Table(entity, parents)
+        columns = ["pk", "code"] if has_code else ["pk"]
+        columns.extend("{}_id".format(parent) for parent in parents)
+
+        parent_ids = []
+        for row in model.objects.order_by("pk").values_list(*columns):
+            table.slots[row[0]] = len(table.pks)
+            table.pks.append(row[0])
+            table.codes.append(self.intern(row[1]) if has_code else NULL)
+            parent_ids.append(row[len(columns) - len(parents) :])
+
+        # Slot of the direct parent, parents are loaded first
+        for ids in parent_ids:
+            parent = NULL
+            for index in range(len(parents) - 1, -1, -1):
+                if ids[index] is not None:
+                    parent = index
+                    break
+            if parent == NULL:
+                table.parent_entities.append(NULL)
+                table.parent_slots.append(NULL)
+            else:
+                name = parents[parent]
+                table.parent_entities.append(ENTITIES.index(name))
+                table.parent_slots.append(
+                    self.tables[name].slots.get(ids[parent], NULL)
+                )
+
+        for lang in settings.LANGUAGES_DATABASES:
+            source = apps.get_model(
+                "codenerix_geodata",
+                "{}GeoName{}".format(dict(MODELS)[entity], lang),
+            )
+            names = array("q", [NULL]) * len(table.pks)
+            for pk, name in source.objects.values_list(
+                "{}_id".format(entity), "name"
+            ):
+                slot = table.slots.get(pk)
+                if slot is not None:
+                    names[slot] = self.intern(name)
+            table.names[lang.lower()] = names
+        return table
+
+    def link(self):
+        """Fill the children arrays of every table"""
+        found = dict(
+            (entity, [[] for pk in self.tables[entity].pks])
+            for entity in ENTITIES
+        )
+        for position, entity in enumerate(ENTITIES):
+            table = self.tables[entity]
+            for slot in range(len(table.pks)):
+                parent = table.parent_entities[slot]
+                if parent != NULL and table.parent_slots[slot] != NULL:
+                    found[ENTITIES[parent]][table.parent_slots[slot]].append(
+                        (position, slot)
+                    )
+        for entity in ENTITIES:
+            table = self.tables[entity]
+            for children in found[entity]:
+                table.first.append(len(table.child_slots))
+                for position, slot in children:
+                    table.child_entities.append(position)
+                    table.child_slots.append(slot)
+            table.first.append(len(table.child_slots))
+
+    def place(self, entity, slot, lang):
+        table = self.tables[entity]
+        code = table.codes[slot]
+        names = table.names.get(lang)
+        name = names[slot] if names is not None else NULL
+        return Place(
+            entity,
+            table.pks[slot],
+            self.pool[code] if code != NULL else None,
+            self.pool[name] if name != NULL else None,
+        )
+
+    def locate(self, entity, pk):
+        return self.tables[entity].slots.get(pk)
+
+    def get(self, entity, pk, lang):
+        slot = self.locate(entity, pk)
+        if slot is None:
+            return None
+        return self.place(entity, slot, lang)
+
+    def children(self, entity, pk, lang):
+        slot = self.locate(entity, pk)
+        if slot is None:
+            return []
+        table = self.tables[entity]
+        return [
+            self.place(
+                ENTITIES[table.child_entities[index]],
+                table.child_slots[index],
+                lang,
+            )
+            for index in range(table.first[slot], table.first[slot + 1])
+        ]
+
+    def path(self, entity, pk, lang):
+        slot = self.locate(entity, pk)
+        found = []
+        while slot is not None and slot != NULL:
+            found.append(self.place(entity, slot, lang))
+            table = self.tables[entity]
+            parent = table.parent_entities[slot]
+            if parent == NULL:
+                break
+            entity = ENTITIES[parent]
+            slot = table.parent_slots[slot]
+        found.reverse()
+        return found
+
+
+_lock = threading.Lock()
+_local = threading.local()
+_cache = None
+_checked = 0.0
+
+
+def current():
+    """Return the gazetteer of the stored dataset version, loading it when
+    missing or stale"""
+    global _cache, _checked
+    cache = _cache
+    now = time.monotonic()
+    ttl = getattr(settings, "CDNX_GEODATA_GAZETTEER_TTL", 5)
+    if cache is not None and now - _checked < ttl:
+        return cache
+    version = DatasetVersion.objects.current()
+    with _lock:
+        if _cache is None or _cache.version != version:
+            # Read before loading, a change made meanwhile loads it again
+            _cache = Gazetteer(version)
+        _checked = time.monotonic()
+        return _cache
+
+
+def invalidate():
+    """Forget the gazetteer of this process, the next lookup loads it"""
+    global _cache
+    _cache = None
+
+
+def bump_version():
+    """Record that the geodata changed, every process loads it again"""
+    DatasetVersion.objects.bump()
+    invalidate()
+
+
+def identify(value):
+    """Return (entity, pk) of a Place, a model instance or a model"""
+    if isinstance(value, Place):
+        return value.entity, value.pk
+    return value._meta.model_name, value.pk
+
+
+def get(model, pk, lang=None):
+    """Return the Place of a row, None when missing, "model" is a geodata
+    model or its name ("city")"""
+    if not isinstance(model, str):
+        model = model._meta.model_name
+    return current().get(model, pk, lang or get_language_database())
+
+
+def children(parent, lang=None):
+    """Return the Places hanging straight from a Place or model instance"""
+    entity, pk = identify(parent)
+    return current().children(entity, pk, lang or get_language_database())
+
+
+def path(place, lang=None):
+    """Return the Places from the continent down to a Place or model
+    instance, both included"""
+    entity, pk = identify(place)
+    return current().path(entity, pk, lang or get_language_database())
+
+
+@contextmanager
+def suspended():
+    """Do not bump the version on every row saved inside, for bulk changes
+    bumping it once at the end"""
+    _local.suspended = getattr(_local, "suspended", 0) + 1
+    try:
+        yield
+    finally:
+        _local.suspended -= 1
+
+
+def changed(sender, using=None, **kwargs):
+    if getattr(_local, "suspended", 0):
+        return
+    # One bump per transaction however many rows it writes. The callbacks
+    # are looked up instead of keeping a flag, a rollback discards them.
+    connection = transaction.get_connection(using)
+    if connection.in_atomic_block and any(
+        callback[1] is bump_version for callback in connection.run_on_commit
+    ):
+        return
+    transaction.on_commit(bump_version, using=using)
+
+
+def connect():
+    """Bump the version whenever a geodata row is saved or deleted"""
+    for field, model in MODELS:
+        senders = [model] + [
+            "{}GeoName{}".format(model, lang)
+            for lang in settings.LANGUAGES_DATABASES
+        ]
+        for sender in senders:
+            sender = apps.get_model("codenerix_geodata", sender)
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    changed,
+                    sender=sender,
+                    dispatch_uid="geodata_gazetteer_{}".format(
+                        sender._meta.model_name
+                    ),
+                )
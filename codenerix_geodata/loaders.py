@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Backends writing plain rows in bulk into geodata tables.
+
+Rows are tuples whose values follow "columns", a list of field attnames
+(for example "country_id"). Loaders fill the "created" and "updated"
+columns every CodenerixModel has. They do not open transactions, the
+caller decides where they start and end.
+"""
+
+from io import StringIO
+
+from django.db import connection
+from django.utils import timezone
+
+
+class OrmLoader(object):
+    """Write rows through model instances, works on every database"""
+
+    vendor = None
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+
+    def insert(self, model, columns, rows):
+        instances = [model(**dict(zip(columns, row))) for row in rows]
+        model.objects.bulk_create(instances, batch_size=self.batch_size)
+
+    def update(self, model, columns, rows):
+        """The first column of "columns" must be the primary key"""
+        now = timezone.now()
+        instances = []
+        for row in rows:
+            instance = model(**dict(zip(columns, row)))
+            instance.updated = now
+            instances.append(instance)
+        model.objects.bulk_update(
+            instances,
+            list(columns[1:]) + ["updated"],
+            batch_size=self.batch_size,
+        )
+
+
+class SQLLoader(OrmLoader):
+    """Common helpers for loaders writing raw SQL"""
+
+    def table(self, model):
+        return connection.ops.quote_name(model._meta.db_table)
+
+    def column(self, model, name):
+        return connection.ops.quote_name(model._meta.get_field(name).column)
+
+    def now(self):
+        return connection.ops.adapt_datetimefield_value(timezone.now())
+
+
+class SQLiteLoader(SQLLoader):
+    """Write rows with one prepared statement run through executemany"""
+
+    vendor = "sqlite"
+
+    def insert(self, model, columns, rows):
+        now = self.now()
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            self.table(model),
+            ", ".join(
+                [self.column(model, name) for name in columns]
+                + [
+                    self.column(model, "created"),
+                    self.column(model, "updated"),
+                ]
+            ),
+            ", ".join(["%s"] * (len(columns) + 2)),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [tuple(row) + (now, now) for row in rows])
+
+    def update(self, model, columns, rows):
+        now = self.now()
+        sql = "UPDATE {} SET {} WHERE {} = %s".format(
+            self.table(model),
+            ", ".join(
+                "{} = %s".format(self.column(model, name))
+                for name in list(columns[1:]) + ["updated"]
+            ),
+            self.column(model, columns[0]),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                sql, [tuple(row[1:]) + (now, row[0]) for row in rows]
+            )
+
+
+class PostgreSQLLoader(SQLLoader):
+    """Write rows with COPY FROM STDIN into a staging table and merge them
+    into the model table with one statement"""
+
+    vendor = "postgresql"
+    staging = "codenerix_geodata_staging"
+
+    def copy(self, cursor, model, columns, rows):
+        cursor.execute(
+            "CREATE TEMPORARY TABLE {} ON COMMIT DROP AS "
+            "SELECT {} FROM {} WITH NO DATA".format(
+                self.staging,
+                ", ".join(self.column(model, name) for name in columns),
+                self.table(model),
+            )
+        )
+        sql = "COPY {} FROM STDIN".format(self.staging)
+        raw = cursor.cursor
+        if hasattr(raw, "copy"):
+            # psycopg 3
+            with raw.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            # psycopg2
+            buffer = StringIO()
+            for row in rows:
+                buffer.write("\t".join(copy_value(value) for value in row))
+                buffer.write("\n")
+            buffer.seek(0)
+            raw.copy_expert(sql, buffer)
+
+    def insert(self, model, columns, rows):
+        names = ", ".join(self.column(model, name) for name in columns)
+        with connection.cursor() as cursor:
+            self.copy(cursor, model, columns, rows)
+            cursor.execute(
+                "INSERT INTO {} ({}, {}, {}) SELECT {}, %s, %s FROM {}".format(
+                    self.table(model),
+                    names,
+                    self.column(model, "created"),
+                    self.column(model, "updated"),
+                    names,
+                    self.staging,
+                ),
+                [self.now(), self.now()],
+            )
+            cursor.execute("DROP TABLE {}".format(self.staging))
+
+    def update(self, model, columns, rows):
+        pk = self.column(model, columns[0])
+        with connection.cursor() as cursor:
+            self.copy(cursor, model, columns, rows)
+            cursor.execute(
+                "UPDATE {0} SET {1}, {2} = %s FROM {3} "
+                "WHERE {0}.{4} = {3}.{4}".format(
+                    self.table(model),
+                    ", ".join(
+                        "{0} = {1}.{0}".format(
+                            self.column(model, name), self.staging
+                        )
+                        for name in columns[1:]
+                    ),
+                    self.column(model, "updated"),
+                    self.staging,
+                    pk,
+                ),
+                [self.now()],
+            )
+            cursor.execute("DROP TABLE {}".format(self.staging))
+
+
+def copy_value(value):
+    """Format a value for the text format of COPY"""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+LOADERS = {
+    "orm": OrmLoader,
+    "sqlite": SQLiteLoader,
+    "postgresql": PostgreSQLLoader,
+}
+
+
+def get_loader(name="auto", batch_size=1000):
+    """Return the loader called "name", "auto" picks the native one of the
+    default database and falls back to the ORM"""
+    if name == "auto":
+        for loader in LOADERS.values():
+            if loader.vendor == connection.vendor:
+                return loader(batch_size)
+        return OrmLoader(batch_size)
+    if name not in LOADERS:
+        raise ValueError(
+            "Unknown loader '{}', use one of: auto, {}".format(
+                name, ", ".join(sorted(LOADERS))
+            )
+        )
+    loader = LOADERS[name]
+    if loader.vendor not in (None, connection.vendor):
+        raise ValueError(
+            "Loader '{}' can not write into a {} database".format(
+                name, connection.vendor
+            )
+        )
+    return loader(batch_size)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Compile the geodata tables into a binary snapshot.
+
+Run it once after populate_geodata, the snapshot is loaded with
+load_geodata_snapshot on every other environment without parsing the CSV
+data files again.
+"""
+
+import time
+from os.path import getsize
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from codenerix_lib.debugger import Debugger
+from codenerix_geodata import __version__
+from codenerix_geodata.models import City
+from codenerix_geodata.snapshot import (
+    FORMAT_VERSION,
+    snapshot_columns,
+    snapshot_models,
+    write_snapshot,
+)
+
+
+class Command(BaseCommand, Debugger):
+    help = _("Writes the geodata tables into a binary snapshot")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help=_("Snapshot file to write"))
+
+    def handle(self, *args, **options):
+
+        # Autoconfigure Debugger
+        self.set_name("CODENERIX-GEODATA")
+        self.set_debug()
+
+        if not City.objects.exists():
+            raise CommandError(
+                "There are no cities to snapshot, run populate_geodata first"
+            )
+
+        start = time.time()
+        tables = []
+        for model in snapshot_models():
+            columns = snapshot_columns(model)
+            rows = list(
+                model.objects.order_by("pk").values_list(
+                    *[column for column, kind in columns]
+                )
+            )
+            tables.append((model._meta.model_name, columns, rows))
+            self.debug(
+                "    > {}: {} rows".format(model._meta.model_name, len(rows)),
+                color="blue",
+            )
+
+        metadata = {
+            "format": FORMAT_VERSION,
+            "version": __version__,
+            "date": timezone.now().isoformat(),
+            "languages": list(settings.LANGUAGES_DATABASES),
+            "tables": [table[0] for table in tables],
+        }
+        with open(options["path"], "wb") as stream:
+            checksum = write_snapshot(stream, tables, metadata)
+
+        self.debug(
+            "Snapshot {} written: {} bytes in {:.2f}s, sha256 {}".format(
+                options["path"],
+                getsize(options["path"]),
+                time.time() - start,
+                checksum,
+            ),
+            color="green",
+        )
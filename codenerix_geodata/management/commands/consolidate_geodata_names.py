@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Copy the names of every <Model>GeoName<LANG> table to GeoTranslation.
+
+Run it once after enabling CDNX_GEODATA_CONSOLIDATED_NAMES on a database
+that already holds geodata, later imports and saves keep the copy up to
+date.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.translation import gettext as _
+
+from codenerix_lib.debugger import Debugger
+from codenerix_geodata.models import consolidated_names
+from codenerix_geodata.translations import rebuild_translations
+
+
+class Command(BaseCommand, Debugger):
+    help = _("Copies every translated name to the consolidated names table")
+
+    def handle(self, *args, **options):
+
+        # Autoconfigure Debugger
+        self.set_name("CODENERIX-GEODATA")
+        self.set_debug()
+
+        if not consolidated_names():
+            self.debug(
+                "CDNX_GEODATA_CONSOLIDATED_NAMES is not enabled, searches "
+                "will not use the names copied",
+                color="yellow",
+            )
+
+        start = time.time()
+        total = rebuild_translations()
+        self.debug(
+            "{} names consolidated in {:.2f}s".format(
+                total, time.time() - start
+            ),
+            color="green",
+        )
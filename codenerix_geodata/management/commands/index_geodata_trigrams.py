@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Build the trigram index of the names used by substring searches.
+
+Run it once after enabling CDNX_GEODATA_TRIGRAM_SEARCH on a database that
+already holds geodata, later imports and saves keep the index up to date.
+On PostgreSQL it creates the pg_trgm extension and the GIN indexes, on
+other databases it fills GeoTrigram.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.translation import gettext as _
+
+from codenerix_lib.debugger import Debugger
+from codenerix_geodata.models import trigram_index
+from codenerix_geodata.trigrams import index_trigrams, rebuild_trigrams
+
+
+class Command(BaseCommand, Debugger):
+    help = _("Builds the trigram index of the translated names")
+
+    def handle(self, *args, **options):
+
+        # Autoconfigure Debugger
+        self.set_name("CODENERIX-GEODATA")
+        self.set_debug()
+
+        if trigram_index() is None:
+            self.debug(
+                "CDNX_GEODATA_TRIGRAM_SEARCH is not enabled, searches will "
+                "not use the index built",
+                color="yellow",
+            )
+
+        start = time.time()
+        if connection.vendor == "postgresql":
+            index_trigrams()
+            self.debug(
+                "GIN trigram indexes built in {:.2f}s".format(
+                    time.time() - start
+                ),
+                color="green",
+            )
+        else:
+            total = rebuild_trigrams()
+            self.debug(
+                "{} trigrams indexed in {:.2f}s".format(
+                    total, time.time() - start
+                ),
+                color="green",
+            )
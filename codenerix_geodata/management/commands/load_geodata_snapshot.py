@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Load a snapshot written by build_geodata_snapshot into the geodata
+tables, skipping the CSV parsing done by populate_geodata.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from django.utils.translation import gettext as _
+
+from codenerix_lib.debugger import Debugger
+from codenerix_geodata import gazetteer
+from codenerix_geodata.loaders import LOADERS, get_loader
+from codenerix_geodata.models import (
+    Continent,
+    City,
+    ImportManifest,
+    consolidated_names,
+    trigram_index,
+)
+from codenerix_geodata.snapshot import (
+    SnapshotError,
+    read_snapshot,
+    snapshot_columns,
+    snapshot_models,
+)
+from codenerix_geodata.translations import rebuild_translations
+from codenerix_geodata.trigrams import index_trigrams, rebuild_trigrams
+
+
+class Command(BaseCommand, Debugger):
+    help = _("Loads a geodata snapshot into the geodata tables")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help=_("Snapshot file to load"))
+        parser.add_argument(
+            "--replace",
+            action="store_true",
+            default=False,
+            help=_(
+                "Delete the geodata already stored before loading, refused "
+                "when rows of other tables refer to rows missing from the "
+                "snapshot"
+            ),
+        )
+        parser.add_argument(
+            "--loader",
+            choices=["auto"] + sorted(LOADERS),
+            default="auto",
+            help=_("Backend writing the rows (default: auto)"),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help=_("Rows written per batch by the orm loader (default: 5000)"),
+        )
+
+    def handle(self, *args, **options):
+
+        # Autoconfigure Debugger
+        self.set_name("CODENERIX-GEODATA")
+        self.set_debug()
+
+        start = time.time()
+        try:
+            loader = get_loader(options["loader"], options["batch_size"])
+            with open(options["path"], "rb") as stream:
+                metadata, tables = read_snapshot(stream)
+        except (SnapshotError, ValueError) as e:
+            raise CommandError(e)
+        self.debug(
+            "Snapshot of version {} built on {}, read in {:.2f}s".format(
+                metadata["version"], metadata["date"], time.time() - start
+            ),
+            color="blue",
+        )
+
+        missing = [
+            lang
+            for lang in settings.LANGUAGES_DATABASES
+            if lang not in metadata["languages"]
+        ]
+        if missing:
+            self.debug(
+                "Snapshot has no names in {}, they will be left empty".format(
+                    ", ".join(missing)
+                ),
+                color="yellow",
+            )
+        models = snapshot_models(
+            [
+                lang
+                for lang in settings.LANGUAGES_DATABASES
+                if lang in metadata["languages"]
+            ]
+        )
+        for model in models:
+            name = model._meta.model_name
+            columns = [column for column, kind in snapshot_columns(model)]
+            if name not in tables:
+                raise CommandError(
+                    "Table {} not found in snapshot".format(name)
+                )
+            if tables[name][0] != columns:
+                raise CommandError(
+                    "Columns of {} do not match the snapshot: {} != {}".format(
+                        name, ", ".join(columns), ", ".join(tables[name][0])
+                    )
+                )
+
+        if not options["replace"] and (
+            Continent.objects.exists() or City.objects.exists()
+        ):
+            raise CommandError(
+                "Geodata tables are not empty, use --replace to overwrite them"
+            )
+
+        try:
+            # Bumped once at the end instead of on every row written
+            with gazetteer.suspended(), transaction.atomic():
+                self.load(loader, models, tables, options["replace"])
+        except IntegrityError as e:
+            if not options["replace"]:
+                raise
+            raise CommandError(
+                "Stored geodata can not be replaced, rows of other tables "
+                "refer to rows missing from the snapshot: {}".format(e)
+            )
+
+        self.debug(
+            "Snapshot loaded in {:.2f}s".format(time.time() - start),
+            color="green",
+        )
+
+    def load(self, loader, models, tables, replace):
+        """Write the rows of the snapshot, after deleting the stored ones
+        when "replace" is set"""
+        if replace:
+            self.debug("Deleting stored geodata ...", color="yellow")
+            # Deleted without cascading, foreign keys from other tables are
+            # checked when the transaction commits
+            with connection.cursor() as cursor:
+                for model in reversed(snapshot_models()):
+                    cursor.execute(
+                        "DELETE FROM {}".format(
+                            connection.ops.quote_name(model._meta.db_table)
+                        )
+                    )
+            # The import manifest describes the deleted rows
+            ImportManifest.objects.exclude(kind="index").delete()
+
+        for model in models:
+            started = time.time()
+            columns, rows = tables[model._meta.model_name]
+            if rows:
+                loader.insert(model, columns, rows)
+            self.debug(
+                "    > {}: {} rows in {:.2f}s".format(
+                    model._meta.model_name,
+                    len(rows),
+                    time.time() - started,
+                ),
+                color="blue",
+            )
+
+        # Primary keys were given explicitly, move the sequences past them
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+        if consolidated_names():
+            rebuild_translations()
+        if trigram_index() == "table":
+            rebuild_trigrams()
+        elif trigram_index() == "pg_trgm":
+            index_trigrams()
+        gazetteer.bump_version()
@@ -23,20 +23,50 @@
 Two different databases were used:
     - GeoLite2 City: http://geolite.maxmind.com/download/geoip/database/GeoLite2-City-CSV.zip
     - GeoLite2 Country: http://geolite.maxmind.com/download/geoip/database/GeoLite2-Country-CSV.zip
+
+Memory: data files are streamed into compact Record objects and model
+instances are only built for the batch being written. Importing the bundled
+dataset with --jobs 1 needs about 70 MB on top of Django, roughly 0.7 KB per
+city, plus --batch-size model instances. Each extra job holds the parsed
+lines of one data file until they are merged (about 40 MB per City file).
 """
 
+import bz2
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
 import sys
 import time
-from os.path import dirname, join
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from io import BufferedReader, TextIOWrapper
+from os import listdir
+from os.path import basename, dirname, exists, isdir, join
 from csv import reader
+from zipfile import BadZipFile, ZipFile
 
+import django
+from django.apps import apps
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.core.exceptions import ObjectDoesNotExist
 
 from codenerix_lib.debugger import Debugger
-from codenerix_extensions.helpers import FileBZ2
+from codenerix_geodata import __version__, gazetteer, translations, trigrams
+from codenerix_geodata.deferred import get_deferred_indexes
+from codenerix_geodata.loaders import LOADERS, get_loader
+from codenerix_geodata.shadow import SUFFIX as SHADOW_SUFFIX
+from codenerix_geodata.shadow import get_shadow_tables
+from codenerix_geodata.snapshot import snapshot_models
 from codenerix_geodata.models import (
     Continent,
     Country,
@@ -44,7 +74,13 @@ from codenerix_geodata.models import (
     Province,
     City,
     TimeZone,
+    ImportManifest,
+    consolidated_names,
+    search_key,
+    trigram_index,
 )
+from codenerix_geodata.translations import rebuild_translations
+from codenerix_geodata.trigrams import index_trigrams, rebuild_trigrams
 
 
 BASE_LANGUAGE = "EN"
@@ -68,6 +104,49 @@ LANGUAGES = set(
 )
 
 
+# Every language with GeoName tables has a slot in Record.names, whether
+# its names come from the bundled files or from a --source archive
+LANGUAGE_INDEX = dict(
+    (lang, index)
+    for index, lang in enumerate(sorted(settings.LANGUAGES_DATABASES))
+)
+
+# Members of the MaxMind GeoLite2 CSV archives holding the locations
+ARCHIVE_MEMBER = re.compile(
+    r"(?:^|/)GeoLite2-(City|Country)-Locations-([A-Za-z-]+)\.csv$"
+)
+
+# Locations in a directory, named like the bundled data files
+DATA_FILE = re.compile(
+    r"^GeoLite2-(City|Country)-Locations-([A-Za-z-]+)"
+    r"\.csv(?:\.bz2|\.gz|\.zst)?$"
+)
+
+# Bytes read at once from compressed data files
+BUFFER_SIZE = 1 << 20
+
+# Columns of the cities written by Command.link()
+CITY_COLUMNS = ("id", "country_id", "region_id", "province_id", "time_zone_id")
+
+
+class Record(object):
+    """Compact in-memory state of an entity being imported
+
+    "values" are the columns written to its table, in the order given to
+    Command.link(), and "names" its translations in LANGUAGE_INDEX order.
+    "pk" is known once the record has been linked to its row.
+    """
+
+    __slots__ = ("pk", "values", "names", "key", "checksum")
+
+    def __init__(self, values):
+        self.pk = None
+        self.values = values
+        self.names = [None] * len(LANGUAGE_INDEX)
+        self.key = None
+        self.checksum = None
+
+
 def clean(name):
     if name:
         try:
@@ -80,86 +159,267 @@ def clean(name):
 
 
 def populate_missing_names(data):
-    for lang in LANGUAGES:
-        for d in data.values():
-            if lang not in d or d[lang] == "":
-                for other_lang in LANGUAGES - {lang}:
-                    if d[other_lang] != "":
-                        d[lang] = d[other_lang]
+    for record in data.values():
+        names = record.names
+        for index, name in enumerate(names):
+            if not name:
+                for other in names:
+                    if other:
+                        names[index] = other
                         break
 
 
-def continents_lines(filename):
-    with FileBZ2(filename, "rb") as data_file:
-        csv_file = reader(data_file, delimiter=",", quotechar='"')
+def batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
 
-        first = True
-        for line in csv_file:
-            if first:
-                first = False
-                continue
 
-            _, _, continent_code, continent_name, _, _ = line
-            if continent_code.strip() != "" and continent_name.strip() != "":
-                yield continent_code, clean(continent_name)
+def file_checksum(filename):
+    checksum = hashlib.sha1()
+    with open(filename, "rb") as data_file:
+        for chunk in iter(lambda: data_file.read(1 << 20), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
 
 
-def country_lines(filename):
-    with FileBZ2(filename, "rb") as data_file:
-        csv_file = reader(data_file, delimiter=",", quotechar='"')
+def record_checksum(record):
+    """Checksum of the columns and names of a linked record"""
+    data = (record.values, record.names)
+    return hashlib.sha1(repr(data).encode("utf-8")).hexdigest()
 
-        first = True
-        for line in csv_file:
-            if first:
-                first = False
-                continue
 
-            geoid, _, continent_code, _, country_code, country_name = line
-            if (
-                continent_code.strip() != ""
-                and country_code.strip() != ""
-                and country_name.strip() != ""
-            ):
-                yield int(geoid), continent_code, country_code, clean(
-                    country_name
-                )
+def code_list(value):
+    """Parse a comma separated list of codes given on the command line"""
+    return frozenset(
+        code.strip().upper() for code in value.split(",") if code.strip()
+    )
 
 
-def region_lines(filename):
-    with FileBZ2(filename, "rb") as data_file:
-        csv_file = reader(data_file, delimiter=",", quotechar='"')
+def in_scope(scope, continent_code, country_code):
+    """Tell whether a line belongs to the selected countries and continents
 
-        first = True
-        for line in csv_file:
-            if first:
-                first = False
+    "scope" is a (countries, continents) pair of sets, an empty set does not
+    filter anything and None keeps every line.
+    """
+    if scope is None:
+        return True
+    countries, continents = scope
+    return (not countries or country_code in countries) and (
+        not continents or continent_code in continents
+    )
+
+
+# Fields reaching the country and the continent codes of every entity
+SCOPE_FIELDS = {
+    Continent: ("countries__code", "code"),
+    Country: ("code", "continent__code"),
+    Region: ("country__code", "country__continent__code"),
+    Province: ("region__country__code", "region__country__continent__code"),
+    City: ("country__code", "country__continent__code"),
+}
+
+
+def scope_q(model, scope):
+    """Return a Q matching the rows of "model" in "scope", see in_scope()"""
+    countries, continents = scope
+    country, continent = SCOPE_FIELDS[model]
+    q = Q()
+    if countries:
+        q &= Q(**{"{}__in".format(country): countries})
+    if continents:
+        q &= Q(**{"{}__in".format(continent): continents})
+    return q
+
+
+def bundled_sources(data_path):
+    """Return the data files shipped with the package for every language"""
+    sources = {}
+    for lang in LANGUAGES:
+        sources[lang] = {
+            "country": join(data_path, COUNTRY_DATA_FILES[lang]),
+            "city": join(data_path, CITY_DATA_FILES[lang]),
+        }
+    return sources
+
+
+def archive_sources(archives):
+    """Find the locations of every language of LANGUAGES_DATABASES inside
+    MaxMind GeoLite2 CSV zip archives or directories of data files
+
+    Returns {lang: {"country": source, "city": source}} where a source is
+    an (archive, member) pair or the path of a data file. Locales are
+    matched on their language, so "pt-BR" provides the names of "PT".
+    """
+    sources = {}
+    for archive in archives:
+        if isdir(archive):
+            for name in sorted(listdir(archive)):
+                match = DATA_FILE.search(name)
+                if not match:
+                    continue
+                kind, locale = match.groups()
+                lang = locale.split("-")[0].upper()
+                if lang in LANGUAGE_INDEX:
+                    sources.setdefault(lang, {})[kind.lower()] = join(
+                        archive, name
+                    )
+            continue
+        try:
+            with ZipFile(archive) as zip_file:
+                members = zip_file.namelist()
+        except (OSError, BadZipFile) as e:
+            raise CommandError("Can not read {}: {}".format(archive, e))
+        for member in members:
+            match = ARCHIVE_MEMBER.search(member)
+            if not match:
                 continue
+            kind, locale = match.groups()
+            lang = locale.split("-")[0].upper()
+            if lang in LANGUAGE_INDEX:
+                sources.setdefault(lang, {})[kind.lower()] = (archive, member)
+    return sources
+
+
+def zstd_open(filename, mode="rb"):
+    try:
+        # Python 3.14 and later
+        from compression import zstd
+
+        return zstd.open(filename, mode)
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise CommandError(
+            "Reading {} needs the zstandard package".format(filename)
+        )
+    return zstandard.ZstdDecompressor().stream_reader(
+        open(filename, mode), closefd=True
+    )
 
-            (
-                geoid,
-                _,
-                _,
-                _,
+
+CODECS = {
+    ".bz2": bz2.open,
+    ".gz": gzip.open,
+    ".zst": zstd_open,
+}
+
+
+def codec(source):
+    """Return the function opening a compressed data file, None for plain
+    CSV files and zip members (the zip file decompresses them)"""
+    if isinstance(source, tuple):
+        return None
+    for extension, function in CODECS.items():
+        if source.endswith(extension):
+            return function
+    return None
+
+
+@contextmanager
+def open_binary(source):
+    if isinstance(source, tuple):
+        archive, member = source
+        with ZipFile(archive) as zip_file:
+            with zip_file.open(member) as raw:
+                yield raw
+    else:
+        with (codec(source) or open)(source, "rb") as raw:
+            yield raw
+
+
+def cached_copy(source, cache):
+    """Return the path of the decompressed copy of "source" in the "cache"
+    directory, decompressing it the first time. Copies are named after the
+    checksum of the compressed data, so a changed file gets a new one"""
+    if isinstance(source, tuple):
+        archive, member = source
+        key = hashlib.sha1(
+            "{}/{}".format(file_checksum(archive), member).encode("utf-8")
+        ).hexdigest()
+    else:
+        key = file_checksum(source)
+    filename = join(cache, "{}.csv".format(key))
+    if not exists(filename):
+        os.makedirs(cache, exist_ok=True)
+        # Other jobs may decompress the same file, the rename is atomic
+        temporary = "{}.{}.tmp".format(filename, os.getpid())
+        with open_binary(source) as raw, open(temporary, "wb") as copy:
+            shutil.copyfileobj(raw, copy, BUFFER_SIZE)
+        os.replace(temporary, filename)
+    return filename
+
+
+@contextmanager
+def open_data(source, cache=None):
+    """Open a data file as text, "source" is the path of a plain, .bz2, .gz
+    or .zst CSV file or an (archive, member) pair read straight from a zip
+    file. With a "cache" directory compressed data is only decompressed
+    the first time it is seen"""
+    if cache and (isinstance(source, tuple) or codec(source)):
+        source = cached_copy(source, cache)
+    with open_binary(source) as raw:
+        # Decompressors are called for large blocks, not for every line
+        yield TextIOWrapper(
+            BufferedReader(raw, BUFFER_SIZE), encoding="utf-8", newline=""
+        )
+
+
+def location_records(line):
+    """Split one City line into its region, province and city records
+
+    Any of them is None when the line does not carry enough data for it.
+    """
+    (
+        geoid,
+        _,
+        _,
+        _,
+        country_code,
+        _,
+        region_code,
+        region_name,
+        province_code,
+        province_name,
+        city_name,
+        _,
+        time_zone,
+    ) = line[:13]
+
+    # Codes are repeated on many lines, share a single copy of each one
+    country_code = sys.intern(country_code)
+    region_code = sys.intern(region_code)
+    province_code = sys.intern(province_code)
+    time_zone = sys.intern(time_zone)
+
+    region = province = city = None
+    if country_code != "" and region_code != "":
+        if region_name.strip() != "":
+            region = (country_code, region_code, clean(region_name))
+        if province_code != "" and province_name != "":
+            province = (
                 country_code,
-                _,
                 region_code,
-                region_name,
                 province_code,
-                province_name,
-                city_name,
-                _,
-                _,
-            ) = line
-            if (
-                country_code != ""
-                and region_code != ""
-                and region_name.strip() != ""
-            ):
-                yield int(geoid), country_code, region_code, clean(region_name)
+                clean(province_name),
+            )
+    if geoid != "" and city_name.strip() != "" and time_zone != "":
+        city = (
+            int(geoid),
+            country_code,
+            region_code,
+            province_code,
+            clean(city_name),
+            clean(time_zone),
+        )
+    return region, province, city
 
 
-def province_lines(filename):
-    with FileBZ2(filename, "rb") as data_file:
+def city_file_lines(filename, scope=None, cache=None):
+    """Decompress and parse a City file once, yielding (region, province,
+    city) for every line in scope"""
+    with open_data(filename, cache) as data_file:
         csv_file = reader(data_file, delimiter=",", quotechar='"')
 
         first = True
@@ -168,36 +428,17 @@ def province_lines(filename):
                 first = False
                 continue
 
-            (
-                geoid,
-                _,
-                _,
-                _,
-                country_code,
-                _,
-                region_code,
-                _,
-                province_code,
-                province_name,
-                _,
-                _,
-                _,
-            ) = line
-            if (
-                country_code != ""
-                and region_code != ""
-                and province_code != ""
-                and province_name != ""
-            ):
-                yield int(
-                    geoid
-                ), country_code, region_code, province_code, clean(
-                    province_name
-                )
+            # Lines out of scope are dropped before any record is built
+            if in_scope(scope, line[2], line[4]):
+                yield location_records(line)
 
 
-def city_lines(filename):
-    with FileBZ2(filename, "rb") as data_file:
+def read_country_file(filename, scope=None, cache=None):
+    """Parse a Country file in a single pass into its continent and country
+    records"""
+    continents = []
+    countries = []
+    with open_data(filename, cache) as data_file:
         csv_file = reader(data_file, delimiter=",", quotechar='"')
 
         first = True
@@ -209,26 +450,40 @@ def city_lines(filename):
             (
                 geoid,
                 _,
-                _,
-                _,
+                continent_code,
+                continent_name,
                 country_code,
-                _,
-                region_code,
-                _,
-                province_code,
-                _,
-                city_name,
-                _,
-                time_zone,
-            ) = line
-            if geoid != "" and city_name.strip() != "" and time_zone != "":
-                yield int(
-                    geoid
-                ), country_code, region_code, province_code, clean(
-                    city_name
-                ), clean(
-                    time_zone
+                country_name,
+            ) = line[:6]
+            if not in_scope(scope, continent_code, country_code):
+                continue
+            if continent_code.strip() != "" and continent_name.strip() != "":
+                continents.append((continent_code, clean(continent_name)))
+            if (
+                continent_code.strip() != ""
+                and country_code.strip() != ""
+                and country_name.strip() != ""
+            ):
+                countries.append(
+                    (
+                        int(geoid),
+                        continent_code,
+                        country_code,
+                        clean(country_name),
+                    )
                 )
+    return continents, countries
+
+
+def load_shard(code, records, state):
+    """Write the cities of one country and their names, runs in the worker
+    processes started by Command.load_shards()"""
+    return Command().load_shard(code, records, state)
+
+
+def read_city_file(filename, scope=None, cache=None):
+    """Parse a City file into its (region, province, city) records"""
+    return list(city_file_lines(filename, scope, cache))
 
 
 class Command(BaseCommand, Debugger):
@@ -282,12 +537,1214 @@ class Command(BaseCommand, Debugger):
             sys.stdout.flush()
         self.__percent["counter"] += 1
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            default=False,
+            help=_(
+                "Load existing keys with one query per table and write "
+                "new and changed rows in batches"
+            ),
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help=_("Rows written per batch in bulk mode (default: 1000)"),
+        )
+        parser.add_argument(
+            "--loader",
+            choices=["auto"] + sorted(LOADERS),
+            default="auto",
+            help=_(
+                "Backend writing rows in bulk mode, 'auto' uses the native "
+                "one of the database and falls back to 'orm' "
+                "(default: auto)"
+            ),
+        )
+        parser.add_argument(
+            "--report",
+            default=None,
+            metavar="PATH",
+            help=_(
+                "Write a JSON report with the time, rows, queries and peak "
+                "memory of every phase of the import, memory is traced with "
+                "tracemalloc which slows the import down"
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help=_(
+                "Rows committed per transaction and checkpoint "
+                "(default: 5000)"
+            ),
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            default=False,
+            help=_("Continue an interrupted import from its last checkpoint"),
+        )
+        parser.add_argument(
+            "--shadow",
+            action="store_true",
+            default=False,
+            help=_(
+                "Import into shadow copies of the geodata tables and swap "
+                "them in with one transaction once indexed, readers keep "
+                "using the old tables meanwhile (implies --bulk, PostgreSQL "
+                "and SQLite only)"
+            ),
+        )
+        parser.add_argument(
+            "--defer-indexes",
+            action="store_true",
+            default=False,
+            help=_(
+                "Drop the secondary indexes and foreign keys of the geodata "
+                "tables while rows are written and build them again once "
+                "at the end (implies --bulk, PostgreSQL and SQLite only)"
+            ),
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            default=False,
+            help=_(
+                "Use the import manifest to skip unchanged data files and "
+                "write only inserted, changed or removed rows"
+            ),
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            default=False,
+            help=_("Import even if the data files did not change"),
+        )
+        parser.add_argument(
+            "--diff",
+            action="store_true",
+            default=False,
+            help=_(
+                "Compare the data files with the stored rows and report the "
+                "inserts, updates, renames and deletions of every entity and "
+                "language, without writing anything"
+            ),
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            default=False,
+            help=_(
+                "List the regions and provinces without cities that would "
+                "be removed, without importing or deleting anything"
+            ),
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help=_(
+                "Worker processes used to parse the data files and, with "
+                "--shard-by, to load the shards"
+            ),
+        )
+        parser.add_argument(
+            "--shard-by",
+            choices=["country"],
+            default=None,
+            help=_(
+                "Once continents, countries, regions, provinces and time "
+                "zones are written, split the cities and their names into "
+                "one shard per country loaded concurrently by --jobs worker "
+                "processes, each with its own database connection (implies "
+                "--bulk, SQLite serializes the writes of the workers)"
+            ),
+        )
+        parser.add_argument(
+            "--source",
+            action="append",
+            default=[],
+            metavar="PATH",
+            help=_(
+                "MaxMind GeoLite2 City or Country CSV zip archive, or "
+                "directory of GeoLite2-*-Locations-<locale>.csv files "
+                "(plain or compressed with .bz2, .gz or .zst), to read the "
+                "locations of every language from, may be repeated"
+            ),
+        )
+        parser.add_argument(
+            "--cache-dir",
+            default=None,
+            metavar="PATH",
+            help=_(
+                "Keep decompressed copies of the data files in this "
+                "directory, named after their checksum, so later imports "
+                "on this node skip decompressing them"
+            ),
+        )
+        parser.add_argument(
+            "--countries",
+            type=code_list,
+            default=frozenset(),
+            metavar="CODES",
+            help=_(
+                "Only import these countries, comma separated ISO codes "
+                "(for example ES,PT,FR)"
+            ),
+        )
+        parser.add_argument(
+            "--continents",
+            type=code_list,
+            default=frozenset(),
+            metavar="CODES",
+            help=_(
+                "Only import these continents, comma separated codes (for "
+                "example EU). Combined with --countries both must match"
+            ),
+        )
+
+    @contextmanager
+    def phase(self, name, entity, lang=None, rows=0):
+        """Measure a step of the import: wall time, SQL queries and, when
+        a report was requested, the peak of memory traced while it ran
+
+        Yields the dict stored in self.phases, its "rows" and "queries" may
+        be updated. Phases run inside another one are "nested", the outer
+        phase already counts their rows and queries.
+        """
+        stats = {"phase": name, "entity": entity, "language": lang}
+        stats["rows"] = rows
+        stats["nested"] = self.depth > 0
+        stats["queries"] = 0
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start = time.time()
+        self.depth += 1
+        try:
+            with connection.execute_wrapper(count):
+                yield stats
+        finally:
+            self.depth -= 1
+        elapsed = time.time() - start
+        stats["seconds"] = round(elapsed, 3)
+        stats["rows_per_second"] = (
+            round(stats["rows"] / elapsed, 1) if elapsed else None
+        )
+        stats["queries"] += queries[0]
+        stats["peak_memory"] = None
+        if tracemalloc.is_tracing():
+            stats["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        self.phases.append(stats)
+
+    def write_report(self, filename, options, status, elapsed):
+        """Dump the measures of every phase as a JSON document"""
+        peaks = [
+            stats["peak_memory"]
+            for stats in self.phases
+            if stats["peak_memory"] is not None
+        ]
+        outer = [stats for stats in self.phases if not stats["nested"]]
+        document = {
+            "version": __version__,
+            "date": timezone.now().isoformat(),
+            "status": status,
+            "database": connection.vendor,
+            "options": dict(
+                (option, options[option])
+                for option in (
+                    "bulk",
+                    "loader",
+                    "batch_size",
+                    "chunk_size",
+                    "jobs",
+                    "incremental",
+                    "force",
+                    "resume",
+                    "shard_by",
+                )
+            ),
+            "countries": sorted(options["countries"]),
+            "continents": sorted(options["continents"]),
+            "languages": self.languages,
+            "seconds": round(elapsed, 3),
+            "rows": sum(stats["rows"] for stats in outer),
+            "queries": sum(stats["queries"] for stats in outer),
+            "peak_memory": max(peaks) if peaks else None,
+            "phases": self.phases,
+        }
+        if self.differences is not None:
+            document["diff"] = self.differences
+        with open(filename, "w") as report:
+            json.dump(document, report, indent=4)
+            report.write("\n")
+
+    def report(self, text, rows, start):
+        elapsed = time.time() - start
+        rate = rows / elapsed if elapsed else rows
+        self.debug("    > {}: ".format(text), color="blue", tail=False)
+        self.debug(
+            "{} rows in {:.2f}s ({:.0f} rows/s)".format(rows, elapsed, rate),
+            color="cyan",
+            head=False,
+        )
+
+    def read_data(self, sources, jobs, scope=None, cache=None):
+        """Yield (kind, lang, lines) for the data files of every language,
+        only lines in "scope" are parsed and compressed files are
+        decompressed into the "cache" directory when given
+
+        With a single job City lines are streamed straight from the files,
+        Country files are small and read whole in a single pass.
+        Otherwise files are handed to a pool of "jobs" worker processes and
+        only their parsed records come back.
+        """
+        tasks = []
+        for lang in sorted(sources):
+            tasks.append(
+                ("country", lang, read_country_file, sources[lang]["country"])
+            )
+            tasks.append(("city", lang, read_city_file, sources[lang]["city"]))
+
+        if jobs > 1:
+            with ProcessPoolExecutor(
+                max_workers=jobs, initializer=django.setup
+            ) as executor:
+                futures = []
+                for kind, lang, function, filename in tasks:
+                    futures.append(
+                        (
+                            kind,
+                            lang,
+                            executor.submit(function, filename, scope, cache),
+                        )
+                    )
+                for kind, lang, future in futures:
+                    yield kind, lang, future.result()
+        else:
+            for kind, lang, function, filename in tasks:
+                if kind == "country":
+                    yield kind, lang, function(filename, scope, cache)
+                else:
+                    yield kind, lang, city_file_lines(filename, scope, cache)
+
+    def manifest_split(self, kind, model, records):
+        """Return the records that changed since the last incremental import
+
+        Unchanged records are bound to the row stored for them without
+        touching it. Rows imported before and no longer present in the data
+        files are removed, both from the table and from the manifest. With
+        --countries or --continents only the rows in scope can be removed,
+        the others were not read and are kept along their manifest entries.
+        """
+        if not self.incremental:
+            return list(records.values())
+
+        start = time.time()
+        manifest = {}
+        for key, checksum, object_id in ImportManifest.objects.filter(
+            kind=kind
+        ).values_list("key", "checksum", "object_id"):
+            manifest[key] = (checksum, object_id)
+        stored = set(model.objects.values_list("pk", flat=True))
+
+        dirty = []
+        for key, record in records.items():
+            record.key = str(key)
+            record.checksum = record_checksum(record)
+            entry = manifest.pop(record.key, None)
+            if entry and entry[0] == record.checksum and entry[1] in stored:
+                record.pk = entry[1]
+            else:
+                dirty.append(record)
+
+        if self.scope is not None:
+            # Rows in scope missing from the data files, the rest were not read
+            found = set()
+            for batch in batches(
+                [object_id for _, object_id in manifest.values()],
+                self.batch_size,
+            ):
+                found.update(
+                    model.objects.filter(
+                        scope_q(model, self.scope), pk__in=batch
+                    ).values_list("pk", flat=True)
+                )
+            for key, (checksum, object_id) in list(manifest.items()):
+                if object_id in stored and object_id not in found:
+                    del manifest[key]
+
+        removed = [object_id for _, object_id in manifest.values()]
+        with transaction.atomic():
+            for batch in batches(removed, self.batch_size):
+                model.objects.filter(pk__in=batch).delete()
+            for batch in batches(list(manifest.keys()), self.batch_size):
+                ImportManifest.objects.filter(
+                    kind=kind, key__in=batch
+                ).delete()
+        self.written += len(removed)
+
+        self.report(
+            "Manifest ({} changed, {} removed)".format(
+                len(dirty), len(removed)
+            ),
+            len(records),
+            start,
+        )
+        return dirty
+
+    def manifest_save(self, kind, records):
+        """Store the checksum and row of every record written"""
+        if not self.incremental:
+            return
+
+        with self.phase("manifest", kind, rows=len(records)):
+            self.write_manifest(kind, records)
+
+    def write_manifest(self, kind, records):
+        existing = dict(
+            ImportManifest.objects.filter(kind=kind).values_list("key", "pk")
+        )
+        for batch in batches(records, self.chunk_size):
+            created = []
+            changed = []
+            for record in batch:
+                pk = existing.get(record.key)
+                if pk is None:
+                    created.append(
+                        (kind, record.key, record.checksum, record.pk)
+                    )
+                else:
+                    changed.append((pk, record.checksum, record.pk))
+            with transaction.atomic():
+                if created:
+                    self.loader.insert(
+                        ImportManifest,
+                        ["kind", "key", "checksum", "object_id"],
+                        created,
+                    )
+                if changed:
+                    self.loader.update(
+                        ImportManifest,
+                        ["id", "checksum", "object_id"],
+                        changed,
+                    )
+
+    def checkpoint_key(self, phase):
+        # Shards are loaded concurrently, each one checkpoints on its own
+        if self.shard is None:
+            return phase
+        return "{}.{}".format(phase, self.shard)
+
+    def checkpoint(self, phase, chunks):
+        """Record that the first "chunks" chunks of a phase are committed"""
+        if not self.resumable:
+            return
+        ImportManifest.objects.update_or_create(
+            kind="checkpoint",
+            key=self.checkpoint_key(phase),
+            defaults={"checksum": self.signature, "object_id": chunks},
+        )
+
+    def chunks(self, phase, records):
+        """Split records in chunks, telling apart the ones committed by an
+        interrupted run that is being resumed"""
+        done = self.checkpoints.get(self.checkpoint_key(phase), 0)
+        for number, chunk in enumerate(batches(records, self.chunk_size)):
+            yield number, chunk, number < done
+
+    def stored(self, model, *fields):
+        """Yield the "fields" of the rows of "model" a bulk link or fill
+        compares the records with, a shard only reads the rows of its own
+        cities through their unique keys"""
+        column = self.shard_columns.get(model)
+        if column is None:
+            yield from model.objects.values_list(*fields)
+            return
+        for batch in batches(self.shard_cities, self.batch_size):
+            yield from model.objects.filter(
+                **{"{}__in".format(column): batch}
+            ).values_list(*fields)
+
+    def link(self, model, records, key, columns):
+        """Bind every record to its row in the database, saving new ones
+
+        "columns" names the values of the records and "key" is the column,
+        or tuple of columns, used to find the row already stored. In bulk
+        mode the remaining columns, but the id, are refreshed on existing
+        rows. Every chunk is written in its own transaction and
+        checkpointed.
+        """
+        if not records:
+            return
+        with self.phase("link", model._meta.model_name, rows=len(records)):
+            if self.bulk:
+                self.bulk_link(model, records, key, columns)
+            else:
+                self.row_link(model, records, key, columns)
+
+    def row_link(self, model, records, key, columns):
+        phase = model._meta.model_name
+        keys = key if isinstance(key, tuple) else (key,)
+        indexes = [columns.index(column) for column in keys]
+        pending = []
+        completed = []
+        for number, chunk, done in self.chunks(phase, records):
+            if done:
+                completed.extend(chunk)
+            else:
+                pending.append((number, chunk))
+
+        if completed:
+            pks = {}
+            for row in model.objects.values_list("pk", *keys):
+                pks[row[1:]] = row[0]
+            for record in completed:
+                record.pk = pks[tuple(record.values[i] for i in indexes)]
+        if not pending:
+            return
+
+        self.percent_init("    > Link", len(records) - len(completed))
+        for number, chunk in pending:
+            with transaction.atomic():
+                for record in chunk:
+                    try:
+                        record.pk = model.objects.values_list(
+                            "pk", flat=True
+                        ).get(
+                            **dict(
+                                (column, record.values[i])
+                                for column, i in zip(keys, indexes)
+                            )
+                        )
+                    except ObjectDoesNotExist:
+                        instance = model(**dict(zip(columns, record.values)))
+                        instance.save()
+                        record.pk = instance.pk
+                        self.written += 1
+                    self.percent()
+                self.checkpoint(phase, number + 1)
+
+    def bulk_link(self, model, records, key, columns):
+        start = time.time()
+        phase = model._meta.model_name
+        keys = key if isinstance(key, tuple) else (key,)
+        indexes = [columns.index(column) for column in keys]
+        fields = [
+            column
+            for column in columns
+            if column not in keys and column != "id"
+        ]
+        positions = [columns.index(field) for field in fields]
+
+        existing = {}
+        for row in self.stored(model, "pk", *keys, *fields):
+            existing[row[1 : len(keys) + 1]] = (row[0], row[len(keys) + 1 :])
+
+        total_created = 0
+        total_changed = 0
+        for number, chunk, done in self.chunks(phase, records):
+            created = []
+            changed = []
+            for record in chunk:
+                row = existing.get(tuple(record.values[i] for i in indexes))
+                if row is None:
+                    created.append(record)
+                else:
+                    record.pk = row[0]
+                    values = tuple(record.values[i] for i in positions)
+                    if values != row[1]:
+                        changed.append(record)
+            if done and not created and not changed:
+                # Already committed by the run being resumed
+                continue
+
+            with transaction.atomic():
+                if created:
+                    self.loader.insert(
+                        model, columns, [record.values for record in created]
+                    )
+                    if "id" in columns:
+                        for record in created:
+                            record.pk = record.values[columns.index("id")]
+                    else:
+                        # Primary keys were assigned by the database
+                        for batch in batches(created, self.batch_size):
+                            pks = {}
+                            for row in model.objects.filter(
+                                **{
+                                    "{}__in".format(keys[0]): [
+                                        record.values[indexes[0]]
+                                        for record in batch
+                                    ]
+                                }
+                            ).values_list("pk", *keys):
+                                pks[row[1:]] = row[0]
+                            for record in batch:
+                                record.pk = pks[
+                                    tuple(record.values[i] for i in indexes)
+                                ]
+                if changed:
+                    self.loader.update(
+                        model,
+                        ["id"] + fields,
+                        [
+                            (record.pk,)
+                            + tuple(record.values[i] for i in positions)
+                            for record in changed
+                        ],
+                    )
+                self.checkpoint(phase, number + 1)
+            total_created += len(created)
+            total_changed += len(changed)
+            self.written += len(created) + len(changed)
+
+        self.report(
+            "Link ({} new, {} changed)".format(total_created, total_changed),
+            len(records),
+            start,
+        )
+
+    def fill(self, model_type, field, records, lang):
+        """Write the name in "lang" of every record into its GeoName table"""
+        if not records:
+            return
+        with self.phase("fill", field, lang, rows=len(records)):
+            if self.bulk:
+                self.bulk_fill(model_type, field, records, lang)
+            else:
+                self.row_fill(model_type, field, records, lang)
+
+    def row_fill(self, model_type, field, records, lang):
+        phase = model_type._meta.model_name
+        index = LANGUAGE_INDEX[lang]
+        attname = "{}_id".format(field)
+        pending = []
+        for number, chunk, done in self.chunks(phase, records):
+            if not done:
+                pending.append((number, chunk))
+        if not pending:
+            return
+
+        self.percent_init(
+            "    > Fill {}".format(lang), sum(len(c) for _, c in pending)
+        )
+        for number, chunk in pending:
+            with transaction.atomic():
+                for record in chunk:
+                    try:
+                        model = model_type.objects.get(**{attname: record.pk})
+                    except ObjectDoesNotExist:
+                        model = model_type(**{attname: record.pk})
+                    model.name = record.names[index]
+                    model.save()
+                    self.written += 1
+                    self.percent()
+                self.checkpoint(phase, number + 1)
+
+    def bulk_fill(self, model_type, field, records, lang):
+        start = time.time()
+        phase = model_type._meta.model_name
+        index = LANGUAGE_INDEX[lang]
+        attname = "{}_id".format(field)
+
+        existing = {}
+        for pk, parent, name in self.stored(
+            model_type, "pk", attname, "name"
+        ):
+            existing[parent] = (pk, name)
+
+        total_created = 0
+        total_changed = 0
+        for number, chunk, done in self.chunks(phase, records):
+            created = []
+            changed = []
+            for record in chunk:
+                name = record.names[index]
+                row = existing.get(record.pk)
+                if row is None:
+                    created.append((record.pk, name, search_key(name)))
+                elif row[1] != name:
+                    changed.append((row[0], name, search_key(name)))
+            if done and not created and not changed:
+                # Already committed by the run being resumed
+                continue
+
+            with transaction.atomic():
+                if created:
+                    self.loader.insert(
+                        model_type, [attname, "name", "search_key"], created
+                    )
+                if changed:
+                    self.loader.update(
+                        model_type, ["id", "name", "search_key"], changed
+                    )
+                self.checkpoint(phase, number + 1)
+            total_created += len(created)
+            total_changed += len(changed)
+            self.written += len(created) + len(changed)
+
+        self.report(
+            "Fill {} ({} new, {} changed)".format(
+                lang, total_created, total_changed
+            ),
+            len(records),
+            start,
+        )
+
+    def load_shards(self, records, jobs):
+        """Write the cities and their names with one shard per country,
+        loaded concurrently by "jobs" worker processes
+
+        Every parent is already written, so shards only insert and update
+        rows of their own cities and never wait on each other's row locks.
+        """
+        if not records:
+            return
+        with self.phase("shard", "city") as stats:
+            start = time.time()
+            shards = {}
+            for record in records:
+                shards.setdefault(record.values[1], []).append(record)
+            codes = dict(Country.objects.values_list("pk", "code"))
+            state = {
+                "loader": self.loader_name,
+                "batch_size": self.batch_size,
+                "chunk_size": self.chunk_size,
+                "languages": self.languages,
+                "checkpoints": self.checkpoints,
+                "signature": self.signature,
+                "shadow": self.shadow is not None,
+            }
+
+            # Workers open their own connections, an open one would be
+            # shared with them once forked
+            connection.close()
+            self.debug(
+                "    > Loading {} shards with {} jobs".format(
+                    len(shards), jobs
+                ),
+                color="blue",
+            )
+            with ProcessPoolExecutor(
+                max_workers=jobs, initializer=django.setup
+            ) as executor:
+                # Largest countries first, small ones fill the gaps at the end
+                futures = [
+                    executor.submit(load_shard, codes[country], shard, state)
+                    for country, shard in sorted(
+                        shards.items(),
+                        key=lambda item: len(item[1]),
+                        reverse=True,
+                    )
+                ]
+                try:
+                    for future in as_completed(futures):
+                        code, rows, written, phases, elapsed = future.result()
+                        # Workers query through connections of their own
+                        for shard_stats in phases:
+                            if not shard_stats["nested"]:
+                                stats["rows"] += shard_stats["rows"]
+                                stats["queries"] += shard_stats["queries"]
+                            shard_stats["nested"] = True
+                        self.phases.extend(phases)
+                        self.written += written
+                        if self.verbosity > 1:
+                            self.report(
+                                "Shard {}".format(code),
+                                rows,
+                                time.time() - elapsed,
+                            )
+                except BaseException:
+                    executor.shutdown(cancel_futures=True)
+                    raise
+            if self.shadow is not None or self.deferred is not None:
+                # The new connection checks foreign keys again on SQLite
+                connection.disable_constraint_checking()
+
+            for record in records:
+                record.pk = record.values[0]
+        self.report("Shards", len(records), start)
+
+    def load_shard(self, code, records, state):
+        """Write the cities of one country and their names in a worker
+        process, return the code, rows, rows written, phases and seconds of
+        the shard"""
+        start = time.time()
+        # Shards are reported by the importing process
+        self.set_debug({})
+        self.bulk = True
+        self.incremental = False
+        self.batch_size = state["batch_size"]
+        self.chunk_size = state["chunk_size"]
+        self.loader = get_loader(state["loader"], self.batch_size)
+        self.languages = state["languages"]
+        self.checkpoints = state["checkpoints"]
+        self.signature = state["signature"]
+        self.resumable = not state["shadow"]
+        self.phases = []
+        self.depth = 0
+        self.written = 0
+        self.shard = code
+        self.shard_cities = [record.values[0] for record in records]
+        self.shard_columns = {City: "pk"}
+        names = []
+        for lang in self.languages:
+            model_type = apps.get_model(
+                "codenerix_geodata", "CityGeoName{}".format(lang)
+            )
+            self.shard_columns[model_type] = "city_id"
+            names.append((lang, model_type))
+
+        if connection.vendor == "sqlite":
+            # Take the write lock when transactions begin, SQLite fails at
+            # once when a reading transaction has to wait for another writer
+            connection.ensure_connection()
+            connection.transaction_mode = "IMMEDIATE"
+        if state["shadow"]:
+            # Forked workers inherit models already pointing to the shadows
+            if not City._meta.db_table.endswith(SHADOW_SUFFIX):
+                get_shadow_tables(snapshot_models() + [ImportManifest]).start()
+            # Shadow rows refer to parents that are only in the shadow tables
+            connection.disable_constraint_checking()
+
+        self.link(City, records, "id", CITY_COLUMNS)
+        for lang, model_type in names:
+            self.fill(model_type, "city", records, lang)
+        for stats in self.phases:
+            stats["shard"] = code
+        return (
+            code,
+            len(records),
+            self.written,
+            self.phases,
+            time.time() - start,
+        )
+
+    def prune(self, text, records, reachable, options):
+        """Drop the records no city refers to and report them"""
+        skipped = [key for key in records if key not in reachable]
+        for key in skipped:
+            del records[key]
+        self.debug(
+            "    > Reachable {}: {} kept, {} skipped".format(
+                text, len(records), len(skipped)
+            ),
+            color="blue",
+        )
+        if options["verbosity"] > 1:
+            for key in sorted(skipped):
+                self.debug("        - {}".format(key), color="grey")
+
+    def diff(
+        self, continents, countries, regions, provinces, cities, timezones
+    ):
+        """Report what an import of the parsed records would change
+
+        The stored state is read with one values_list query per table and
+        turned into the shape of the records, parents referred to by their
+        codes, so nothing has to be linked or written. Only the rows in the
+        scope of --countries and --continents are compared, the import does
+        not touch the others.
+        """
+        self.debug("Comparing with stored data ...", color="yellow")
+        self.differences = []
+        scoped = self.scoped
+
+        continent_codes = dict(
+            scoped(Continent).distinct().values_list("pk", "code")
+        )
+        stored_continents = dict(
+            (code, (pk, (code,))) for pk, code in continent_codes.items()
+        )
+        country_codes = {}
+        stored_countries = {}
+        for pk, code, continent in scoped(Country).values_list(
+            "pk", "code", "continent_id"
+        ):
+            country_codes[pk] = code
+            stored_countries[code] = (
+                pk,
+                (pk, code, continent_codes[continent]),
+            )
+        region_keys = {}
+        stored_regions = {}
+        for pk, code, country in scoped(Region).values_list(
+            "pk", "code", "country_id"
+        ):
+            region_keys[pk] = "{}_{}".format(country_codes[country], code)
+            stored_regions[(code, country_codes[country])] = (
+                pk,
+                (code, country_codes[country]),
+            )
+        province_keys = {}
+        stored_provinces = {}
+        for pk, code, region in scoped(Province).values_list(
+            "pk", "code", "region_id"
+        ):
+            province_keys[pk] = "{}_{}".format(region_keys[region], code)
+            stored_provinces[(code, region_keys[region])] = (
+                pk,
+                (code, region_keys[region]),
+            )
+        timezone_names = dict(TimeZone.objects.values_list("pk", "name"))
+        stored_timezones = dict(
+            (name, (pk, (name,))) for pk, name in timezone_names.items()
+        )
+        stored_cities = {}
+        rows = scoped(City).values_list(
+            "pk", "country_id", "region_id", "province_id", "time_zone_id"
+        )
+        for pk, country, region, province, time_zone in rows:
+            stored_cities[pk] = (
+                pk,
+                (
+                    pk,
+                    country_codes[country],
+                    region_keys.get(region),
+                    province_keys.get(province),
+                    timezone_names[time_zone],
+                ),
+            )
+
+        populate_missing_names(regions)
+        populate_missing_names(provinces)
+        populate_missing_names(cities)
+
+        # Keys and compared columns follow the arguments given to link()
+        for entity, records, stored, key, positions in (
+            ("continent", continents, stored_continents, 0, ()),
+            ("country", countries, stored_countries, 1, (2,)),
+            ("region", regions, stored_regions, (0, 1), ()),
+            ("province", provinces, stored_provinces, (0, 1), ()),
+            ("timezone", timezones, stored_timezones, 0, ()),
+            ("city", cities, stored_cities, 0, (1, 2, 3, 4)),
+        ):
+            pks = self.diff_rows(entity, records, stored, key, positions)
+            if entity != "timezone":
+                for lang in self.languages:
+                    self.diff_names(entity, lang, records, pks)
+
+    def scoped(self, model):
+        """Return the rows of "model" in the scope of the import"""
+        if self.scope is None:
+            return model.objects.all()
+        return model.objects.filter(scope_q(model, self.scope))
+
+    def diff_rows(self, entity, records, stored, key, positions):
+        """Count the rows of an entity an import would insert, update and
+        delete, return the primary key matched by every record
+
+        "stored" maps every key to the primary key and the values of its
+        row, in the shape of the records. "key" is the position of the key
+        in the values of the records, or a tuple of positions.
+        """
+        pks = {}
+        matched = set()
+        inserted = []
+        updated = []
+        for record in records.values():
+            if isinstance(key, tuple):
+                code = tuple(record.values[i] for i in key)
+            else:
+                code = record.values[key]
+            if code not in stored:
+                inserted.append(code)
+                continue
+            pk, row = stored[code]
+            pks[record] = pk
+            matched.add(code)
+            if any(record.values[i] != row[i] for i in positions):
+                updated.append(code)
+        if entity == "timezone":
+            # Imports never delete time zones
+            deleted = set()
+        else:
+            deleted = set(stored) - matched
+        self.diff_report(entity, None, inserted, updated, [], deleted)
+        return pks
+
+    def diff_names(self, entity, lang, records, pks):
+        """Count the translations in "lang" an import would insert, rename
+        and delete"""
+        index = LANGUAGE_INDEX[lang]
+        model = apps.get_model(
+            "codenerix_geodata", "{}GeoName{}".format(entity.title(), lang)
+        )
+        attname = "{}_id".format(entity)
+        stored = model.objects.values_list(attname, "name")
+        if self.scope is not None:
+            stored = stored.filter(
+                **{
+                    "{}__in".format(entity): self.scoped(
+                        apps.get_model("codenerix_geodata", entity)
+                    ).values("pk")
+                }
+            )
+        stored = dict(stored)
+        inserted = []
+        renamed = []
+        for record in records.values():
+            pk = pks.get(record)
+            name = record.names[index]
+            if pk is None or pk not in stored:
+                inserted.append(name)
+            elif stored[pk] != name:
+                renamed.append("{} -> {}".format(stored[pk], name))
+        deleted = set(stored) - set(pks.values())
+        self.diff_report(entity, lang, inserted, [], renamed, deleted)
+
+    def diff_report(self, entity, lang, inserted, updated, renamed, deleted):
+        self.differences.append(
+            {
+                "entity": entity,
+                "language": lang,
+                "insert": len(inserted),
+                "update": len(updated),
+                "rename": len(renamed),
+                "delete": len(deleted),
+            }
+        )
+        changes = [
+            "{} new".format(len(inserted)),
+            "{} changed".format(len(updated)) if lang is None else None,
+            "{} renamed".format(len(renamed)) if lang else None,
+            "{} {}".format(
+                len(deleted),
+                "removed" if self.incremental else "not in data files",
+            ),
+        ]
+        self.debug(
+            "    > {}{}: ".format(entity, " {}".format(lang) if lang else ""),
+            color="blue",
+            tail=False,
+        )
+        self.debug(
+            ", ".join(change for change in changes if change),
+            color=(
+                "cyan" if inserted or updated or renamed or deleted else "grey"
+            ),
+            head=False,
+        )
+        if self.verbosity > 1:
+            for text, items in (
+                ("+", inserted),
+                ("~", updated),
+                ("~", renamed),
+                ("-", deleted),
+            ):
+                for item in sorted(items, key=str):
+                    self.debug(
+                        "        {} {}".format(text, item), color="grey"
+                    )
+
+    def remove_orphans(self, dry_run=False):
+        """Remove regions and provinces without cities, return how many
+        rows were deleted
+
+        Orphans are found with a single anti-join per table instead of
+        counting the cities of every row. Provinces go first, a region is
+        only left without cities once its provinces are gone.
+        """
+        removed = 0
+        for model, text, columns in (
+            (
+                Province,
+                "provinces",
+                ("pk", "region__country__code", "region__code", "code"),
+            ),
+            (Region, "regions", ("pk", "country__code", "code")),
+        ):
+            orphans = model.objects.filter(cities__isnull=True)
+            if dry_run:
+                rows = list(orphans.values_list(*columns))
+                self.debug(
+                    "{} {} without cities would be removed".format(
+                        len(rows), text
+                    ),
+                    color="yellow",
+                )
+                for row in rows:
+                    self.debug(
+                        "    - {} (id {})".format(
+                            "/".join(row[1:]), row[0]
+                        ),
+                        color="grey",
+                    )
+            else:
+                self.debug(
+                    "Removing {} without cities ...".format(text),
+                    color="yellow",
+                    tail=False,
+                )
+                removed += self.delete_orphans(model, orphans)
+                self.debug(" ... Done", color="green", head=False)
+        return removed
+
+    def delete_orphans(self, model, orphans):
+        """Delete the "orphans" rows of "model" and their names with one
+        DELETE statement per table, return how many rows were deleted
+
+        QuerySet.delete() loads every row and sends the signals of every
+        name, refreshing GeoTranslation and GeoTrigram one name at a time,
+        they are rebuilt once at the end of the import instead. Rows other
+        models point to, like the addresses of other applications, still
+        go through QuerySet.delete() to cascade to them.
+        """
+        names = [
+            apps.get_model(
+                "codenerix_geodata",
+                "{}GeoName{}".format(model.__name__, lang),
+            )
+            for lang in settings.LANGUAGES_DATABASES
+        ]
+        referenced = Q()
+        for relation in model._meta.related_objects:
+            if relation.related_model not in names + [City]:
+                referenced |= Q(
+                    **{
+                        "{}__isnull".format(
+                            relation.field.related_query_name()
+                        ): False
+                    }
+                )
+        removed = 0
+        if referenced:
+            removed += orphans.filter(referenced).delete()[0]
+        pks = orphans.values("pk")
+        for name_model in names:
+            removed += name_model.objects.filter(
+                **{"{}__in".format(name_model.geo_entity): pks}
+            )._raw_delete(connection.alias)
+        removed += orphans._raw_delete(connection.alias)
+        return removed
+
     def handle(self, *args, **options):
 
         # Autoconfigure Debugger
         self.set_name("CODENERIX-GEODATA")
         self.set_debug()
 
+        self.bulk = options["bulk"]
+        self.batch_size = options["batch_size"]
+        self.incremental = options["incremental"]
+        self.verbosity = options["verbosity"]
+        self.chunk_size = options["chunk_size"]
+        self.loader_name = options["loader"]
+        try:
+            self.loader = get_loader(self.loader_name, self.batch_size)
+        except ValueError as e:
+            raise CommandError(e)
+
+        self.shard_by = options["shard_by"]
+        self.shard = None
+        self.shard_columns = {}
+        if self.shard_by:
+            if options["jobs"] < 2:
+                raise CommandError("--shard-by needs --jobs 2 or more")
+            self.bulk = True
+
+        if options["dry_run"]:
+            self.remove_orphans(dry_run=True)
+            return
+
+        self.shadow = None
+        self.resumable = True
+        if options["shadow"] and not options["diff"]:
+            if options["resume"]:
+                raise CommandError(
+                    "--resume can not be used with --shadow, shadow tables "
+                    "are created again on every import"
+                )
+            try:
+                # The manifest is swapped along the data it describes
+                self.shadow = get_shadow_tables(
+                    snapshot_models() + [ImportManifest]
+                )
+            except ValueError as e:
+                raise CommandError(e)
+            self.bulk = True
+            # Shadow tables are created again, their checkpoints are useless
+            self.resumable = False
+
+        self.deferred = None
+        try:
+            deferred = get_deferred_indexes(snapshot_models())
+        except ValueError as e:
+            if options["defer_indexes"]:
+                raise CommandError(e)
+        else:
+            if deferred.pending() and options["diff"]:
+                self.debug(
+                    "Indexes left dropped by an interrupted import are "
+                    "restored by the next import, --diff writes nothing",
+                    color="yellow",
+                )
+            elif deferred.pending():
+                self.debug(
+                    "Restoring indexes left dropped by an interrupted "
+                    "import ...",
+                    color="yellow",
+                )
+                deferred.restore()
+            # Shadow tables are indexed once loaded already
+            if (
+                options["defer_indexes"]
+                and self.shadow is None
+                and not options["diff"]
+            ):
+                self.deferred = deferred
+                self.bulk = True
+
+        # Reported even when populate() fails before reading any data file
+        self.languages = []
+        self.phases = []
+        self.depth = 0
+        self.differences = None
+        # Rows inserted, updated or deleted, the version is bumped when any
+        self.written = 0
+        if options["report"]:
+            tracemalloc.start()
+        start = time.time()
+        status = "failed"
+        try:
+            with ExitStack() as stack:
+                # Bumped once below instead of on every row saved
+                stack.enter_context(gazetteer.suspended())
+                if self.shadow is not None:
+                    # The live GeoTranslation and GeoTrigram tables are only
+                    # rebuilt once the shadow tables are swapped in
+                    stack.enter_context(translations.suspended())
+                    stack.enter_context(trigrams.suspended())
+                self.populate(options)
+            status = "done"
+        finally:
+            if self.shadow is not None and status == "failed":
+                # Live tables were not touched, drop the partial copies
+                self.shadow.stop()
+                self.shadow.drop()
+            if self.deferred is not None and self.deferred.pending():
+                self.deferred.restore()
+            if options["report"]:
+                self.write_report(
+                    options["report"], options, status, time.time() - start
+                )
+                tracemalloc.stop()
+
+        # Once the import is cleaned up, only when it changed any row
+        if self.written:
+            gazetteer.bump_version()
+
+    def populate(self, options):
         # print('Erasing existing data ...')
         # City.objects.all().delete()
         # TimeZone.objects.all().delete()
@@ -300,8 +1757,70 @@ class Command(BaseCommand, Debugger):
         print("")
         data_path = join(dirname(dirname(dirname(__file__))), "data")
 
+        sources = bundled_sources(data_path)
+        if options["source"]:
+            found = archive_sources(options["source"])
+            for lang, members in found.items():
+                if "city" not in members:
+                    continue
+                if "country" not in members:
+                    # GeoLite2-City archives carry no country geoname ids,
+                    # take them from a Country archive or the bundled files
+                    if lang not in sources:
+                        raise CommandError(
+                            "No Country locations found for {}, add the "
+                            "GeoLite2-Country-CSV archive to --source".format(
+                                lang
+                            )
+                        )
+                    members["country"] = sources[lang]["country"]
+                sources[lang] = members
+            if not found:
+                raise CommandError(
+                    "No locations for {} found in {}".format(
+                        ", ".join(sorted(LANGUAGE_INDEX)),
+                        ", ".join(options["source"]),
+                    )
+                )
+        self.languages = sorted(sources)
+
+        checksums = {}
+        for members in sources.values():
+            for source in members.values():
+                filename = source[0] if isinstance(source, tuple) else source
+                if basename(filename) not in checksums:
+                    checksums[basename(filename)] = file_checksum(filename)
+
+        scope = None
+        if options["countries"] or options["continents"]:
+            scope = (options["countries"], options["continents"])
+            # The selection is part of the input of the import, so it is
+            # checked along the data files by --incremental and --resume
+            checksums["scope"] = hashlib.sha1(
+                repr(tuple(sorted(codes) for codes in scope)).encode("utf-8")
+            ).hexdigest()
+        self.scope = scope
+
+        if self.incremental:
+            stored = dict(
+                ImportManifest.objects.filter(kind="file").values_list(
+                    "key", "checksum"
+                )
+            )
+            if (
+                checksums == stored
+                and not options["force"]
+                and not options["diff"]
+            ):
+                self.debug(
+                    "Data files did not change since the last import, "
+                    "nothing to do",
+                    color="green",
+                )
+                return
+
         # Importing language generated models
-        for lang in LANGUAGES:
+        for lang in self.languages:
             exec(
                 "from codenerix_geodata.models import ContinentGeoName{}".format(
                     lang
@@ -328,91 +1847,217 @@ class Command(BaseCommand, Debugger):
                 )
             )
 
+        # Every data file is read once and merged line by line into compact
+        # records, parent references are kept as codes until they are linked
+        self.debug("Reading data files ...", color="yellow")
+        continents = {}
+        countries = {}
+        regions = {}
+        provinces = {}
+        cities = {}
+        timezones = {}
+        for kind, lang, data in self.read_data(
+            sources, options["jobs"], scope, options["cache_dir"]
+        ):
+            with self.phase("read", kind, lang) as stats:
+                start = time.time()
+                index = LANGUAGE_INDEX[lang]
+                rows = 0
+                if kind == "country":
+                    continent_items, country_items = data
+                    for code, name in continent_items:
+                        if code not in continents:
+                            continents[code] = Record((code,))
+                        continents[code].names[index] = name
+                        rows += 1
+                    for geoid, continent, code, name in country_items:
+                        if code not in countries:
+                            countries[code] = Record((geoid, code, continent))
+                        countries[code].names[index] = name
+                        rows += 1
+                else:
+                    for region, province, city in data:
+                        if region:
+                            country_code, region_code, name = region
+                            region_key = "{}_{}".format(
+                                country_code, region_code
+                            )
+                            if region_key not in regions:
+                                regions[region_key] = Record(
+                                    (region_code, country_code)
+                                )
+                            regions[region_key].names[index] = name
+                        if province:
+                            (
+                                country_code,
+                                region_code,
+                                province_code,
+                                name,
+                            ) = province
+                            region_key = "{}_{}".format(
+                                country_code, region_code
+                            )
+                            province_key = "{}_{}_{}".format(
+                                country_code, region_code, province_code
+                            )
+                            if province_key not in provinces:
+                                provinces[province_key] = Record(
+                                    (province_code, region_key)
+                                )
+                            provinces[province_key].names[index] = name
+                        if city:
+                            (
+                                city_id,
+                                country_code,
+                                region_code,
+                                province_code,
+                                name,
+                                time_zone,
+                            ) = city
+                            if time_zone not in timezones:
+                                timezones[time_zone] = Record((time_zone,))
+                            if city_id not in cities:
+                                region_key = None
+                                province_key = None
+                                if region_code != "":
+                                    region_key = "{}_{}".format(
+                                        country_code, region_code
+                                    )
+                                if province_code != "":
+                                    province_key = "{}_{}_{}".format(
+                                        country_code,
+                                        region_code,
+                                        province_code,
+                                    )
+                                cities[city_id] = Record(
+                                    (
+                                        city_id,
+                                        country_code,
+                                        region_key,
+                                        province_key,
+                                        time_zone,
+                                    )
+                                )
+                            cities[city_id].names[index] = name
+                        rows += 1
+                stats["rows"] = rows
+            self.report("Read {} {}".format(kind, lang), rows, start)
+
+        if scope:
+            missing = sorted(options["countries"] - set(countries))
+            missing += sorted(options["continents"] - set(continents))
+            if missing:
+                self.debug(
+                    "No data found for {}".format(", ".join(missing)),
+                    color="yellow",
+                )
+
+        # Regions and provinces without cities would be removed at the end,
+        # skip them before anything is written
+        reachable_regions = set()
+        reachable_provinces = set()
+        for record in cities.values():
+            _, _, region_key, province_key, _ = record.values
+            reachable_regions.add(region_key)
+            reachable_provinces.add(province_key)
+        self.prune("regions", regions, reachable_regions, options)
+        self.prune("provinces", provinces, reachable_provinces, options)
+
+        if options["diff"]:
+            self.diff(
+                continents, countries, regions, provinces, cities, timezones
+            )
+            return
+
+        # Checkpoints are only valid for the same data files and options
+        self.signature = hashlib.sha1(
+            repr(
+                (
+                    sorted(checksums.items()),
+                    self.incremental,
+                    self.chunk_size,
+                )
+            ).encode("utf-8")
+        ).hexdigest()
+        self.checkpoints = {}
+        if options["resume"]:
+            self.checkpoints = dict(
+                ImportManifest.objects.filter(
+                    kind="checkpoint", checksum=self.signature
+                ).values_list("key", "object_id")
+            )
+            if not self.checkpoints:
+                self.debug(
+                    "No checkpoint found for these data files, importing "
+                    "from the beginning",
+                    color="yellow",
+                )
+            else:
+                # The interrupted run committed rows without bumping it
+                self.written += 1
+        ImportManifest.objects.filter(kind="checkpoint").exclude(
+            checksum=self.signature
+        ).delete()
+        if not options["resume"]:
+            ImportManifest.objects.filter(kind="checkpoint").delete()
+
+        if self.shadow is not None:
+            with self.phase("shadow", "create"):
+                self.shadow.create()
+            self.shadow.start()
+
+        if self.deferred is not None:
+            with self.phase("defer", "indexes") as stats:
+                stats["rows"] = self.deferred.defer()
+            for drop in self.deferred.skipped:
+                self.debug(
+                    "Not deferred, too long for the import manifest: "
+                    "{}".format(drop),
+                    color="yellow",
+                )
+
+        # Regions and provinces stored with explicit ids by older imports,
+        # new ones are numbered by the database after them
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), [Region, Province]
+        )
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
         self.debug("Importing ...", color="yellow", tail=False)
         self.debug(" Continents", color="purple", head=False, tail=False)
         self.debug(
             " Countries Regions Provinces Cities", color="grey", head=False
         )
-        continents = {}
-        for lang in LANGUAGES:
-            filename = join(data_path, COUNTRY_DATA_FILES[lang])
-            lines = list(continents_lines(filename))
-            self.percent_init("    > Prepare data {}".format(lang), len(lines))
-            for code, name in lines:
-                if code not in continents:
-                    continents[code] = {"model": Continent(code=code)}
-                continents[code][lang] = name
-                self.percent()
-
-        items = continents.items()
-        self.percent_init("    > Link", len(items))
-        for code, continent in items:
-            try:
-                model = Continent.objects.get(code=code)
-                continent["model"] = model
-            except ObjectDoesNotExist:
-                continent["model"].save()
-            self.percent()
+        with self.phase("prepare", "continent", rows=len(continents)):
+            dirty = self.manifest_split("continent", Continent, continents)
+
+        self.link(Continent, dirty, "code", ("code",))
 
-        for lang in LANGUAGES:
+        for lang in self.languages:
             model_type = eval("ContinentGeoName{}".format(lang))
-            items = continents.values()
-            self.percent_init("    > Fill {}".format(lang), len(items))
-            for continent in items:
-                try:
-                    model = model_type.objects.get(
-                        continent=continent["model"]
-                    )
-                except ObjectDoesNotExist:
-                    model = model_type()
-                    model.continent = continent["model"]
-                model.name = continent[lang]
-                model.save()
-                self.percent()
+            self.fill(model_type, "continent", dirty, lang)
+        self.manifest_save("continent", dirty)
 
         self.debug("Importing ...", color="yellow", tail=False)
         self.debug(" Continents", color="simplepurple", head=False, tail=False)
         self.debug(" Countries", color="purple", head=False, tail=False)
         self.debug(" Regions Provinces Cities", color="grey", head=False)
-        countries = {}
-        for lang in LANGUAGES:
-            filename = join(data_path, COUNTRY_DATA_FILES[lang])
-            items = list(country_lines(filename))
-            self.percent_init("    > Prepare data {}".format(lang), len(items))
-            for geoid, continent, code, name in items:
-                if code not in countries:
-                    countries[code] = {
-                        "model": Country(
-                            pk=geoid,
-                            code=code,
-                            continent=continents[continent]["model"],
-                        )
-                    }
-                countries[code][lang] = name
-                self.percent()
+        with self.phase("prepare", "country", rows=len(countries)):
+            for record in countries.values():
+                geoid, code, continent = record.values
+                record.values = (geoid, code, continents[continent].pk)
 
-        values = countries.values()
-        self.percent_init("    > Link", len(values))
-        for country in values:
-            try:
-                model = Country.objects.get(code=country["model"].code)
-                country["model"] = model
-            except ObjectDoesNotExist:
-                country["model"].save()
-            self.percent()
+            dirty = self.manifest_split("country", Country, countries)
 
-        for lang in LANGUAGES:
+        self.link(Country, dirty, "code", ("id", "code", "continent_id"))
+
+        for lang in self.languages:
             model_type = eval("CountryGeoName{}".format(lang))
-            self.percent_init("    > Fill {}".format(lang), len(values))
-            for country in values:
-                try:
-                    model = model_type.objects.get(country=country["model"])
-                except ObjectDoesNotExist:
-                    model = model_type()
-                    model.country = country["model"]
-                model.name = country[lang]
-                model.save()
-                self.percent()
+            self.fill(model_type, "country", dirty, lang)
+        self.manifest_save("country", dirty)
 
         self.debug("Importing ...", color="yellow", tail=False)
         self.debug(
@@ -423,51 +2068,27 @@ class Command(BaseCommand, Debugger):
         )
         self.debug(" Regions", color="purple", head=False, tail=False)
         self.debug(" Provinces Cities", color="grey", head=False)
-        regions = {}
-        for lang in LANGUAGES:
-            filename = join(data_path, CITY_DATA_FILES[lang])
-            lines = list(region_lines(filename))
-            self.percent_init("    > Prepare data {}".format(lang), len(lines))
-            for geoid, country_code, region_code, region_name in lines:
-                region_key = "{}_{}".format(country_code, region_code)
-                if region_key not in regions:
-                    regions[region_key] = {
-                        "model": Region(
-                            pk=geoid,
-                            code=region_code,
-                            country=countries[country_code]["model"],
-                        )
-                    }
-                regions[region_key][lang] = region_name
-                self.percent()
+        with self.phase("prepare", "region", rows=len(regions)):
+            for record in regions.values():
+                code, country = record.values
+                record.values = (code, countries[country].pk)
 
-        items = regions.values()
-        self.percent_init("    > Link", len(items))
-        for region in items:
-            try:
-                model = Region.objects.get(pk=region["model"].pk)
-                region["model"] = model
-            except ObjectDoesNotExist:
-                region["model"].save()
-            self.percent()
+            self.debug("    > Populate missing", color="blue", tail=False)
+            populate_missing_names(regions)
+            self.debug(" ... Done", color="green", head=False)
 
-        self.debug("    > Populate missing", color="blue", tail=False)
-        populate_missing_names(regions)
-        self.debug(" ... Done", color="green", head=False)
+            dirty = self.manifest_split("region", Region, regions)
 
-        for lang in LANGUAGES:
+        # Ids are given by the database, the geoname id of the first city
+        # of a subdivision can already belong to another one
+        self.link(
+            Region, dirty, ("country_id", "code"), ("code", "country_id")
+        )
+
+        for lang in self.languages:
             model_type = eval("RegionGeoName{}".format(lang))
-            items = regions.values()
-            self.percent_init("    > Fill {}".format(lang), len(items))
-            for region in items:
-                try:
-                    model = model_type.objects.get(region=region["model"])
-                except ObjectDoesNotExist:
-                    model = model_type()
-                    model.region = region["model"]
-                    model.name = region[lang]
-                model.save()
-                self.percent()
+            self.fill(model_type, "region", dirty, lang)
+        self.manifest_save("region", dirty)
 
         self.debug("Importing ...", color="yellow", tail=False)
         self.debug(
@@ -478,60 +2099,25 @@ class Command(BaseCommand, Debugger):
         )
         self.debug(" Provinces", color="purple", head=False, tail=False)
         self.debug(" Cities", color="grey", head=False)
-        provinces = {}
-        for lang in LANGUAGES:
-            filename = join(data_path, CITY_DATA_FILES[lang])
-            lines = list(province_lines(filename))
-            self.percent_init("    > Prepare data {}".format(lang), len(lines))
-            for (
-                geoid,
-                country_code,
-                region_code,
-                province_code,
-                province_name,
-            ) in lines:
-                region_key = "{}_{}".format(country_code, region_code)
-                province_key = "{}_{}_{}".format(
-                    country_code, region_code, province_code
-                )
-                if province_key not in provinces:
-                    provinces[province_key] = {
-                        "model": Province(
-                            pk=geoid,
-                            code=province_code,
-                            region=regions[region_key]["model"],
-                        )
-                    }
-                provinces[province_key][lang] = province_name
-                self.percent()
+        with self.phase("prepare", "province", rows=len(provinces)):
+            for record in provinces.values():
+                code, region = record.values
+                record.values = (code, regions[region].pk)
 
-        items = provinces.values()
-        self.percent_init("    > Link", len(items))
-        for province in items:
-            try:
-                model = Province.objects.get(pk=province["model"].pk)
-                province["model"] = model
-            except ObjectDoesNotExist:
-                province["model"].save()
-            self.percent()
+            self.debug("    > Populate missing", color="blue", tail=False)
+            populate_missing_names(provinces)
+            self.debug(" ... Done", color="green", head=False)
 
-        self.debug("    > Populate missing", color="blue", tail=False)
-        populate_missing_names(provinces)
-        self.debug(" ... Done", color="green", head=False)
+            dirty = self.manifest_split("province", Province, provinces)
+
+        self.link(
+            Province, dirty, ("region_id", "code"), ("code", "region_id")
+        )
 
-        for lang in LANGUAGES:
+        for lang in self.languages:
             model_type = eval("ProvinceGeoName{}".format(lang))
-            items = provinces.values()
-            self.percent_init("    > Fill {}".format(lang), len(items))
-            for province in items:
-                try:
-                    model = model_type.objects.get(province=province["model"])
-                except ObjectDoesNotExist:
-                    model = model_type()
-                    model.province = province["model"]
-                model.name = province[lang]
-                model.save()
-                self.percent()
+            self.fill(model_type, "province", dirty, lang)
+        self.manifest_save("province", dirty)
 
         self.debug("Importing ...", color="yellow", tail=False)
         self.debug(
@@ -541,91 +2127,74 @@ class Command(BaseCommand, Debugger):
             tail=False,
         )
         self.debug(" Cities", color="purple", head=False, tail=False)
-        cities = {}
-        timezones = {}
-        for lang in LANGUAGES:
-            filename = join(data_path, CITY_DATA_FILES[lang])
-            lines = list(city_lines(filename))
-            self.percent_init("    > Prepare data {}".format(lang), len(lines))
-            for (
-                city_id,
-                country_code,
-                region_code,
-                province_code,
-                city_name,
-                time_zone,
-            ) in lines:
-                if time_zone not in timezones:
-                    try:
-                        model = TimeZone.objects.get(name=time_zone)
-                        timezones[time_zone] = model
-                    except ObjectDoesNotExist:
-                        timezones[time_zone] = TimeZone(name=time_zone)
-                        timezones[time_zone].save()
-
-                if city_id not in cities:
-                    city = City(
-                        pk=city_id,
-                        country=countries[country_code]["model"],
-                        time_zone=timezones[time_zone],
-                    )
-                    if region_code != "":
-                        region_key = "{}_{}".format(country_code, region_code)
-                        city.region = regions[region_key]["model"]
+        self.link(TimeZone, list(timezones.values()), "name", ("name",))
+        with self.phase("prepare", "city", rows=len(cities)):
+            for record in cities.values():
+                city_id, country, region, province, time_zone = record.values
+                record.values = (
+                    city_id,
+                    countries[country].pk,
+                    regions[region].pk if region else None,
+                    provinces[province].pk if province else None,
+                    timezones[time_zone].pk,
+                )
 
-                    if province_code != "":
-                        province_key = "{}_{}_{}".format(
-                            country_code, region_code, province_code
+            self.debug("    > Populate missing", color="blue", tail=False)
+            populate_missing_names(cities)
+            self.debug(" ... Done", color="green", head=False)
+
+            dirty = self.manifest_split("city", City, cities)
+
+        if self.shard_by:
+            self.load_shards(dirty, options["jobs"])
+        else:
+            self.link(City, dirty, "id", CITY_COLUMNS)
+
+            for lang in self.languages:
+                model_type = eval("CityGeoName{}".format(lang))
+                self.fill(model_type, "city", dirty, lang)
+        self.manifest_save("city", dirty)
+
+        if self.deferred is not None:
+            self.debug("Building deferred indexes ...", color="blue")
+            with self.phase("restore", "indexes") as stats:
+                stats["rows"] = self.deferred.restore()
+
+        with self.phase("cleanup", "orphans") as stats:
+            stats["rows"] = self.remove_orphans()
+            self.written += stats["rows"]
+            ImportManifest.objects.filter(kind="checkpoint").delete()
+
+            if self.incremental:
+                ImportManifest.objects.filter(kind="file").delete()
+                ImportManifest.objects.bulk_create(
+                    [
+                        ImportManifest(
+                            kind="file", key=name, checksum=checksum
                         )
-                        city.province = provinces[province_key]["model"]
-
-                    cities[city_id] = {"model": city}
-
-                cities[city_id][lang] = city_name
-                self.percent()
-
-        items = cities.values()
-        self.percent_init("    > Link", len(items))
-        for city in items:
-            try:
-                model = City.objects.get(pk=city["model"].pk)
-                city["model"] = model
-            except ObjectDoesNotExist:
-                city["model"].save()
-            self.percent()
-
-        self.debug("    > Populate missing", color="blue", tail=False)
-        populate_missing_names(cities)
-        self.debug(" ... Done", color="green", head=False)
-
-        for lang in LANGUAGES:
-            model_type = eval("CityGeoName{}".format(lang))
-            items = cities.values()
-            self.percent_init("    > Fill {}".format(lang), len(items))
-            for city in items:
-                try:
-                    model = model_type.objects.get(city=city["model"])
-                except ObjectDoesNotExist:
-                    model = model_type()
-                    model.city = city["model"]
-                model.name = city[lang]
-                model.save()
-                self.percent()
-
-        self.debug(
-            "Removing regions without cities ...", color="yellow", tail=False
-        )
-        for region in Region.objects.all():
-            if region.cities.count() == 0:
-                region.delete()
-        self.debug(" ... Done", color="green", head=False)
+                        for name, checksum in checksums.items()
+                    ]
+                )
 
-        self.debug(
-            "Removing provinces without cities ...", color="yellow", tail=False
-        )
-        for province in Province.objects.all():
-            if province.cities.count() == 0:
-                province.delete()
-        self.debug(" ... Done", color="green", head=False)
+        if self.shadow is not None:
+            self.debug("Indexing shadow tables ...", color="blue")
+            with self.phase("shadow", "index"):
+                self.shadow.index()
+            self.debug("Swapping shadow tables ...", color="blue")
+            with self.phase("shadow", "swap"):
+                self.shadow.swap()
+
+        if consolidated_names():
+            self.debug("Consolidating names ...", color="blue")
+            with self.phase("consolidate", "names") as stats:
+                stats["rows"] = rebuild_translations()
+
+        if trigram_index() == "table":
+            self.debug("Indexing trigrams ...", color="blue")
+            with self.phase("trigrams", "names") as stats:
+                stats["rows"] = rebuild_trigrams()
+        elif trigram_index() == "pg_trgm":
+            with self.phase("trigrams", "names"):
+                index_trigrams()
 
         self.debug("All done !!!", color="green")
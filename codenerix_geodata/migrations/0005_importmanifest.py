@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_geodata', '0004_alter_city_options_alter_citygeonameen_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportManifest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+                ('kind', models.CharField(max_length=20, verbose_name='Kind')),
+                ('key', models.CharField(max_length=255, verbose_name='Key')),
+                ('checksum', models.CharField(max_length=40, verbose_name='Checksum')),
+                ('object_id', models.IntegerField(blank=True, null=True, verbose_name='Object ID')),
+            ],
+            options={
+                'abstract': False,
+                'default_permissions': ('add', 'change', 'delete', 'view', 'list', 'detail'),
+                'unique_together': {('kind', 'key')},
+            },
+        ),
+    ]
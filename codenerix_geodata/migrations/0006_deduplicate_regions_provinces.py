@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:15
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicates(model, parent):
+    '''
+    Keep the oldest row of every (parent, code) pair, rows referring to the
+    other ones are moved to it before they are deleted
+    '''
+    groups = model.objects.values(parent, 'code').annotate(count=Count('pk'), keep=Min('pk')).filter(count__gt=1)
+    for group in groups:
+        duplicates = list(model.objects.filter(**{parent: group[parent], 'code': group['code']}).exclude(pk=group['keep']).values_list('pk', flat=True))
+        for relation in model._meta.related_objects:
+            # Names (one to one) are deleted along their duplicate
+            if relation.one_to_one or relation.many_to_many:
+                continue
+            relation.related_model._base_manager.filter(**{'{}__in'.format(relation.field.name): duplicates}).update(**{relation.field.name: group['keep']})
+        model.objects.filter(pk__in=duplicates).delete()
+
+
+def deduplicate(apps, schema_editor):
+    # Regions first, merging them may leave duplicated provinces behind
+    merge_duplicates(apps.get_model('codenerix_geodata', 'Region'), 'country')
+    merge_duplicates(apps.get_model('codenerix_geodata', 'Province'), 'region')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_geodata', '0005_importmanifest'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+    ]
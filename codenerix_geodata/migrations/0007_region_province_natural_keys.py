@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_geodata', '0006_deduplicate_regions_provinces'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='province',
+            unique_together={('region', 'code')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='region',
+            unique_together={('country', 'code')},
+        ),
+    ]
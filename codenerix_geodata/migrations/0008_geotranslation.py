@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:33
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+
+GEONAME_MODEL = re.compile(r'^(Continent|Country|Region|Province|City)GeoName([A-Z]+)$')
+
+
+def consolidate(apps, schema_editor):
+    '''
+    Copy the names of the GeoName tables, only when consolidated names are
+    enabled (the consolidate_geodata_names command copies them later on)
+    '''
+    if not getattr(settings, 'CDNX_GEODATA_CONSOLIDATED_NAMES', False):
+        return
+    quote = schema_editor.connection.ops.quote_name
+    GeoTranslation = apps.get_model('codenerix_geodata', 'GeoTranslation')
+    for model in apps.get_app_config('codenerix_geodata').get_models():
+        match = GEONAME_MODEL.match(model.__name__)
+        if match is None:
+            continue
+        entity = match.group(1).lower()
+        schema_editor.execute(
+            'INSERT INTO {} (created, updated, entity, object_id, lang, name) SELECT created, updated, %s, {}, %s, name FROM {}'.format(quote(GeoTranslation._meta.db_table), quote('{}_id'.format(entity)), quote(model._meta.db_table)),
+            [entity, match.group(2).lower()],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_geodata', '0007_region_province_natural_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeoTranslation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+                ('entity', models.CharField(max_length=10, verbose_name='Entity')),
+                ('object_id', models.IntegerField(verbose_name='Object ID')),
+                ('lang', models.CharField(max_length=10, verbose_name='Language')),
+                ('name', models.CharField(max_length=100, verbose_name='Name')),
+            ],
+            options={
+                'abstract': False,
+                'default_permissions': ('add', 'change', 'delete', 'view', 'list', 'detail'),
+                'indexes': [models.Index(fields=['entity', 'name'], name='geodata_translation_name_idx')],
+                'unique_together': {('entity', 'object_id', 'lang')},
+            },
+        ),
+        migrations.RunPython(consolidate, migrations.RunPython.noop),
+    ]
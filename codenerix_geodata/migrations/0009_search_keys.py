@@ -0,0 +1,106 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:37
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+GEONAME_MODEL = re.compile(r'^(Continent|Country|Region|Province|City)GeoName([A-Z]+)$')
+
+
+def search_key(text):
+    # Same as codenerix_geodata.models.search_key when this was written
+    text = unicodedata.normalize('NFKD', text or '')
+    text = u''.join(char for char in text if not unicodedata.combining(char))
+    return u' '.join(text.casefold().split())[:100]
+
+
+def fill_search_keys(apps, schema_editor):
+    '''
+    Set the search key of the names already stored, GeoTranslation included
+    '''
+    quote = schema_editor.connection.ops.quote_name
+    tables = [apps.get_model('codenerix_geodata', 'GeoTranslation')._meta.db_table]
+    for model in apps.get_app_config('codenerix_geodata').get_models():
+        if GEONAME_MODEL.match(model.__name__):
+            tables.append(model._meta.db_table)
+    with schema_editor.connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute('SELECT id, name FROM {}'.format(quote(table)))
+            rows = [(search_key(name), pk) for pk, name in cursor.fetchall()]
+            for start in range(0, len(rows), 10000):
+                cursor.executemany('UPDATE {} SET search_key = %s WHERE id = %s'.format(quote(table)), rows[start:start + 10000])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_geodata', '0008_geotranslation'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='geotranslation',
+            name='geodata_translation_name_idx',
+        ),
+        migrations.AddField(
+            model_name='citygeonameen',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='citygeonamees',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='continentgeonameen',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='continentgeonamees',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='countrygeonameen',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='countrygeonamees',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='geotranslation',
+            name='search_key',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='provincegeonameen',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='provincegeonamees',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='regiongeonameen',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddField(
+            model_name='regiongeonamees',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=100, verbose_name='Search key'),
+        ),
+        migrations.AddIndex(
+            model_name='geotranslation',
+            index=models.Index(fields=['entity', 'search_key'], name='geodata_translation_key_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
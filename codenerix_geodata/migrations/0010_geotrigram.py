@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:42
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+GEONAME_MODEL = re.compile(r'^(Continent|Country|Region|Province|City)GeoName([A-Z]+)$')
+
+
+def index_trigrams(apps, schema_editor):
+    '''
+    Build the trigram index of the names, only when trigram searches are
+    enabled (the index_geodata_trigrams command builds it later on)
+    '''
+    if not getattr(settings, 'CDNX_GEODATA_TRIGRAM_SEARCH', False):
+        return
+    connection = schema_editor.connection
+    quote = connection.ops.quote_name
+    models_by_entity = {}
+    for model in apps.get_app_config('codenerix_geodata').get_models():
+        match = GEONAME_MODEL.match(model.__name__)
+        if match is not None:
+            models_by_entity.setdefault(match.group(1).lower(), []).append(model)
+
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for sources in models_by_entity.values():
+            for model in sources:
+                table = model._meta.db_table
+                schema_editor.execute('CREATE INDEX IF NOT EXISTS {} ON {} USING gin (search_key gin_trgm_ops)'.format(quote('{}_trgm'.format(table)), quote(table)))
+        return
+
+    table = quote(apps.get_model('codenerix_geodata', 'GeoTrigram')._meta.db_table)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        for entity, sources in models_by_entity.items():
+            found = {}
+            for model in sources:
+                for object_id, key in model.objects.values_list('{}_id'.format(entity), 'search_key').iterator():
+                    found.setdefault(object_id, set()).update(key[index:index + 3] for index in range(len(key) - 2))
+            rows = [(now, now, entity, object_id, trigram) for object_id, trigrams in found.items() for trigram in trigrams]
+            for start in range(0, len(rows), 10000):
+                cursor.executemany('INSERT INTO {} (created, updated, entity, object_id, trigram) VALUES (%s, %s, %s, %s, %s)'.format(table), rows[start:start + 10000])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('codenerix_geodata', '0009_search_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeoTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Updated')),
+                ('entity', models.CharField(max_length=10, verbose_name='Entity')),
+                ('object_id', models.IntegerField(verbose_name='Object ID')),
+                ('trigram', models.CharField(max_length=3, verbose_name='Trigram')),
+            ],
+            options={
+                'abstract': False,
+                'default_permissions': ('add', 'change', 'delete', 'view', 'list', 'detail'),
+                'indexes': [models.Index(fields=['entity', 'object_id'], name='geodata_trigram_object_idx')],
+                'unique_together': {('entity', 'trigram', 'object_id')},
+            },
+        ),
+        migrations.RunPython(index_trigrams, migrations.RunPython.noop),
+    ]
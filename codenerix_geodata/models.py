@@ -18,9 +18,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import unicodedata
+
+from django.apps import apps
 from django.conf import settings
-from django.db import models
-from django.db.models import Q
+from django.db import connection, models
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.db.models.query import ModelIterable
+from django.utils import timezone
 from django.utils.encoding import smart_str
 from django.utils.translation import gettext_lazy as _
 
@@ -28,16 +34,152 @@ from codenerix.models import CodenerixModel, GenInterface
 from codenerix_extensions.helpers import get_language_database
 
 
+def geo_name_alias(path):
+    return '_'.join(['geo_name'] + path.split('__')) if path else 'geo_name'
+
+
+class GeoNamesIterable(ModelIterable):
+    '''
+    Copies the names fetched by GeoQuerySet.with_names() to the objects they
+    belong to, the row itself and its parents loaded by select_related().
+    The row keeps every name under its geo_name_alias() as well, which is
+    the column the list views show and order by
+    '''
+
+    def __iter__(self):
+        related = self.queryset._geo_names
+        for obj in super().__iter__():
+            for path in ('',) + related:
+                value = obj.__dict__.get(geo_name_alias(path))
+                target = obj
+                for field in path.split('__') if path else []:
+                    target = getattr(target, field)
+                    if target is None:
+                        break
+                if target is not None:
+                    # Empty when missing in every language, __str__ falls
+                    # back to the code without querying again
+                    target.geo_name = value or ''
+            yield obj
+
+
+class GeoQuerySet(models.QuerySet):
+    _geo_names = None
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._geo_names = self._geo_names
+        return clone
+
+    def with_names(self, lang=None, fallbacks=(), related=None):
+        '''
+        Fetch the name of every row in "lang" (the language of the database
+        by default), or else in the first "fallbacks" language it has, in
+        the same query. The "related" parents (geo_parents of the model by
+        default) are loaded with their names as well, so __str__ of the rows
+        and their parents runs no query
+        '''
+        languages = [(lang or get_language_database()).lower()]
+        for fallback in fallbacks:
+            if fallback.lower() not in languages:
+                languages.append(fallback.lower())
+        if related is None:
+            related = self.model.geo_parents
+        related = tuple(related)
+
+        annotations = {}
+        for path in ('',) + related:
+            names = [F('{}{}__name'.format(path + '__' if path else '', language)) for language in languages]
+            if len(names) > 1:
+                # The importer stores missing names as '', fall back on those too
+                names = [NullIf(name, Value('')) for name in names]
+            annotations[geo_name_alias(path)] = Coalesce(*names) if len(names) > 1 else names[0]
+        queryset = self.annotate(**annotations)
+        if related:
+            queryset = queryset.select_related(*related)
+        queryset._geo_names = related
+        queryset._iterable_class = GeoNamesIterable
+        return queryset
+
+
+GeoManager = models.Manager.from_queryset(GeoQuerySet)
+
+
+class CodeManager(GeoManager):
+    def get_by_natural_key(self, code):
+        return self.get(code=code)
+
+
+class TimeZoneManager(models.Manager):
+    def get_by_natural_key(self, name):
+        return self.get(name=name)
+
+
+class RegionManager(GeoManager):
+    def get_by_natural_key(self, country, code):
+        return self.get(country__code=country, code=code)
+
+
+class ProvinceManager(GeoManager):
+    def get_by_natural_key(self, country, region, code):
+        return self.get(region__country__code=country, region__code=region, code=code)
+
+
+def consolidated_names():
+    '''
+    Names are copied to GeoTranslation when CDNX_GEODATA_CONSOLIDATED_NAMES
+    is enabled, searches in any language then use that table
+    '''
+    return getattr(settings, 'CDNX_GEODATA_CONSOLIDATED_NAMES', False)
+
+
+def search_key(text):
+    '''
+    Return the key names are searched by: casefolded, without accents and
+    with its whitespace collapsed, so "  MÁLAGA " and "malaga" share a key
+    '''
+    text = unicodedata.normalize('NFKD', text or '')
+    text = u''.join(char for char in text if not unicodedata.combining(char))
+    return u' '.join(text.casefold().split())[:100]
+
+
+def trigram_index():
+    '''
+    Return how names are indexed for substring searches when
+    CDNX_GEODATA_TRIGRAM_SEARCH is enabled: "pg_trgm" (GIN indexes on the
+    search keys) on PostgreSQL, "table" (GeoTrigram) on other databases
+    '''
+    if not getattr(settings, 'CDNX_GEODATA_TRIGRAM_SEARCH', False):
+        return None
+    return 'pg_trgm' if connection.vendor == 'postgresql' else 'table'
+
+
+def trigrams(key):
+    '''
+    Return the set of substrings of 3 characters of a search key
+    '''
+    return set(key[index:index + 3] for index in range(len(key) - 2))
+
+
 class GenGeoName(CodenerixModel):  # META: Abstract class
 
     class Meta(CodenerixModel.Meta):
         abstract = True
 
     name = models.CharField(_('Name'), max_length=100, blank=False)
+    search_key = models.CharField(_('Search key'), max_length=100, blank=True, editable=False, db_index=True)
+
+    # Set on every <Model>GeoName<LANG> class
+    geo_entity = None
+    geo_lang = None
 
     def __str__(self):
         return u'{}'.format(smart_str(self.name))
 
+    def save(self, *args, **kwargs):
+        self.search_key = search_key(self.name)
+        super().save(*args, **kwargs)
+
     def __unicode__(self):
         return self.__str__()
 
@@ -50,12 +192,22 @@ class GenGeoName(CodenerixModel):  # META: Abstract class
 class Continent(CodenerixModel):
     code = models.CharField(_('Code'), max_length=2, unique=True, blank=False)
 
+    objects = CodeManager()
+
+    # Parents loaded with their names by with_names()
+    geo_parents = ()
+
+    def natural_key(self):
+        return (self.code,)
+
     def __str__(self):
-        lang = get_language_database()
-        lang_obj = getattr(self, '{}'.format(lang), None)
-        if lang_obj and lang_obj.name:
-            txt = lang_obj.name
-        else:
+        # Fetched along the row by with_names()
+        txt = getattr(self, 'geo_name', None)
+        if txt is None:
+            lang = get_language_database()
+            lang_obj = getattr(self, '{}'.format(lang), None)
+            txt = lang_obj and lang_obj.name
+        if not txt:
             txt = self.code
         return u"{}".format(smart_str(txt))
 
@@ -82,12 +234,22 @@ class Country(CodenerixModel):
     code = models.CharField(_('Code'), max_length=2, unique=True, blank=False)
     continent = models.ForeignKey(Continent, on_delete=models.CASCADE, verbose_name=_('Continent'), related_name='countries', null=False)
 
+    objects = CodeManager()
+
+    # Parents loaded with their names by with_names()
+    geo_parents = ('continent',)
+
+    def natural_key(self):
+        return (self.code,)
+
     def __str__(self):
-        lang = get_language_database()
-        lang_obj = getattr(self, '{}'.format(lang), None)
-        if lang_obj and lang_obj.name:
-            txt = lang_obj.name
-        else:
+        # Fetched along the row by with_names()
+        txt = getattr(self, 'geo_name', None)
+        if txt is None:
+            lang = get_language_database()
+            lang_obj = getattr(self, '{}'.format(lang), None)
+            txt = lang_obj and lang_obj.name
+        if not txt:
             txt = self.code
         return u"{}".format(smart_str(txt))
 
@@ -114,6 +276,11 @@ class Country(CodenerixModel):
 class TimeZone(CodenerixModel):
     name = models.CharField(_('Name'), max_length=50, unique=True, blank=False)
 
+    objects = TimeZoneManager()
+
+    def natural_key(self):
+        return (self.name,)
+
     def __str__(self):
         return u"{}".format(smart_str(self.name))
 
@@ -137,15 +304,30 @@ class TimeZone(CodenerixModel):
 
 
 class Region(CodenerixModel):
+
+    class Meta(CodenerixModel.Meta):
+        unique_together = (('country', 'code'),)
+
     country = models.ForeignKey(Country, on_delete=models.CASCADE, verbose_name=_('Country'), null=False, related_name='regions')
     code = models.CharField(_('Code'), max_length=3, blank=False)
 
+    objects = RegionManager()
+
+    # Parents loaded with their names by with_names()
+    geo_parents = ('country', 'country__continent')
+
+    def natural_key(self):
+        return self.country.natural_key() + (self.code,)
+    natural_key.dependencies = ['codenerix_geodata.country']
+
     def __str__(self):
-        lang = get_language_database()
-        lang_obj = getattr(self, '{}'.format(lang), None)
-        if lang_obj and lang_obj.name:
-            txt = lang_obj.name
-        else:
+        # Fetched along the row by with_names()
+        txt = getattr(self, 'geo_name', None)
+        if txt is None:
+            lang = get_language_database()
+            lang_obj = getattr(self, '{}'.format(lang), None)
+            txt = lang_obj and lang_obj.name
+        if not txt:
             txt = self.code
         return u"{}".format(smart_str(txt))
 
@@ -170,15 +352,30 @@ class Region(CodenerixModel):
 
 
 class Province(CodenerixModel):
+
+    class Meta(CodenerixModel.Meta):
+        unique_together = (('region', 'code'),)
+
     region = models.ForeignKey(Region, on_delete=models.CASCADE, verbose_name=_('Region'), null=False, related_name='provinces')
     code = models.CharField(_('Code'), max_length=3, blank=False)
 
+    objects = ProvinceManager()
+
+    # Parents loaded with their names by with_names()
+    geo_parents = ('region', 'region__country', 'region__country__continent')
+
+    def natural_key(self):
+        return self.region.natural_key() + (self.code,)
+    natural_key.dependencies = ['codenerix_geodata.region']
+
     def __str__(self):
-        lang = get_language_database()
-        lang_obj = getattr(self, '{}'.format(lang), None)
-        if lang_obj and lang_obj.name:
-            txt = lang_obj.name
-        else:
+        # Fetched along the row by with_names()
+        txt = getattr(self, 'geo_name', None)
+        if txt is None:
+            lang = get_language_database()
+            lang_obj = getattr(self, '{}'.format(lang), None)
+            txt = lang_obj and lang_obj.name
+        if not txt:
             txt = self.code
         return u"{}".format(smart_str(txt))
 
@@ -208,12 +405,19 @@ class City(CodenerixModel):
     province = models.ForeignKey(Province, on_delete=models.CASCADE, verbose_name=_('Province'), null=True, related_name='cities')
     time_zone = models.ForeignKey(TimeZone, on_delete=models.CASCADE, verbose_name=_('Timezone'), null=False, related_name='cities')
 
+    objects = GeoManager()
+
+    # Parents loaded with their names by with_names()
+    geo_parents = ('country', 'country__continent', 'region', 'province')
+
     def __str__(self):
-        lang = get_language_database()
-        lang_obj = getattr(self, '{}'.format(lang), None)
-        if lang_obj and lang_obj.name:
-            txt = lang_obj.name
-        else:
+        # Fetched along the row by with_names()
+        txt = getattr(self, 'geo_name', None)
+        if txt is None:
+            lang = get_language_database()
+            lang_obj = getattr(self, '{}'.format(lang), None)
+            txt = lang_obj and lang_obj.name
+        if not txt:
             txt = self.pk
         return u"{}".format(smart_str(txt))
 
@@ -227,6 +431,159 @@ class City(CodenerixModel):
         ]
 
 
+class ImportManifest(CodenerixModel):
+    '''
+    Checksum of every data file and every row loaded by an incremental
+    populate_geodata run
+    '''
+
+    class Meta(CodenerixModel.Meta):
+        unique_together = (('kind', 'key'),)
+
+    kind = models.CharField(_('Kind'), max_length=20, blank=False)
+    key = models.CharField(_('Key'), max_length=255, blank=False)
+    checksum = models.CharField(_('Checksum'), max_length=40, blank=False)
+    object_id = models.IntegerField(_('Object ID'), blank=True, null=True)
+
+    def __str__(self):
+        return u"{} {}".format(smart_str(self.kind), smart_str(self.key))
+
+    def __unicode__(self):
+        return self.__str__()
+
+    def __fields__(self, info):
+        return [
+            ('kind', _('Kind'), 100),
+            ('key', _('Key'), 100),
+            ('checksum', _('Checksum'), 100),
+            ('object_id', _('Object ID'), 100),
+        ]
+
+
+class GeoTranslation(CodenerixModel):
+    '''
+    Name of a continent, country, region, province or city in one language,
+    a copy of the <Model>GeoName<LANG> tables kept when
+    CDNX_GEODATA_CONSOLIDATED_NAMES is enabled
+    '''
+
+    class Meta(CodenerixModel.Meta):
+        unique_together = (('entity', 'object_id', 'lang'),)
+        indexes = [
+            # Operator classes (only used by PostgreSQL) so LIKE 'prefix%' uses the index
+            models.Index(fields=['entity', 'search_key'], name='geodata_translation_key_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ]
+
+    entity = models.CharField(_('Entity'), max_length=10, blank=False)
+    object_id = models.IntegerField(_('Object ID'), blank=False, null=False)
+    lang = models.CharField(_('Language'), max_length=10, blank=False)
+    name = models.CharField(_('Name'), max_length=100, blank=False)
+    search_key = models.CharField(_('Search key'), max_length=100, blank=True, editable=False)
+
+    def __str__(self):
+        return u"{}".format(smart_str(self.name))
+
+    def __unicode__(self):
+        return self.__str__()
+
+    def __fields__(self, info):
+        return [
+            ('entity', _('Entity'), 100),
+            ('object_id', _('Object ID'), 100),
+            ('lang', _('Language'), 100),
+            ('name', _('Name'), 100),
+        ]
+
+
+class GeoTrigramManager(models.Manager):
+
+    def refresh(self, entity, object_id):
+        '''
+        Index again the trigrams of the names of one entity in every language
+        '''
+        found = set()
+        for lang_code in settings.LANGUAGES_DATABASES:
+            model = apps.get_model('codenerix_geodata', '{}GeoName{}'.format(entity.capitalize(), lang_code))
+            for key in model.objects.filter(**{'{}_id'.format(entity): object_id}).values_list('search_key', flat=True):
+                found.update(trigrams(key))
+        self.filter(entity=entity, object_id=object_id).delete()
+        self.bulk_create([self.model(entity=entity, object_id=object_id, trigram=trigram) for trigram in sorted(found)])
+
+
+class GeoTrigram(CodenerixModel):
+    '''
+    Trigram of the search keys of a continent, country, region, province or
+    city in any language, the substring index of the names kept when
+    CDNX_GEODATA_TRIGRAM_SEARCH is enabled on databases without pg_trgm
+    '''
+
+    objects = GeoTrigramManager()
+
+    class Meta(CodenerixModel.Meta):
+        # Covers the lookup of the entities having a trigram
+        unique_together = (('entity', 'trigram', 'object_id'),)
+        indexes = [
+            models.Index(fields=['entity', 'object_id'], name='geodata_trigram_object_idx'),
+        ]
+
+    entity = models.CharField(_('Entity'), max_length=10, blank=False)
+    object_id = models.IntegerField(_('Object ID'), blank=False, null=False)
+    trigram = models.CharField(_('Trigram'), max_length=3, blank=False)
+
+    def __str__(self):
+        return u"{}".format(smart_str(self.trigram))
+
+    def __unicode__(self):
+        return self.__str__()
+
+    def __fields__(self, info):
+        return [
+            ('entity', _('Entity'), 100),
+            ('object_id', _('Object ID'), 100),
+            ('trigram', _('Trigram'), 100),
+        ]
+
+
+class DatasetVersionManager(models.Manager):
+
+    def current(self):
+        '''
+        Return the version of the geodata stored, 0 before the first bump
+        '''
+        return self.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    def bump(self):
+        '''
+        Record that the geodata changed
+        '''
+        if not self.filter(pk=1).update(version=F('version') + 1, updated=timezone.now()):
+            self.get_or_create(pk=1, defaults={'version': 1})
+
+
+class DatasetVersion(CodenerixModel):
+    '''
+    Version of the geodata, bumped by populate_geodata, load_geodata_snapshot
+    and every change saved through the ORM, in-process caches compare it with
+    the version they loaded
+    '''
+
+    objects = DatasetVersionManager()
+
+    version = models.PositiveIntegerField(_('Version'), default=0)
+
+    def __str__(self):
+        return u"{}".format(self.version)
+
+    def __unicode__(self):
+        return self.__str__()
+
+    def __fields__(self, info):
+        return [
+            ('version', _('Version'), 100),
+            ('updated', _('Updated'), 100),
+        ]
+
+
 class GeoAddress(GenInterface):  # META: Abstract class
     class Meta(GenInterface.Meta):
         abstract = True
@@ -289,4 +646,6 @@ for field, model in MODELS:
     for lang_code in settings.LANGUAGES_DATABASES:
         query = "class {}GeoName{}(GenGeoName):\n".format(model, lang_code)
         query += "    {} = models.OneToOneField({}, on_delete=models.CASCADE, blank=False, null=False, related_name='{}')\n".format(field, model, lang_code.lower())
+        query += "    geo_entity = '{}'\n".format(field)
+        query += "    geo_lang = '{}'\n".format(lang_code.lower())
         exec(query)
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shadow copies of the geodata tables swapped in with a single transaction.
+
+An import into shadow tables goes through these steps:
+
+    create()    copy the live tables into "<table>__shadow" tables, without
+                secondary indexes
+    start()     point the models to the shadow tables in this process, the
+                import writes there while readers keep using the live ones
+    index()     build the indexes of the shadow tables once loaded
+    swap()      drop the live tables and rename the shadow ones in their
+                place in one transaction, foreign keys are attached again
+    stop()      point the models back to their tables
+
+Readers see either the old dataset or the new one, the live tables are
+only touched by swap().
+"""
+
+import re
+
+from django.db import connection, transaction
+
+SUFFIX = "__shadow"
+
+
+class ShadowTables(object):
+    vendor = None
+
+    def __init__(self, models):
+        self.models = models
+        self.tables = [model._meta.db_table for model in models]
+        self.started = False
+
+    def shadow(self, table):
+        return "{}{}".format(table, SUFFIX)
+
+    def quote(self, name):
+        return connection.ops.quote_name(name)
+
+    def rename(self, model, table):
+        model._meta.db_table = table
+        # Columns cache the table name they were first compiled with
+        for field in model._meta.concrete_fields:
+            field.__dict__.pop("cached_col", None)
+
+    def start(self):
+        for model, table in zip(self.models, self.tables):
+            self.rename(model, self.shadow(table))
+        self.started = True
+
+    def stop(self):
+        for model, table in zip(self.models, self.tables):
+            self.rename(model, table)
+        self.started = False
+
+    def execute(self, cursor, sql, params=None):
+        cursor.execute(sql, params)
+
+    def drop(self):
+        """Remove the shadow tables left by an interrupted import"""
+        with connection.cursor() as cursor:
+            for table in reversed(self.tables):
+                self.execute(
+                    cursor,
+                    "DROP TABLE IF EXISTS {}".format(
+                        self.quote(self.shadow(table))
+                    ),
+                )
+
+
+class SQLiteShadowTables(ShadowTables):
+    """The shadow tables are created from the statements stored in
+    sqlite_master, their foreign keys already name the live tables"""
+
+    vendor = "sqlite"
+
+    def schema(self, cursor, kind, table):
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type = %s AND tbl_name = %s AND sql IS NOT NULL",
+            [kind, table],
+        )
+        return cursor.fetchall()
+
+    def index_name(self, name):
+        # SQLite can not rename indexes, they keep the name they were built
+        # with and every swap alternates between both names
+        if name.endswith(SUFFIX):
+            return name[: -len(SUFFIX)]
+        return self.shadow(name)
+
+    def create(self):
+        self.drop()
+        # Shadow rows refer to parents that are only in the shadow tables
+        if not connection.disable_constraint_checking():
+            raise RuntimeError("Foreign key checks can not be disabled")
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table in self.tables:
+                ((_, sql),) = self.schema(cursor, "table", table)
+                self.execute(
+                    cursor,
+                    sql.replace(
+                        self.quote(table), self.quote(self.shadow(table)), 1
+                    ),
+                )
+                self.execute(
+                    cursor,
+                    "INSERT INTO {} SELECT * FROM {}".format(
+                        self.quote(self.shadow(table)), self.quote(table)
+                    ),
+                )
+
+    def index(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table in self.tables:
+                for name, sql in self.schema(cursor, "index", table):
+                    sql = sql.replace(
+                        self.quote(name), self.quote(self.index_name(name)), 1
+                    )
+                    sql = sql.replace(
+                        "ON {}".format(self.quote(table)),
+                        "ON {}".format(self.quote(self.shadow(table))),
+                        1,
+                    )
+                    self.execute(cursor, sql)
+
+    def swap(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            # References in other tables keep naming the live tables
+            self.execute(cursor, "PRAGMA legacy_alter_table = ON")
+            for table in reversed(self.tables):
+                self.execute(cursor, "DROP TABLE {}".format(self.quote(table)))
+            for table in self.tables:
+                self.execute(
+                    cursor,
+                    "ALTER TABLE {} RENAME TO {}".format(
+                        self.quote(self.shadow(table)), self.quote(table)
+                    ),
+                )
+            self.execute(cursor, "PRAGMA legacy_alter_table = OFF")
+        self.stop()
+        connection.enable_constraint_checking()
+        connection.check_constraints(table_names=self.tables)
+
+    def drop(self):
+        super().drop()
+        connection.enable_constraint_checking()
+
+
+class PostgreSQLShadowTables(ShadowTables):
+    """The shadow tables are created with LIKE, their indexes and foreign
+    keys are replayed from the catalog of the live tables
+
+    Identity columns get a sequence of their own in the shadow tables,
+    serial columns keep drawing from the sequence of the live table, which
+    is handed to the shadow table before the live one is dropped.
+    """
+
+    vendor = "postgresql"
+    INDEX = re.compile(r"^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON )(\S+)( .*)$")
+
+    def create(self):
+        self.drop()
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table in self.tables:
+                self.execute(
+                    cursor,
+                    "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS "
+                    "INCLUDING IDENTITY INCLUDING GENERATED)".format(
+                        self.quote(self.shadow(table)), self.quote(table)
+                    ),
+                )
+                self.execute(
+                    cursor,
+                    "INSERT INTO {} SELECT * FROM {}".format(
+                        self.quote(self.shadow(table)), self.quote(table)
+                    ),
+                )
+                # New identity sequences start at 1 below the copied ids
+                self.restart(cursor, self.shadow(table))
+
+    def qualified(self, schema, name):
+        return "{}.{}".format(self.quote(schema), self.quote(name))
+
+    def sequences(self, cursor, table):
+        """Return (schema, sequence, column, dependency) of the sequences
+        owned by the columns of a table, the dependency is "a" for serial
+        columns and "i" for identity ones"""
+        cursor.execute(
+            "SELECT n.nspname, s.relname, a.attname, d.deptype "
+            "FROM pg_depend d "
+            "JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S' "
+            "JOIN pg_namespace n ON n.oid = s.relnamespace "
+            "JOIN pg_attribute a ON a.attrelid = d.refobjid "
+            "AND a.attnum = d.refobjsubid "
+            "WHERE d.refobjid = %s::regclass AND d.deptype IN ('a', 'i')",
+            [table],
+        )
+        return cursor.fetchall()
+
+    def restart(self, cursor, table):
+        """Move the sequences of a table past the ids it holds, ids are
+        copied and written explicitly"""
+        for schema, sequence, column, _ in self.sequences(cursor, table):
+            self.execute(
+                cursor,
+                "SELECT setval(%s, COALESCE(MAX({column}), 1), "
+                "MAX({column}) IS NOT NULL) FROM {table}".format(
+                    column=self.quote(column), table=self.quote(table)
+                ),
+                [self.qualified(schema, sequence)],
+            )
+
+    def indexes(self, cursor, table):
+        """Return (name, definition, constraint type) of the indexes of a
+        table, the type is "p" or "u" when the index backs a constraint"""
+        cursor.execute(
+            "SELECT i.relname, pg_get_indexdef(i.oid), c.contype "
+            "FROM pg_index x "
+            "JOIN pg_class i ON i.oid = x.indexrelid "
+            "LEFT JOIN pg_constraint c ON c.conindid = x.indexrelid "
+            "AND c.contype IN ('p', 'u') "
+            "WHERE x.indrelid = %s::regclass",
+            [table],
+        )
+        return cursor.fetchall()
+
+    def foreign_keys(self, cursor):
+        """Return (schema, table, name, definition) of the foreign keys from
+        or to any geodata table"""
+        cursor.execute(
+            "SELECT n.nspname, r.relname, c.conname, "
+            "pg_get_constraintdef(c.oid) FROM pg_constraint c "
+            "JOIN pg_class r ON r.oid = c.conrelid "
+            "JOIN pg_namespace n ON n.oid = r.relnamespace "
+            "WHERE c.contype = 'f' AND (c.conrelid = ANY(%s::regclass[]) "
+            "OR c.confrelid = ANY(%s::regclass[]))",
+            [self.tables, self.tables],
+        )
+        return cursor.fetchall()
+
+    def index(self):
+        self.renames = []
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table in self.tables:
+                shadow = self.shadow(table)
+                for name, sql, constraint in self.indexes(cursor, table):
+                    temporary = self.shadow(name)[:63]
+                    head, _, _, _, tail = self.INDEX.match(sql).groups()
+                    self.execute(
+                        cursor,
+                        "{}{} ON {}{}".format(
+                            head,
+                            self.quote(temporary),
+                            self.quote(shadow),
+                            tail,
+                        ),
+                    )
+                    if constraint:
+                        kind = "PRIMARY KEY" if constraint == "p" else "UNIQUE"
+                        self.execute(
+                            cursor,
+                            "ALTER TABLE {} ADD CONSTRAINT {} {} "
+                            "USING INDEX {}".format(
+                                self.quote(shadow),
+                                self.quote(temporary),
+                                kind,
+                                self.quote(temporary),
+                            ),
+                        )
+                    self.renames.append((temporary, name))
+
+    def swap(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            foreign_keys = self.foreign_keys(cursor)
+            for schema, table, name, _ in foreign_keys:
+                if table not in self.tables:
+                    self.execute(
+                        cursor,
+                        "ALTER TABLE {} DROP CONSTRAINT {}".format(
+                            self.qualified(schema, table), self.quote(name)
+                        ),
+                    )
+            # The defaults of the shadow serial columns call the sequences
+            # of the live tables, dropping them would drop the sequences
+            for table in self.tables:
+                for schema, sequence, column, dependency in self.sequences(
+                    cursor, table
+                ):
+                    if dependency == "a":
+                        self.execute(
+                            cursor,
+                            "ALTER SEQUENCE {} OWNED BY {}.{}".format(
+                                self.qualified(schema, sequence),
+                                self.quote(self.shadow(table)),
+                                self.quote(column),
+                            ),
+                        )
+            self.execute(
+                cursor,
+                "DROP TABLE {}".format(
+                    ", ".join(self.quote(table) for table in self.tables)
+                ),
+            )
+            for table in self.tables:
+                self.execute(
+                    cursor,
+                    "ALTER TABLE {} RENAME TO {}".format(
+                        self.quote(self.shadow(table)), self.quote(table)
+                    ),
+                )
+            for temporary, name in self.renames:
+                self.execute(
+                    cursor,
+                    "ALTER INDEX {} RENAME TO {}".format(
+                        self.quote(temporary), self.quote(name)
+                    ),
+                )
+            # Rows written by the import gave their ids explicitly
+            for table in self.tables:
+                self.restart(cursor, table)
+            # Definitions name the tables, they now resolve to the new ones.
+            # NOT VALID keeps the swap short, rows are checked afterwards
+            for schema, table, name, definition in foreign_keys:
+                self.execute(
+                    cursor,
+                    "ALTER TABLE {} ADD CONSTRAINT {} {} NOT VALID".format(
+                        self.qualified(schema, table),
+                        self.quote(name),
+                        definition,
+                    ),
+                )
+        self.stop()
+        with connection.cursor() as cursor:
+            for schema, table, name, _ in foreign_keys:
+                self.execute(
+                    cursor,
+                    "ALTER TABLE {} VALIDATE CONSTRAINT {}".format(
+                        self.qualified(schema, table), self.quote(name)
+                    ),
+                )
+
+    def drop(self):
+        with connection.cursor() as cursor:
+            for table in reversed(self.tables):
+                self.execute(
+                    cursor,
+                    "DROP TABLE IF EXISTS {} CASCADE".format(
+                        self.quote(self.shadow(table))
+                    ),
+                )
+
+
+SHADOW_TABLES = {
+    "sqlite": SQLiteShadowTables,
+    "postgresql": PostgreSQLShadowTables,
+}
+
+
+def get_shadow_tables(models):
+    """Return the shadow tables of "models" for the default database"""
+    if connection.vendor not in SHADOW_TABLES:
+        raise ValueError(
+            "Shadow tables are not supported on {} databases".format(
+                connection.vendor
+            )
+        )
+    return SHADOW_TABLES[connection.vendor](models)
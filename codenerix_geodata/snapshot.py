@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Binary snapshot of the geodata tables.
+
+A snapshot file is laid out as:
+
+    MAGIC                8 bytes
+    FORMAT_VERSION       uint32
+    sha256 of payload    32 bytes
+    payload              zlib compressed
+
+and the payload, once decompressed, as:
+
+    metadata             JSON document, length prefixed
+    string pool          strings joined by NUL, length prefixed
+    tables               for every table its name, number of rows and
+                         columns, then every column as its name, its type
+                         ("i" integer or "s" string) and one int64 array
+
+String columns store indexes into the pool. Null values are stored as -1,
+primary keys and codes are never negative. Integers are little endian.
+"""
+
+import hashlib
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+from django.apps import apps
+from django.conf import settings
+
+MAGIC = b"CGEOSNAP"
+FORMAT_VERSION = 1
+NULL = -1
+
+# Written and loaded in this order so parents always exist first
+MODELS = ("Continent", "Country", "TimeZone", "Region", "Province", "City")
+GEONAME_MODELS = ("Continent", "Country", "Region", "Province", "City")
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def snapshot_models(languages=None):
+    """Return the models stored in a snapshot, parents first"""
+    if languages is None:
+        languages = settings.LANGUAGES_DATABASES
+    models = [apps.get_model("codenerix_geodata", name) for name in MODELS]
+    for lang in languages:
+        for name in GEONAME_MODELS:
+            models.append(
+                apps.get_model(
+                    "codenerix_geodata", "{}GeoName{}".format(name, lang)
+                )
+            )
+    return models
+
+
+def snapshot_columns(model):
+    """Return (attname, type) of the fields stored for a model, the
+    CodenerixModel timestamps are set again when the snapshot is loaded"""
+    columns = []
+    for field in model._meta.concrete_fields:
+        if field.name in ("created", "updated"):
+            continue
+        if field.get_internal_type() == "CharField":
+            columns.append((field.attname, "s"))
+        else:
+            columns.append((field.attname, "i"))
+    return columns
+
+
+def pack_array(values):
+    data = array("q", values)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack_array(raw):
+    data = array("q")
+    data.frombytes(raw)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data
+
+
+class Writer(object):
+    def __init__(self):
+        self.chunks = []
+        self.pool = {}
+
+    def intern(self, value):
+        if value is None:
+            return NULL
+        index = self.pool.get(value)
+        if index is None:
+            index = len(self.pool)
+            self.pool[value] = index
+        return index
+
+    def blob(self, data):
+        self.chunks.append(struct.pack("<Q", len(data)))
+        self.chunks.append(data)
+
+    def table(self, name, columns, rows):
+        """Add a table, "rows" is a list of tuples following "columns" """
+        self.blob(name.encode("utf-8"))
+        self.chunks.append(struct.pack("<QI", len(rows), len(columns)))
+        for index, (column, kind) in enumerate(columns):
+            if kind == "s":
+                values = [self.intern(row[index]) for row in rows]
+            else:
+                values = [
+                    NULL if row[index] is None else row[index] for row in rows
+                ]
+            self.blob(column.encode("utf-8"))
+            self.chunks.append(kind.encode("ascii"))
+            self.blob(pack_array(values))
+
+    def payload(self, metadata):
+        strings = sorted(self.pool, key=self.pool.get)
+        for value in strings:
+            if "\0" in value:
+                raise SnapshotError(
+                    "NUL character found in {!r}".format(value)
+                )
+        head = []
+        for data in (
+            json.dumps(metadata, sort_keys=True).encode("utf-8"),
+            "\0".join(strings).encode("utf-8"),
+        ):
+            head.append(struct.pack("<Q", len(data)))
+            head.append(data)
+        head.append(struct.pack("<Q", len(strings)))
+        return b"".join(head + self.chunks)
+
+
+class Reader(object):
+    def __init__(self, payload):
+        self.payload = payload
+        self.offset = 0
+
+    def take(self, size):
+        data = self.payload[self.offset : self.offset + size]
+        if len(data) != size:
+            raise SnapshotError("Snapshot is truncated")
+        self.offset += size
+        return data
+
+    def unpack(self, layout):
+        return struct.unpack(layout, self.take(struct.calcsize(layout)))
+
+    def blob(self):
+        return self.take(self.unpack("<Q")[0])
+
+
+def write_snapshot(stream, tables, metadata):
+    """Write "tables", a list of (name, columns, rows), into "stream" and
+    return the checksum of the payload"""
+    writer = Writer()
+    for name, columns, rows in tables:
+        writer.table(name, columns, rows)
+    payload = writer.payload(metadata)
+    checksum = hashlib.sha256(payload).digest()
+    stream.write(MAGIC)
+    stream.write(struct.pack("<I", FORMAT_VERSION))
+    stream.write(checksum)
+    stream.write(zlib.compress(payload, 6))
+    return checksum.hex()
+
+
+def read_snapshot(stream):
+    """Return (metadata, tables) of a snapshot, tables maps every table
+    name to (column names, rows as a list of tuples)"""
+    if stream.read(len(MAGIC)) != MAGIC:
+        raise SnapshotError("Not a geodata snapshot")
+    (version,) = struct.unpack("<I", stream.read(4))
+    if version != FORMAT_VERSION:
+        raise SnapshotError(
+            "Snapshot format {} is not supported (expected {})".format(
+                version, FORMAT_VERSION
+            )
+        )
+    checksum = stream.read(32)
+    try:
+        payload = zlib.decompress(stream.read())
+    except zlib.error as e:
+        raise SnapshotError("Snapshot is corrupted: {}".format(e))
+    if hashlib.sha256(payload).digest() != checksum:
+        raise SnapshotError("Snapshot checksum does not match")
+
+    reader = Reader(payload)
+    metadata = json.loads(reader.blob().decode("utf-8"))
+    strings = reader.blob().decode("utf-8")
+    (count,) = reader.unpack("<Q")
+    pool = strings.split("\0") if count else []
+
+    tables = {}
+    while reader.offset < len(payload):
+        name = reader.blob().decode("utf-8")
+        rows, width = reader.unpack("<QI")
+        names = []
+        values = []
+        for i in range(width):
+            names.append(reader.blob().decode("utf-8"))
+            kind = reader.take(1).decode("ascii")
+            data = unpack_array(reader.blob())
+            if len(data) != rows:
+                raise SnapshotError(
+                    "Column {}.{} is truncated".format(name, names[-1])
+                )
+            if kind == "s":
+                values.append([None if v == NULL else pool[v] for v in data])
+            else:
+                values.append([None if v == NULL else v for v in data])
+        tables[name] = (names, list(zip(*values)) if width else [])
+    return metadata, tables
@@ -0,0 +1,725 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import json
+import shutil
+import tempfile
+from collections import defaultdict
+from contextlib import redirect_stdout
+from io import StringIO
+from os.path import join
+from unittest import mock, skipUnless
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.contrib.auth.models import AnonymousUser
+from django.test.utils import CaptureQueriesContext
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+from codenerix_geodata.deferred import (
+    DeferredIndexes,
+    SQLiteDeferredIndexes,
+)
+from codenerix_geodata.management.commands.populate_geodata import Command
+from codenerix_geodata.loaders import (
+    LOADERS,
+    OrmLoader,
+    PostgreSQLLoader,
+    SQLiteLoader,
+    get_loader,
+)
+from codenerix_geodata.models import (
+    City,
+    Continent,
+    ContinentGeoNameEN,
+    Country,
+    GeoTranslation,
+    GeoTrigram,
+    Province,
+    Region,
+    TimeZone,
+    search_key,
+    trigrams,
+)
+from codenerix_geodata import views
+from codenerix_geodata.shadow import SHADOW_TABLES
+from codenerix_geodata.snapshot import snapshot_columns, snapshot_models
+
+COUNTRY_HEADER = [
+    "geoname_id",
+    "locale_code",
+    "continent_code",
+    "continent_name",
+    "country_iso_code",
+    "country_name",
+]
+CITY_HEADER = COUNTRY_HEADER + [
+    "subdivision_1_iso_code",
+    "subdivision_1_name",
+    "subdivision_2_iso_code",
+    "subdivision_2_name",
+    "city_name",
+    "metro_code",
+    "time_zone",
+]
+COUNTRIES = [
+    ("2510769", "EU", "Europe", "ES", "Spain"),
+    ("2264397", "EU", "Europe", "PT", "Portugal"),
+    ("3017382", "EU", "Europe", "FR", "France"),
+    ("6252001", "NA", "North America", "US", "United States"),
+]
+CITIES = [
+    ("2521978", 0, "AN", "Andalusia", "AL", "Almería", "Almería", ""),
+    ("2514256", 0, "AN", "Andalusia", "MA", "Málaga", "Málaga", ""),
+    ("3117735", 0, "MD", "Madrid", "M", "Madrid", "Madrid", ""),
+    ("2267057", 1, "11", "Lisbon", "", "", "Lisbon", ""),
+    ("2735943", 1, "", "", "", "", "Porto", ""),
+    ("5128581", 3, "NY", "New York", "", "", "New York", "501"),
+]
+TIME_ZONES = {
+    "ES": "Europe/Madrid",
+    "PT": "Europe/Lisbon",
+    "US": "America/New_York",
+}
+# Names of the other languages are the English ones
+SPANISH = {
+    "Europe": "Europa",
+    "North America": "Norteamérica",
+    "Spain": "España",
+    "Andalusia": "Andalucía",
+    "Lisbon": "Lisboa",
+    "New York": "Nueva York",
+}
+
+
+def translate(name, lang):
+    if lang == "ES":
+        return SPANISH.get(name, name)
+    return name
+
+
+def write_locations(path, lang, cities=CITIES):
+    """Write small Country and City location files in the MaxMind format"""
+    locale = lang.lower()
+    with open(
+        join(path, "GeoLite2-Country-Locations-{}.csv".format(locale)),
+        "w",
+        newline="",
+        encoding="utf-8",
+    ) as stream:
+        writer = csv.writer(stream)
+        writer.writerow(COUNTRY_HEADER)
+        for geoid, continent, continent_name, code, name in COUNTRIES:
+            writer.writerow(
+                [
+                    geoid,
+                    locale,
+                    continent,
+                    translate(continent_name, lang),
+                    code,
+                    translate(name, lang),
+                ]
+            )
+    with open(
+        join(path, "GeoLite2-City-Locations-{}.csv".format(locale)),
+        "w",
+        newline="",
+        encoding="utf-8",
+    ) as stream:
+        writer = csv.writer(stream)
+        writer.writerow(CITY_HEADER)
+        for geoid, country, *subdivisions, name, metro in cities:
+            _, continent, continent_name, code, country_name = COUNTRIES[
+                country
+            ]
+            writer.writerow(
+                [geoid, locale, continent, translate(continent_name, lang)]
+                + [code, translate(country_name, lang)]
+                + [
+                    translate(value, lang) if number % 2 else value
+                    for number, value in enumerate(subdivisions)
+                ]
+                + [translate(name, lang), metro, TIME_ZONES[code]]
+            )
+
+
+def geoname_model(model, lang):
+    return apps.get_model(
+        "codenerix_geodata", "{}GeoName{}".format(model, lang)
+    )
+
+
+def stored_rows():
+    """Return the rows of every geodata table, the ids given by the
+    database are replaced by the natural keys of the rows"""
+    natural = {
+        "continent_id": ["continent__code"],
+        "time_zone_id": ["time_zone__name"],
+        "region_id": ["region__country_id", "region__code"],
+        "province_id": [
+            "province__region__country_id",
+            "province__region__code",
+            "province__code",
+        ],
+    }
+    rows = {}
+    for model in snapshot_models():
+        fields = []
+        for column, kind in snapshot_columns(model):
+            if column != "id" or model in (Country, City):
+                fields.extend(natural.get(column, [column]))
+        rows[model._meta.model_name] = sorted(
+            model.objects.values_list(*fields), key=repr
+        )
+    return rows
+
+
+def add_orphans(count):
+    """Spanish regions with a province and their names, without cities"""
+    spain = Country.objects.get(code="ES")
+    regions = []
+    for number in range(count):
+        code = "Z{}".format(number)
+        region = Region.objects.create(country=spain, code=code)
+        province = Province.objects.create(region=region, code=code)
+        for lang in settings.LANGUAGES_DATABASES:
+            geoname_model("Region", lang).objects.create(
+                region=region, name="Zeta"
+            )
+            geoname_model("Province", lang).objects.create(
+                province=province, name="Zeta"
+            )
+        regions.append(region.pk)
+    return regions
+
+
+class LoaderMixin(object):
+    loader = None
+
+    def test_insert(self):
+        get_loader(self.loader).insert(
+            TimeZone, ["name"], [("Europe/Madrid",), ("Europe/Lisbon",)]
+        )
+        self.assertEqual(
+            sorted(TimeZone.objects.values_list("name", flat=True)),
+            ["Europe/Lisbon", "Europe/Madrid"],
+        )
+        self.assertFalse(
+            TimeZone.objects.filter(created__isnull=True).exists()
+        )
+        self.assertFalse(
+            TimeZone.objects.filter(updated__isnull=True).exists()
+        )
+
+    def test_insert_foreign_keys(self):
+        continent = Continent.objects.create(code="EU")
+        get_loader(self.loader).insert(
+            ContinentGeoNameEN,
+            ["continent_id", "name", "search_key"],
+            [(continent.pk, "Europe", "europe")],
+        )
+        self.assertEqual(continent.en.name, "Europe")
+        self.assertEqual(continent.en.search_key, "europe")
+
+    def test_update(self):
+        madrid = TimeZone.objects.create(name="Europe/Madrid")
+        lisbon = TimeZone.objects.create(name="Europe/Lisbon")
+        get_loader(self.loader).update(
+            TimeZone, ["id", "name"], [(madrid.pk, "Atlantic/Canary")]
+        )
+        madrid.refresh_from_db()
+        self.assertEqual(madrid.name, "Atlantic/Canary")
+        self.assertGreaterEqual(madrid.updated, madrid.created)
+        self.assertEqual(
+            TimeZone.objects.get(pk=lisbon.pk).name, "Europe/Lisbon"
+        )
+
+
+class OrmLoaderTests(LoaderMixin, TestCase):
+    loader = "orm"
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite only")
+class SQLiteLoaderTests(LoaderMixin, TestCase):
+    loader = "sqlite"
+
+
+@skipUnless(connection.vendor == "postgresql", "PostgreSQL only")
+class PostgreSQLLoaderTests(LoaderMixin, TestCase):
+    loader = "postgresql"
+
+
+class GetLoaderTests(TestCase):
+    def test_auto(self):
+        native = {
+            "sqlite": SQLiteLoader,
+            "postgresql": PostgreSQLLoader,
+        }.get(connection.vendor, OrmLoader)
+        loader = get_loader()
+        self.assertIs(type(loader), native)
+        self.assertEqual(get_loader(batch_size=10).batch_size, 10)
+
+    def test_orm(self):
+        self.assertIs(type(get_loader("orm")), OrmLoader)
+
+    def test_other_vendor(self):
+        for name, loader in LOADERS.items():
+            if loader.vendor in (None, connection.vendor):
+                self.assertIs(type(get_loader(name)), loader)
+            else:
+                with self.assertRaises(ValueError):
+                    get_loader(name)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_loader("oracle")
+
+
+class PopulateMixin(object):
+    """Location files written once for every test of the class"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.source = tempfile.mkdtemp()
+        for lang in settings.LANGUAGES_DATABASES:
+            write_locations(cls.source, lang)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.source)
+        super().tearDownClass()
+
+    def call(self, *args, source=None):
+        with redirect_stdout(StringIO()):
+            call_command(
+                "populate_geodata", "--source", source or self.source, *args
+            )
+
+
+class PopulateLoaderTests(PopulateMixin, TestCase):
+    def populate(self, loader):
+        self.call("--bulk", "--loader", loader)
+        return stored_rows()
+
+    def clear(self):
+        for model in reversed(snapshot_models()):
+            model.objects.all().delete()
+
+    def test_populate(self):
+        rows = self.populate("orm")
+        self.assertEqual(len(rows["continent"]), 2)
+        self.assertEqual(len(rows["country"]), 4)
+        self.assertEqual(len(rows["city"]), 6)
+        self.assertEqual(len(rows["timezone"]), 3)
+        porto = City.objects.get(pk=2735943)
+        self.assertIsNone(porto.region_id)
+        self.assertEqual(porto.country.code, "PT")
+        if "ES" in settings.LANGUAGES_DATABASES:
+            self.assertEqual(Country.objects.get(code="ES").es.name, "España")
+
+    @skipUnless(connection.vendor in LOADERS, "No native loader")
+    def test_native_and_orm(self):
+        native = self.populate(connection.vendor)
+        self.clear()
+        self.assertEqual(self.populate("orm"), native)
+
+
+class NamesMixin(object):
+    """A continent with a country named in every language"""
+
+    def setUp(self):
+        self.europe = Continent.objects.create(code="EU")
+        self.spain = Country.objects.create(
+            pk=2510769, code="ES", continent=self.europe
+        )
+        for lang in settings.LANGUAGES_DATABASES:
+            geoname_model("Country", lang).objects.create(
+                country=self.spain, name=translate("Spain", lang)
+            )
+
+
+@override_settings(CDNX_GEODATA_CONSOLIDATED_NAMES=True)
+class TranslationTests(NamesMixin, TestCase):
+    def translations(self):
+        return GeoTranslation.objects.filter(
+            entity="country", object_id=self.spain.pk
+        )
+
+    def test_save(self):
+        self.assertEqual(
+            self.translations().count(), len(settings.LANGUAGES_DATABASES)
+        )
+        lang = settings.LANGUAGES_DATABASES[0]
+        name = geoname_model("Country", lang).objects.get(country=self.spain)
+        name.name = "Reino de España"
+        name.save()
+        self.assertEqual(
+            self.translations().get(lang=lang.lower()).search_key,
+            "reino de espana",
+        )
+
+    def test_delete(self):
+        lang = settings.LANGUAGES_DATABASES[0]
+        geoname_model("Country", lang).objects.get(country=self.spain).delete()
+        self.assertFalse(self.translations().filter(lang=lang.lower()))
+        self.assertEqual(
+            self.translations().count(),
+            len(settings.LANGUAGES_DATABASES) - 1,
+        )
+
+    def test_queryset_delete(self):
+        for lang in settings.LANGUAGES_DATABASES:
+            geoname_model("Country", lang).objects.all().delete()
+        self.assertFalse(self.translations().exists())
+
+    def test_cascade(self):
+        Continent.objects.filter(pk=self.europe.pk).delete()
+        self.assertFalse(self.translations().exists())
+
+
+@skipUnless(connection.vendor != "postgresql", "Indexed by pg_trgm")
+@override_settings(CDNX_GEODATA_TRIGRAM_SEARCH=True)
+class TrigramTests(NamesMixin, TestCase):
+    def trigrams(self):
+        return set(
+            GeoTrigram.objects.filter(
+                entity="country", object_id=self.spain.pk
+            ).values_list("trigram", flat=True)
+        )
+
+    def test_save(self):
+        self.assertIn("spa", self.trigrams())
+        lang = settings.LANGUAGES_DATABASES[0]
+        for name in geoname_model("Country", lang).objects.all():
+            name.name = "Castilla"
+            name.save()
+        self.assertIn("cas", self.trigrams())
+
+    def test_delete(self):
+        for lang in settings.LANGUAGES_DATABASES[1:]:
+            geoname_model("Country", lang).objects.get(
+                country=self.spain
+            ).delete()
+        lang = settings.LANGUAGES_DATABASES[0]
+        self.assertEqual(
+            self.trigrams(),
+            trigrams(search_key(translate("Spain", lang))),
+        )
+
+    def test_cascade(self):
+        Continent.objects.filter(pk=self.europe.pk).delete()
+        self.assertFalse(self.trigrams())
+
+
+class SubdivisionTests(PopulateMixin, TestCase):
+    """Almería moves to a new region while Andalusia keeps Málaga, the new
+    region used to take the id of the city, Andalusia's id"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cities = [
+            (
+                ("2521978", 0, "XX", "Eastern Andalusia") + city[4:]
+                if city[0] == "2521978"
+                else city
+            )
+            for city in CITIES
+        ]
+        cls.moved = tempfile.mkdtemp()
+        for lang in settings.LANGUAGES_DATABASES:
+            write_locations(cls.moved, lang, cities)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.moved)
+        super().tearDownClass()
+
+    def reimport(self, *args):
+        self.call(*args)
+        andalusia = Region.objects.get(country__code="ES", code="AN")
+        self.call(*args, source=self.moved)
+        self.assertEqual(Region.objects.get(pk=andalusia.pk).code, "AN")
+        return andalusia
+
+    def test_bulk(self):
+        andalusia = self.reimport("--bulk")
+        eastern = Region.objects.get(country__code="ES", code="XX")
+        self.assertNotEqual(eastern.pk, andalusia.pk)
+        almeria = City.objects.get(pk=2521978)
+        self.assertEqual(almeria.region_id, eastern.pk)
+        self.assertEqual(almeria.province.region_id, eastern.pk)
+        self.assertEqual(
+            list(andalusia.cities.values_list("pk", flat=True)), [2514256]
+        )
+
+    def test_rows(self):
+        # Row mode only inserts, Almería stays in Andalusia and the new
+        # region is removed as an orphan
+        andalusia = self.reimport()
+        self.assertEqual(andalusia.cities.count(), 2)
+        self.assertFalse(Region.objects.filter(code="XX").exists())
+
+
+@override_settings(
+    CDNX_GEODATA_CONSOLIDATED_NAMES=True, CDNX_GEODATA_TRIGRAM_SEARCH=True
+)
+class OrphanTests(PopulateMixin, TestCase):
+    def setUp(self):
+        self.call("--bulk")
+
+    def remove_orphans(self):
+        with redirect_stdout(StringIO()):
+            command = Command()
+            command.set_name("CODENERIX-GEODATA")
+            command.set_debug()
+            with CaptureQueriesContext(connection) as queries:
+                removed = command.remove_orphans()
+        return removed, len(queries)
+
+    def test_queries(self):
+        # A region, its province and their names
+        rows = 2 + 2 * len(settings.LANGUAGES_DATABASES)
+        add_orphans(1)
+        removed, queries = self.remove_orphans()
+        self.assertEqual(removed, rows)
+        add_orphans(5)
+        self.assertEqual(self.remove_orphans(), (5 * rows, queries))
+
+    def test_names(self):
+        regions = add_orphans(2)
+        self.call("--bulk")
+        self.assertFalse(Region.objects.filter(pk__in=regions).exists())
+        self.assertFalse(
+            GeoTranslation.objects.filter(
+                entity="region", object_id__in=regions
+            ).exists()
+        )
+        self.assertFalse(
+            GeoTrigram.objects.filter(
+                entity="region", object_id__in=regions
+            ).exists()
+        )
+
+
+@skipUnless(connection.vendor in SHADOW_TABLES, "No shadow tables")
+@override_settings(
+    CDNX_GEODATA_CONSOLIDATED_NAMES=True, CDNX_GEODATA_TRIGRAM_SEARCH=True
+)
+class ShadowTests(PopulateMixin, TransactionTestCase):
+    """The second import adds Seville and removes a region without cities"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        seville = ("2510911", 0, "AN", "Andalusia", "SE", "Sevilla")
+        cls.extended = tempfile.mkdtemp()
+        for lang in settings.LANGUAGES_DATABASES:
+            write_locations(
+                cls.extended, lang, CITIES + [seville + ("Seville", "")]
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.extended)
+        super().tearDownClass()
+
+    def names(self):
+        return (
+            set(GeoTranslation.objects.values_list("entity", "object_id")),
+            set(GeoTrigram.objects.values_list("entity", "object_id")),
+        )
+
+    def setUp(self):
+        self.call()
+        self.orphan = add_orphans(1)[0]
+
+    def test_swap(self):
+        self.call("--shadow", source=self.extended)
+        for names in self.names():
+            self.assertIn(("city", 2510911), names)
+            self.assertNotIn(("region", self.orphan), names)
+
+    def test_failed_swap(self):
+        names = self.names()
+        with mock.patch.object(
+            SHADOW_TABLES[connection.vendor],
+            "swap",
+            side_effect=RuntimeError("swap"),
+        ):
+            with self.assertRaises(RuntimeError):
+                self.call("--shadow", source=self.extended)
+        self.assertFalse(City.objects.filter(pk=2510911).exists())
+        self.assertEqual(self.names(), names)
+
+
+class DiffTests(PopulateMixin, TestCase):
+    def diff(self, *args):
+        report = join(self.source, "report.json")
+        self.call("--diff", "--report", report, *args)
+        with open(report) as stream:
+            return dict(
+                ((entry["entity"], entry["language"]), entry)
+                for entry in json.load(stream)["diff"]
+            )
+
+    def test_scoped(self):
+        self.call("--bulk")
+        City.objects.filter(pk=2735943).delete()
+        for entry in self.diff("--countries", "ES").values():
+            self.assertEqual(
+                (entry["insert"], entry["update"], entry["delete"]),
+                (0, 0, 0),
+                entry,
+            )
+        found = self.diff("--countries", "PT")
+        self.assertEqual(found[("city", None)]["insert"], 1)
+        # Cities, names and time zones out of scope are not deletions
+        self.assertFalse(any(entry["delete"] for entry in found.values()))
+
+    def test_unscoped(self):
+        self.call("--bulk")
+        City.objects.filter(pk=2735943).delete()
+        TimeZone.objects.create(name="Atlantic/Canary")
+        found = self.diff()
+        self.assertEqual(found[("city", None)]["insert"], 1)
+        self.assertEqual(found[("timezone", None)]["delete"], 0)
+
+
+class ReportTests(PopulateMixin, TestCase):
+    def test_failed(self):
+        report = join(self.source, "failed.json")
+        missing = join(self.source, "missing.zip")
+        with self.assertRaisesMessage(CommandError, missing):
+            self.call("--report", report, source=missing)
+        with open(report) as stream:
+            document = json.load(stream)
+        self.assertEqual(document["status"], "failed")
+        self.assertEqual(document["languages"], [])
+        self.assertEqual(document["rows"], 0)
+
+    def test_nested(self):
+        command = Command()
+        command.languages = []
+        command.phases = []
+        command.depth = 0
+        command.differences = None
+        with command.phase("shard", "city", rows=2):
+            with command.phase("link", "city", rows=2):
+                City.objects.count()
+        with command.phase("cleanup", "orphans"):
+            pass
+        self.assertEqual(
+            [stats["nested"] for stats in command.phases], [True, False, False]
+        )
+        report = join(self.source, "nested.json")
+        command.write_report(report, defaultdict(list), "done", 0)
+        with open(report) as stream:
+            document = json.load(stream)
+        self.assertEqual(document["rows"], 2)
+        self.assertEqual(document["queries"], 1)
+
+
+class ListTests(PopulateMixin, TestCase):
+    def setUp(self):
+        self.call("--bulk")
+
+    def rows(self, view, lang):
+        request = RequestFactory().get(
+            "/", {"json": "{}"}, HTTP_X_REQUESTED_WITH="XMLHttpRequest"
+        )
+        request.user = AnonymousUser()
+        request.session = {}
+        request.LANGUAGE_CODE = lang
+        response = view.as_view()(request)
+        return json.loads(response.content)["table"]["body"]
+
+    def test_queries(self):
+        lang = settings.LANGUAGES[0][0]
+        for view in (
+            views.ContinentList,
+            views.CountryList,
+            views.RegionList,
+            views.ProvinceList,
+            views.CityList,
+        ):
+            # The count of the rows and the page, whatever its size
+            with self.assertNumQueries(2):
+                rows = self.rows(view, lang)
+            self.assertTrue(rows)
+        name = "{}__name".format(lang)
+        lisbon = [row for row in rows if row["pk"] == 2267057][0]
+        self.assertEqual(lisbon[name], translate("Lisbon", lang.upper()))
+        self.assertEqual(lisbon["country__" + name], "Portugal")
+        self.assertIsNone(lisbon["province__" + name])
+
+    def test_empty_name(self):
+        languages = [lang.lower() for lang in settings.LANGUAGES_DATABASES]
+        if len(languages) < 2:
+            self.skipTest("Only one language")
+        lang, fallback = languages[:2]
+        geoname_model("City", lang).objects.filter(city=2267057).update(
+            name=""
+        )
+        with self.assertNumQueries(1):
+            lisbon = City.objects.with_names(lang, [fallback]).get(pk=2267057)
+            self.assertEqual(str(lisbon), "Lisbon")
+            self.assertEqual(str(lisbon.country), "Portugal")
+
+
+class LongIndexes(SQLiteDeferredIndexes):
+    """The first index gets a create statement too long to be stored"""
+
+    def statements(self, cursor):
+        statements = super().statements(cursor)
+        drop, create = statements[0]
+        return [(drop, create + " " * 255)] + statements[1:]
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite indexes")
+class DeferredIndexesTests(TransactionTestCase):
+    def indexes(self, deferred):
+        with connection.cursor() as cursor:
+            return [drop for drop, _ in deferred.statements(cursor)]
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            DeferredIndexes(snapshot_models())
+
+    def test_too_long(self):
+        deferred = LongIndexes(snapshot_models())
+        indexes = self.indexes(deferred)
+        deferred.defer()
+        try:
+            self.assertEqual(deferred.skipped, indexes[:1])
+            self.assertEqual(self.indexes(deferred), indexes[:1])
+        finally:
+            self.assertEqual(deferred.restore(), len(indexes) - 1)
+        self.assertEqual(self.indexes(deferred), indexes)
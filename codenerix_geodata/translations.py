@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Names of every entity in every language consolidated in one table.
+
+The <Model>GeoName<LANG> tables stay the source of the names. With
+CDNX_GEODATA_CONSOLIDATED_NAMES enabled they are also copied to
+GeoTranslation (entity, object_id, lang, name): saving or deleting a name
+through the ORM updates its copy (see connect(), deletes cascading from an
+entity or made by a queryset included), populate_geodata and
+load_geodata_snapshot rebuild the whole table once their bulk writes are
+done. A name in any language is
+then matched with one lookup on the (entity, search_key) index instead of
+one LEFT JOIN per language.
+
+Names are searched by their search_key (see models.search_key), so "malaga"
+finds "Málaga" and a prefix search is a range scan of an index.
+"""
+
+import operator
+import threading
+from contextlib import contextmanager
+from functools import reduce
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+
+from codenerix_geodata.models import (
+    MODELS,
+    GeoTranslation,
+    consolidated_names,
+    search_key,
+)
+
+
+def rebuild_translations():
+    """Copy every name of the GeoName tables to GeoTranslation, return how
+    many were copied"""
+    quote = connection.ops.quote_name
+    table = quote(GeoTranslation._meta.db_table)
+    total = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Without the per row delete signals of QuerySet.delete()
+        cursor.execute("DELETE FROM {}".format(table))
+        for field, model in MODELS:
+            for lang in settings.LANGUAGES_DATABASES:
+                source = apps.get_model(
+                    "codenerix_geodata", "{}GeoName{}".format(model, lang)
+                )
+                cursor.execute(
+                    "INSERT INTO {} (created, updated, entity, object_id, "
+                    "lang, name, search_key) SELECT created, updated, %s, "
+                    "{}, %s, name, search_key FROM {}".format(
+                        table,
+                        quote("{}_id".format(field)),
+                        quote(source._meta.db_table),
+                    ),
+                    [field, lang.lower()],
+                )
+                total += cursor.rowcount
+    return total
+
+
+_local = threading.local()
+
+
+@contextmanager
+def suspended():
+    """Do not copy the names saved or deleted inside, for bulk changes
+    rebuilding the whole table with rebuild_translations() afterwards"""
+    _local.suspended = getattr(_local, "suspended", 0) + 1
+    try:
+        yield
+    finally:
+        _local.suspended -= 1
+
+
+def name_saved(sender, instance, **kwargs):
+    if not consolidated_names() or getattr(_local, "suspended", 0):
+        return
+    GeoTranslation.objects.update_or_create(
+        entity=sender.geo_entity,
+        object_id=getattr(instance, "{}_id".format(sender.geo_entity)),
+        lang=sender.geo_lang,
+        defaults={"name": instance.name, "search_key": instance.search_key},
+    )
+
+
+def name_deleted(sender, instance, **kwargs):
+    if not consolidated_names() or getattr(_local, "suspended", 0):
+        return
+    GeoTranslation.objects.filter(
+        entity=sender.geo_entity,
+        object_id=getattr(instance, "{}_id".format(sender.geo_entity)),
+        lang=sender.geo_lang,
+    ).delete()
+
+
+def connect():
+    """Keep GeoTranslation in step with every name saved or deleted"""
+    for field, model in MODELS:
+        for lang in settings.LANGUAGES_DATABASES:
+            sender = apps.get_model(
+                "codenerix_geodata", "{}GeoName{}".format(model, lang)
+            )
+            dispatch_uid = "geodata_translation_{}".format(
+                sender._meta.model_name
+            )
+            post_save.connect(
+                name_saved, sender=sender, dispatch_uid=dispatch_uid
+            )
+            post_delete.connect(
+                name_deleted, sender=sender, dispatch_uid=dispatch_uid
+            )
+
+
+def search_q(field, lookup, value):
+    """Return a Q matching the rows whose search key "field" starts with or
+    contains (lookup "startswith" or "contains") the key of "value" """
+    key = search_key(value)
+    if lookup == "startswith" and connection.vendor == "sqlite":
+        # SQLite only uses an index for LIKE with case_sensitive_like on, a
+        # range of the binary collation selects the same rows
+        return Q(
+            **{
+                "{}__gte".format(field): key,
+                "{}__lt".format(field): key + "\U0010ffff",
+            }
+        )
+    return Q(**{"{}__{}".format(field, lookup): key})
+
+
+def any_name_q(entity, lookup, value, path=""):
+    """Return a Q matching the rows whose "entity", reached through the
+    "path" prefix ("country__" for example), has a name in any language
+    whose search key starts with or contains (lookup "startswith" or
+    "contains") the key of "value" """
+    if consolidated_names():
+        return Q(
+            **{
+                "{}pk__in".format(path): GeoTranslation.objects.filter(
+                    search_q("search_key", lookup, value), entity=entity
+                ).values("object_id")
+            }
+        )
+    # One subquery per language, each one a lookup on the search_key index
+    # of its table where a LEFT JOIN per language would scan every row
+    return reduce(
+        operator.or_,
+        [
+            Q(
+                **{
+                    "{}pk__in".format(path): apps.get_model(
+                        "codenerix_geodata",
+                        "{}GeoName{}".format(entity.capitalize(), lang),
+                    )
+                    .objects.filter(search_q("search_key", lookup, value))
+                    .values("{}_id".format(entity))
+                }
+            )
+            for lang in settings.LANGUAGES_DATABASES
+        ],
+    )
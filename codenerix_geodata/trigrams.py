@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# django-codenerix-geodata
+#
+# Codenerix GNU
+#
+# Project URL : http://www.codenerix.com
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Trigram index of the names for substring searches.
+
+A B-tree index can not find the names containing a text, without one every
+keystroke of a list search reads every name. With
+CDNX_GEODATA_TRIGRAM_SEARCH enabled substring searches use, depending on
+the database:
+
+    pg_trgm     PostgreSQL, a GIN index with gin_trgm_ops on the search_key
+                of every <Model>GeoName<LANG> table, LIKE '%text%' uses it
+                as it is (index_trigrams() creates them)
+    table       any other database, GeoTrigram holds every trigram of the
+                search keys of every entity: the entities having all the
+                trigrams of the text are looked up first and only their
+                names are compared with it (rebuild_trigrams() fills it,
+                connect() keeps it in step with the names saved or
+                deleted through the ORM)
+
+Texts shorter than a trigram are compared with every name.
+"""
+
+import operator
+import threading
+from contextlib import contextmanager
+from functools import reduce
+from itertools import groupby
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+
+from codenerix_geodata.loaders import get_loader
+from codenerix_geodata.models import (
+    MODELS,
+    GeoTrigram,
+    search_key,
+    trigram_index,
+    trigrams,
+)
+from codenerix_geodata.translations import any_name_q, search_q
+
+BATCH_SIZE = 10000
+
+
+def geoname_models(model):
+    return [
+        apps.get_model("codenerix_geodata", "{}GeoName{}".format(model, lang))
+        for lang in settings.LANGUAGES_DATABASES
+    ]
+
+
+def index_trigrams():
+    """Create pg_trgm and the GIN index of every <Model>GeoName<LANG>
+    table missing it, PostgreSQL only"""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for field, model in MODELS:
+            for source in geoname_models(model):
+                table = source._meta.db_table
+                cursor.execute(
+                    "CREATE INDEX IF NOT EXISTS {} ON {} USING gin "
+                    "(search_key gin_trgm_ops)".format(
+                        quote("{}_trgm".format(table)), quote(table)
+                    )
+                )
+
+
+def rebuild_trigrams():
+    """Index again the trigrams of every name in GeoTrigram, return how many
+    were written"""
+    quote = connection.ops.quote_name
+    loader = get_loader(batch_size=BATCH_SIZE)
+    total = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Without the per row delete signals of QuerySet.delete()
+        cursor.execute(
+            "DELETE FROM {}".format(quote(GeoTrigram._meta.db_table))
+        )
+        for field, model in MODELS:
+            # The names of an entity in every language, one after another
+            cursor.execute(
+                " UNION ALL ".join(
+                    "SELECT {}, search_key FROM {}".format(
+                        quote("{}_id".format(field)),
+                        quote(source._meta.db_table),
+                    )
+                    for source in geoname_models(model)
+                )
+                + " ORDER BY 1"
+            )
+            rows = []
+            for object_id, names in groupby(
+                cursor.fetchall(), key=operator.itemgetter(0)
+            ):
+                found = set()
+                for _, key in names:
+                    found.update(trigrams(key))
+                rows.extend((field, object_id, trigram) for trigram in found)
+                if len(rows) >= BATCH_SIZE:
+                    loader.insert(
+                        GeoTrigram, ["entity", "object_id", "trigram"], rows
+                    )
+                    total += len(rows)
+                    rows = []
+            if rows:
+                loader.insert(
+                    GeoTrigram, ["entity", "object_id", "trigram"], rows
+                )
+                total += len(rows)
+    return total
+
+
+_local = threading.local()
+
+
+@contextmanager
+def suspended():
+    """Do not index the names saved or deleted inside, for bulk changes
+    rebuilding the whole table with rebuild_trigrams() afterwards"""
+    _local.suspended = getattr(_local, "suspended", 0) + 1
+    try:
+        yield
+    finally:
+        _local.suspended -= 1
+
+
+def name_changed(sender, instance, **kwargs):
+    if trigram_index() != "table" or getattr(_local, "suspended", 0):
+        return
+    GeoTrigram.objects.refresh(
+        sender.geo_entity,
+        getattr(instance, "{}_id".format(sender.geo_entity)),
+    )
+
+
+def connect():
+    """Index again the trigrams of an entity whenever one of its names is
+    saved or deleted"""
+    for field, model in MODELS:
+        for sender in geoname_models(model):
+            dispatch_uid = "geodata_trigram_{}".format(sender._meta.model_name)
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    name_changed, sender=sender, dispatch_uid=dispatch_uid
+                )
+
+
+def contains_q(entity, value, path="", lang=None):
+    """Return a Q matching the rows whose "entity", reached through the
+    "path" prefix ("country__" for example), has a name in "lang" (in any
+    language when None) whose search key contains the key of "value" """
+    if trigram_index() == "table":
+        found = trigrams(search_key(value))
+    else:
+        found = set()
+    if lang:
+        match = search_q(
+            "{}{}__search_key".format(path, lang), "contains", value
+        )
+    elif found:
+        # Only compared on the rows having every trigram
+        match = reduce(
+            operator.or_,
+            [
+                search_q(
+                    "{}{}__search_key".format(path, lang_code.lower()),
+                    "contains",
+                    value,
+                )
+                for lang_code in settings.LANGUAGES_DATABASES
+            ],
+        )
+    else:
+        return any_name_q(entity, "contains", value, path)
+
+    if not found:
+        return match
+    return (
+        reduce(
+            operator.and_,
+            [
+                Q(
+                    **{
+                        "{}pk__in".format(path): GeoTrigram.objects.filter(
+                            entity=entity, trigram=trigram
+                        ).values("object_id")
+                    }
+                )
+                for trigram in sorted(found)
+            ],
+        )
+        & match
+    )
@@ -19,8 +19,6 @@
 # limitations under the License.
 
 import ast
-import operator
-from functools import reduce
 
 from django.db.models import Q
 from django.conf import settings
@@ -39,6 +37,7 @@ from codenerix.views import (
 )
 
 from .models import (
+    geo_name_alias,
     Continent,
     Country,
     Region,
@@ -55,6 +54,8 @@ from .forms import (
     TimeZoneForm,
     CityForm,
 )
+from .translations import any_name_q
+from .trigrams import contains_q
 
 
 # forms for multiforms
@@ -87,6 +88,22 @@ class TranslatedMixin(object):
                     return self.request.LANGUAGE_CODE.lower()
         return settings.LANGUAGES[0][0].lower()
 
+    def name_field(self, path=""):
+        """
+        Column of the name of the row, or of its "path" parent, read from
+        the annotation of with_names() under the usual lookup as its alias
+        """
+        lookup = "{}__name".format(self.lang)
+        if path:
+            lookup = "{}__{}".format(path, lookup)
+        return "{}:{}".format(lookup, geo_name_alias(path))
+
+    @property
+    def queryset(self):
+        # One query for the whole page, names of the parents included. Set
+        # before codenerix filters and orders it, to order by the names
+        return self.model.objects.with_names(self.lang)
+
 
 # ###########################################
 # Continent
@@ -103,23 +120,18 @@ class ContinentList(TranslatedMixin, GenContinentUrl, GenList):
     def __fields__(self, info):
         fields = self.model().__fields__(info)
         fields.append(
-            ("{}__name".format(self.lang), _("Name")),
+            (self.name_field(), _("Name")),
         )
         return fields
 
     def __searchQ__(self, info, text):
         filters = self.model().__searchQ__(info, text)
-        filters["name"] = Q(**{"{}__name__icontains".format(self.lang): text})
+        filters["name"] = contains_q("continent", text, lang=self.lang)
         return filters
 
     def __searchF__(self, info):
         def f(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(**{"{}__name__icontains".format(lang.lower()): x})
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("continent", x)
 
         filters = self.model().__searchF__(info)
         filters["{}__name".format(self.lang)] = (_("Name"), f, "input")
@@ -182,42 +194,26 @@ class CountryList(TranslatedMixin, GenCountryUrl, GenList):
     def __fields__(self, info):
         return [
             ("code", _("Code")),
-            ("{}__name".format(self.lang), _("Name")),
+            (self.name_field(), _("Name")),
             ("continent__code", _("Code continent")),
-            ("continent__{}__name".format(self.lang), _("Name continent")),
+            (self.name_field("continent"), _("Name continent")),
         ]
 
     def __searchQ__(self, info, text):
         filters = self.model().__searchQ__(info, text)
-        filters["name"] = Q(**{"{}__name__icontains".format(self.lang): text})
+        filters["name"] = contains_q("country", text, lang=self.lang)
         filters["continent_code"] = Q(**{"continent__code": text})
-        filters["continent_name"] = Q(
-            **{"continent__{}__name__icontains".format(self.lang): text}
+        filters["continent_name"] = contains_q(
+            "continent", text, "continent__", self.lang
         )
         return filters
 
     def __searchF__(self, info):
         def f(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(**{"{}__name__icontains".format(lang.lower()): x})
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("country", x)
 
         def fc(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(
-                        **{
-                            "continent__{}__name__icontains".format(
-                                lang.lower()
-                            ): x
-                        }
-                    )
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("continent", x, "continent__")
 
         filters = self.model().__searchF__(info)
         filters["{}__name".format(self.lang)] = (_("Name"), f, "input")
@@ -269,12 +265,9 @@ class CountryForeign(TranslatedMixin, GenCountryUrl, GenForeignKey):
 
     def get_foreign(self, queryset, search, filters):
         # Filter with search string
-        qsobject = Q(code__istartswith=search)
-
-        for lang in settings.LANGUAGES_DATABASES:
-            qsobject |= Q(
-                **{"{}__name__istartswith".format(lang.lower()): search}
-            )
+        qsobject = Q(code__istartswith=search) | any_name_q(
+            "country", "startswith", search
+        )
         qs = queryset.filter(qsobject).order_by("{}__name".format(self.lang))
         return qs
 
@@ -310,69 +303,38 @@ class RegionList(TranslatedMixin, GenRegionUrl, GenList):
     def __fields__(self, info):
         return [
             ("code", _("Code")),
-            ("{}__name".format(self.lang), _("Name")),
+            (self.name_field(), _("Name")),
             ("country__code", _("Code country")),
-            ("country__{}__name".format(self.lang), _("Name country")),
+            (self.name_field("country"), _("Name country")),
             ("country__continent__code", _("Code continent")),
             (
-                "country__continent__{}__name".format(self.lang),
+                self.name_field("country__continent"),
                 _("Name continent"),
             ),
         ]
 
     def __searchQ__(self, info, text):
         filters = self.model().__searchQ__(info, text)
-        filters["name"] = Q(**{"{}__name__icontains".format(self.lang): text})
+        filters["name"] = contains_q("region", text, lang=self.lang)
         filters["country_code"] = Q(**{"country__code": text})
-        filters["country_name"] = Q(
-            **{"country__{}__name__icontains".format(self.lang): text}
+        filters["country_name"] = contains_q(
+            "country", text, "country__", self.lang
         )
         filters["continent_code"] = Q(**{"country__continent__code": text})
-        filters["continent_name"] = Q(
-            **{
-                "country__continent__{}__name__icontains".format(
-                    self.lang
-                ): text
-            }
+        filters["continent_name"] = contains_q(
+            "continent", text, "country__continent__", self.lang
         )
         return filters
 
     def __searchF__(self, info):
         def f(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(**{"{}__name__icontains".format(lang.lower()): x})
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("region", x)
 
         def fco(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(
-                        **{
-                            "country__continent__{}__name__icontains".format(
-                                lang.lower()
-                            ): x
-                        }
-                    )
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("continent", x, "country__continent__")
 
         def fcu(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(
-                        **{
-                            "country__{}__name__icontains".format(
-                                lang.lower()
-                            ): x
-                        }
-                    )
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("country", x, "country__")
 
         filters = self.model().__searchF__(info)
         filters["{}__name".format(self.lang)] = (_("Name"), f, "input")
@@ -436,12 +398,9 @@ class RegionForeign(TranslatedMixin, GenRegionUrl, GenForeignKey):
 
     def get_foreign(self, queryset, search, filters):
         # Filter with search string
-        qsobject = Q(code__istartswith=search)
-
-        for lang in settings.LANGUAGES_DATABASES:
-            qsobject |= Q(
-                **{"{}__name__istartswith".format(lang.lower()): search}
-            )
+        qsobject = Q(code__istartswith=search) | any_name_q(
+            "region", "startswith", search
+        )
         qs = queryset.filter(qsobject)
 
         country = filters.get("country", None)
@@ -487,91 +446,49 @@ class ProvinceList(TranslatedMixin, GenProvinceUrl, GenList):
     def __fields__(self, info):
         return [
             ("code", _("Code")),
-            ("{}__name".format(self.lang), _("Name")),
+            (self.name_field(), _("Name")),
             ("region__code", _("Code region")),
-            ("region__{}__name".format(self.lang), _("Name region")),
+            (self.name_field("region"), _("Name region")),
             ("region__country__code", _("Code country")),
-            ("region__country__{}__name".format(self.lang), _("Name country")),
+            (self.name_field("region__country"), _("Name country")),
             ("region__country__continent__code", _("Code continent")),
             (
-                "region__country__continent__{}__name".format(self.lang),
+                self.name_field("region__country__continent"),
                 _("Name continent"),
             ),
         ]
 
     def __searchQ__(self, info, text):
         filters = self.model().__searchQ__(info, text)
-        filters["name"] = Q(**{"{}__name__icontains".format(self.lang): text})
+        filters["name"] = contains_q("province", text, lang=self.lang)
         filters["region_code"] = Q(**{"region__code": text})
-        filters["region_name"] = Q(
-            **{"region__{}__name__icontains".format(self.lang): text}
+        filters["region_name"] = contains_q(
+            "region", text, "region__", self.lang
         )
         filters["country_code"] = Q(**{"region__country__code": text})
-        filters["country_name"] = Q(
-            **{"region__country__{}__name__icontains".format(self.lang): text}
+        filters["country_name"] = contains_q(
+            "country", text, "region__country__", self.lang
         )
         filters["continent_code"] = Q(
             **{"region__country__continent__code": text}
         )
-        filters["continent_name"] = Q(
-            **{
-                "region__country__continent__{}__name__icontains".format(
-                    self.lang
-                ): text
-            }
+        filters["continent_name"] = contains_q(
+            "continent", text, "region__country__continent__", self.lang
         )
         return filters
 
     def __searchF__(self, info):
         def f(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(**{"{}__name__icontains".format(lang.lower()): x})
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("province", x)
 
         def fr(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(
-                        **{
-                            "region__{}__name__icontains".format(
-                                lang.lower()
-                            ): x
-                        }
-                    )
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("region", x, "region__")
 
         def fco(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(
-                        **{
-                            "region__country__continent__{}__name__icontains".format(
-                                lang.lower()
-                            ): x
-                        }
-                    )
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("continent", x, "region__country__continent__")
 
         def fcu(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(
-                        **{
-                            "region__country__{}__name__icontains".format(
-                                lang.lower()
-                            ): x
-                        }
-                    )
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("country", x, "region__country__")
 
         filters = self.model().__searchF__(info)
         filters["{}__name".format(self.lang)] = (_("Name"), f, "input")
@@ -646,12 +563,9 @@ class ProvinceForeign(TranslatedMixin, GenProvinceUrl, GenForeignKey):
 
     def get_foreign(self, queryset, search, filters):
         # Filter with search string
-        qsobject = Q(code__istartswith=search)
-
-        for lang in settings.LANGUAGES_DATABASES:
-            qsobject |= Q(
-                **{"{}__name__istartswith".format(lang.lower()): search}
-            )
+        qsobject = Q(code__istartswith=search) | any_name_q(
+            "province", "startswith", search
+        )
         qs = queryset.filter(qsobject)
 
         region = filters.get("region", None)
@@ -744,90 +658,48 @@ class CityList(TranslatedMixin, GenCityUrl, GenList):
 
     def __fields__(self, info):
         return [
-            ("{}__name".format(self.lang), _("Name")),
+            (self.name_field(), _("Name")),
             ("time_zone", _("Time Zone")),
             ("province__code".format(self.lang), _("Code province")),
-            ("province__{}__name".format(self.lang), _("Province")),
+            (self.name_field("province"), _("Province")),
             ("country__code".format(self.lang), _("Code country")),
-            ("country__{}__name".format(self.lang), _("Country")),
+            (self.name_field("country"), _("Country")),
             ("country__continent__code", _("Code continent")),
             (
-                "country__continent__{}__name".format(self.lang),
+                self.name_field("country__continent"),
                 _("Name continent"),
             ),
         ]
 
     def __searchQ__(self, info, text):
         filters = self.model().__searchQ__(info, text)
-        filters["name"] = Q(**{"{}__name__icontains".format(self.lang): text})
+        filters["name"] = contains_q("city", text, lang=self.lang)
         filters["province_code"] = Q(**{"province__code": text})
-        filters["province_name"] = Q(
-            **{"province__{}__name__icontains".format(self.lang): text}
+        filters["province_name"] = contains_q(
+            "province", text, "province__", self.lang
         )
         filters["country_code"] = Q(**{"country__code": text})
-        filters["country_name"] = Q(
-            **{"country__{}__name__icontains".format(self.lang): text}
+        filters["country_name"] = contains_q(
+            "country", text, "country__", self.lang
         )
         filters["continent_code"] = Q(**{"country__continent__code": text})
-        filters["continent_name"] = Q(
-            **{
-                "country__continent__{}__name__icontains".format(
-                    self.lang
-                ): text
-            }
+        filters["continent_name"] = contains_q(
+            "continent", text, "country__continent__", self.lang
         )
         return filters
 
     def __searchF__(self, info):
         def f(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(**{"{}__name__icontains".format(lang.lower()): x})
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("city", x)
 
         def fp(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(
-                        **{
-                            "province__{}__name__icontains".format(
-                                lang.lower()
-                            ): x
-                        }
-                    )
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("province", x, "province__")
 
         def fco(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(
-                        **{
-                            "country__continent__{}__name__icontains".format(
-                                lang.lower()
-                            ): x
-                        }
-                    )
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("continent", x, "country__continent__")
 
         def fcu(x):
-            qsobject = []
-            for lang in settings.LANGUAGES_DATABASES:
-                qsobject.append(
-                    Q(
-                        **{
-                            "country__{}__name__icontains".format(
-                                lang.lower()
-                            ): x
-                        }
-                    )
-                )
-            return reduce(operator.or_, qsobject)
+            return contains_q("country", x, "country__")
 
         filters = self.model().__searchF__(info)
         filters["{}__name".format(self.lang)] = (_("Name"), f, "input")
@@ -866,6 +738,10 @@ class CityList(TranslatedMixin, GenCityUrl, GenList):
         )
         return filters
 
+    @property
+    def queryset(self):
+        return super(CityList, self).queryset.select_related("time_zone")
+
     def dispatch(self, request, *args, **kwargs):
         self.order_by = ["{}__name".format(self.lang)]
         return super(CityList, self).dispatch(request, *args, **kwargs)
@@ -902,13 +778,7 @@ class CityForeign(TranslatedMixin, GenCityUrl, GenForeignKey):
 
     def get_foreign(self, queryset, search, filters):
         # Filter with search string
-        qsobject = []
-        for lang in settings.LANGUAGES_DATABASES:
-            qsobject.append(
-                Q(**{"{}__name__istartswith".format(lang.lower()): search})
-            )
-        qs = queryset.filter(reduce(operator.or_, qsobject))
-        # qs = queryset.filter(qsobject)
+        qs = queryset.filter(any_name_q("city", "startswith", search))
 
         country = filters.get("country", None)
         if country:
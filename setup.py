@@ -52,4 +52,8 @@ setup(
         "django_codenerix>=5.0.69",
         "django_codenerix_extensions",
     ],
+    extras_require={
+        # populate_geodata reads .zst data files on Python < 3.14
+        "zstd": ["zstandard"],
+    },
 )